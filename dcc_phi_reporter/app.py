@@ -1,16 +1,38 @@
-import sys
-import zipfile
+import os
 import io
-import json
-import urllib
 import logging
+import itertools
+import threading
 
-from typing import List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple
 
-from tifffile import TiffFile
-import boto3
 from botocore.exceptions import ClientError
 
+try:
+    from . import (archive, checkpoint, chunkcache, chunking, dispatch, entities, jsonleaves,
+                   omexml, packing, prefilter, report, resultcache, sampling, sniff, streaming,
+                   tabular, tiffmeta)
+except ImportError:  # Lambda loads app.py as a top-level module
+    import archive
+    import checkpoint
+    import chunkcache
+    import chunking
+    import dispatch
+    import entities
+    import jsonleaves
+    import omexml
+    import packing
+    import prefilter
+    import report
+    import resultcache
+    import sampling
+    import sniff
+    import streaming
+    import tabular
+    import tiffmeta
+
 logger = logging.getLogger(__name__)
 logger.setLevel('INFO')
 
@@ -21,27 +43,154 @@ result_codes = {
 }
 
 BYTE_MAX = 5000
+# Bytes shared by consecutive detection windows
+WINDOW_OVERLAP = 250
+# Concurrent Comprehend calls per invocation
+COMPREHEND_WORKERS = 8
+# Tasks of one S3 Batch invocation processed at once
+TASK_WORKERS = 8
+# Local pre-screen ahead of Comprehend, one of prefilter.POLICIES
+PREFILTER_POLICY = os.environ.get('PREFILTER_POLICY', prefilter.OFF)
+# 'full' scans every byte, 'sample' spot-checks large .txt objects
+SCAN_MODE = os.environ.get('SCAN_MODE', 'full')
+# In sample mode, fully scan objects whose sample finds PHI
+SAMPLE_ESCALATE = os.environ.get('SAMPLE_ESCALATE', '').lower() in ('1', 'true', 'yes')
+# 'first' scans the first page's ImageDescription of TIFFs, 'all' every
+# text tag of every IFD (label/macro images, Artist, private tags)
+TIFF_SCAN = os.environ.get('TIFF_SCAN', 'first')
+# Scan result cache, 'sqlite://<path>' or 'dynamodb://<table>', off if unset
+RESULT_CACHE = os.environ.get('RESULT_CACHE')
+# Settings a cached result depends on, change to invalidate old entries
+CACHE_NAMESPACE = f'v1/{SCAN_MODE}/{TIFF_SCAN}/{PREFILTER_POLICY}/{BYTE_MAX}/{WINDOW_OVERLAP}'
+# Persistent tier for per-chunk entities, same url format as RESULT_CACHE
+CHUNK_CACHE = os.environ.get('CHUNK_CACHE')
+# 's3://bucket/prefix' for full-detail sidecars of each result, off if unset
+RESULTS_PREFIX = os.environ.get('RESULTS_PREFIX')
+# 's3://bucket/prefix' for progress of text scans that run out of time,
+# resumed when S3 Batch retries the task; off if unset
+CHECKPOINT_PREFIX = os.environ.get('CHECKPOINT_PREFIX')
+# Text objects up to this many bytes share Comprehend requests with the
+# other small objects of the invocation, 0 to send each on its own
+PACK_OBJECT_BYTES = int(os.environ.get('PACK_OBJECT_BYTES', '0'))
+
+# .txt objects larger than this are streamed instead of read whole
+STREAM_MIN_SIZE = 8 * 1024 * 1024
+# JSON objects larger than this are scanned as streamed text rather than
+# by path, e.g. multi-GB JSON Lines logs
+JSON_PATH_MAX_SIZE = 16 * 1024 * 1024
+
+# Archive members scanned as plain text
+TEXT_EXTENSIONS = ('.txt', '.xml', '.md', '.log')
+# Largest non-seekable archive member buffered in memory to read TIFF tags
+MAX_MEMBER_BUFFER = 64 * 1024 * 1024
+
+# S3 errors that retrying the task will not fix
+PERMANENT_ERROR_CODES = {'NoSuchKey', 'NoSuchBucket', 'AccessDenied', '403', '404'}
+
+# S3File block cache defaults
+BLOCK_SIZE = 64 * 1024
+READ_AHEAD_BLOCKS = 2
+MAX_CACHED_BLOCKS = 64
+
+# Pooled connections are kept alive and reused across warm invocations
+MAX_POOL_CONNECTIONS = TASK_WORKERS + COMPREHEND_WORKERS
+# Lambda timeout in seconds, keep in sync with Timeout in template.yaml
+FUNCTION_TIMEOUT = int(os.environ.get('FUNCTION_TIMEOUT', '30'))
+CONNECT_TIMEOUT = 3  # seconds
+# dispatch backs off on throttling itself, keep botocore's own retries short
+CLIENT_RETRIES = {'mode': 'standard', 'max_attempts': 2}
+# Every attempt of one call timing out must still end before the deadline margin
+READ_TIMEOUT = max(1.0, min(20.0, (FUNCTION_TIMEOUT - dispatch.DEADLINE_MARGIN_MS / 1000)
+                            / CLIENT_RETRIES['max_attempts'] - CONNECT_TIMEOUT))  # seconds
+
+# boto3 clients, created on first use, see get_client
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Shared by every detect_pii call in this container so throttling backs
+# off all of them
+comprehend_limiter = dispatch.AdaptiveLimiter(COMPREHEND_WORKERS)
+comprehend_executor = ThreadPoolExecutor(max_workers=COMPREHEND_WORKERS)
+
+result_cache = resultcache.from_url(RESULT_CACHE)
+chunk_cache = chunkcache.ChunkCache(persistent=resultcache.from_url(CHUNK_CACHE))
 
-# Instantiate boto client
-comprehend = boto3.client('comprehend')
-s3 = boto3.client('s3')
-s3_resource = boto3.resource('s3')
+
+def client_config():
+    from botocore.config import Config
+
+    return Config(max_pool_connections=MAX_POOL_CONNECTIONS,
+                  connect_timeout=CONNECT_TIMEOUT,
+                  read_timeout=READ_TIMEOUT,
+                  retries=CLIENT_RETRIES)
+
+
+def _get_boto(kind, service_name):
+    key = (kind, service_name)
+    instance = _clients.get(key)
+    if instance is None:
+        # boto3 sessions are not thread-safe, create each instance once under the lock
+        with _clients_lock:
+            instance = _clients.get(key)
+            if instance is None:
+                import boto3
+
+                factory = boto3.client if kind == 'client' else boto3.resource
+                instance = _clients[key] = factory(service_name, config=client_config())
+    return instance
+
+
+def get_client(service_name):
+    """Shared boto3 client, created on first use and reused while warm."""
+    return _get_boto('client', service_name)
 
 
 class S3File(io.RawIOBase):
     """
     https://alexwlchan.net/2019/02/working-with-large-s3-objects/
+
+    Reads are served from an aligned block cache so that many small reads
+    (e.g. TiffFile walking the header and IFD tags) collapse into a few
+    ranged GETs. A cache miss fetches the missing blocks plus ``read_ahead``
+    following blocks in a single request, and the least recently used blocks
+    are evicted once ``max_blocks`` are held.
+
+    Bytes already fetched from the start of the object (``head``) serve
+    reads inside them without a request, and a known ``size`` saves a HEAD
+    request. With ``etag`` every GET must still match it.
+
+    Requests go through a (thread-safe) S3 client, so handles on the same
+    object can be read from several threads, one handle per thread.
     """
-    def __init__(self, s3_object):
-        self.s3_object = s3_object
+    def __init__(self, s3_client, bucket, key, block_size=BLOCK_SIZE, read_ahead=READ_AHEAD_BLOCKS,
+                 max_blocks=MAX_CACHED_BLOCKS, head=b'', size=None, etag=None):
+        if block_size <= 0:
+            raise ValueError("block_size must be positive (got %r)" % block_size)
+        if max_blocks <= read_ahead:
+            raise ValueError("max_blocks (%r) must be greater than read_ahead (%r)" % (
+                max_blocks, read_ahead
+            ))
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.etag = etag
         self.position = 0
+        self.block_size = block_size
+        self.read_ahead = read_ahead
+        self.max_blocks = max_blocks
+        self.requests = 0
+        self.head = head
+        self._size = size
+        self._blocks = OrderedDict()
 
     def __repr__(self):
-        return "<%s s3_object=%r>" % (type(self).__name__, self.s3_object)
+        return "<%s s3://%s/%s>" % (type(self).__name__, self.bucket, self.key)
 
     @property
     def size(self):
-        return self.s3_object.content_length
+        if self._size is None:
+            self._size = self.s3_client.head_object(Bucket=self.bucket, Key=self.key)['ContentLength']
+        return self._size
 
     def tell(self):
         return self.position
@@ -63,23 +212,70 @@ class S3File(io.RawIOBase):
     def seekable(self):
         return True
 
-    def read(self, size=-1):
-        if size == -1:
-            # Read to the end of the file
-            range_header = "bytes=%d-" % self.position
-            self.seek(offset=0, whence=io.SEEK_END)
-        else:
-            new_position = self.position + size
+    def _get_range(self, start, end):
+        """Fetch bytes [start, end) with a single ranged GET."""
+        self.requests += 1
+        range_header = "bytes=%d-%d" % (start, end - 1)
+        kwargs = {'IfMatch': self.etag} if self.etag else {}
+        return self.s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=range_header,
+                                         **kwargs)["Body"].read()
 
-            # If we're going to read beyond the end of the object, return
-            # the entire object.
-            if new_position >= self.size:
-                return self.read()
+    def read_range(self, start, end):
+        """Read bytes [start, end) in one GET, bypassing the cache and position."""
+        end = min(end, self.size)
+        if start >= end:
+            return b''
+        return self._get_range(start, end)
 
-            range_header = "bytes=%d-%d" % (self.position, new_position - 1)
-            self.seek(offset=size, whence=io.SEEK_CUR)
+    def _fetch_blocks(self, first, last):
+        """Fetch blocks first..last (inclusive) plus read-ahead into the cache."""
+        last_block = (self.size - 1) // self.block_size
+        last = min(last + self.read_ahead, last_block)
+        data = self._get_range(first * self.block_size,
+                               min((last + 1) * self.block_size, self.size))
+        for index in range(first, last + 1):
+            offset = (index - first) * self.block_size
+            self._blocks[index] = data[offset:offset + self.block_size]
+            self._blocks.move_to_end(index)
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
 
-        return self.s3_object.get(Range=range_header)["Body"].read()
+    def _read_cached(self, start, end):
+        first = start // self.block_size
+        last = (end - 1) // self.block_size
+        if last - first + 1 + self.read_ahead > self.max_blocks:
+            # Larger than the cache can hold, don't thrash it
+            return self._get_range(start, end)
+
+        index = first
+        while index <= last:
+            if index in self._blocks:
+                self._blocks.move_to_end(index)
+                index += 1
+                continue
+            # Fetch the whole run of missing blocks in one request
+            run_end = index
+            while run_end < last and run_end + 1 not in self._blocks:
+                run_end += 1
+            self._fetch_blocks(index, run_end)
+            index = run_end + 1
+
+        buffer = b''.join(self._blocks[i] for i in range(first, last + 1))
+        offset = first * self.block_size
+        return buffer[start - offset:end - offset]
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        start = self.position
+        end = min(start + size, self.size)
+        if start >= end:
+            return b''
+
+        self.seek(offset=end, whence=io.SEEK_SET)
+        if end <= len(self.head):
+            return self.head[start:end]
+        return self._read_cached(start, end)
 
     def readable(self):
         return True
@@ -106,124 +302,951 @@ def get_object(bucket, object_key):
         return body
 
 
-def extract_image_description(ometiff):
+def extract_image_description(ometiff) -> str:
+    """extract_image_description.
+    Read the first page's ImageDescription (OME-XML for .ome.tiff).
+
+    Tries the header-only reader first and falls back to tifffile for
+    layouts it does not understand.
+
+    Args:
+        ometiff: seekable binary file object (e.g. S3File)
+
+    Returns:
+        str: ImageDescription, '' if there is none
+    """
+    try:
+        return tiffmeta.read_image_description(ometiff)
+    except tiffmeta.TiffLayoutError as e:
+        logger.info(f'Falling back to tifffile: {e}')
+
+    from tifffile import TiffFile
+
+    ometiff.seek(0)
     with TiffFile(ometiff) as tif:
         tags = tif.pages[0].tags
+        desc_tag = tags.get('ImageDescription')
+        return desc_tag.value if desc_tag is not None else ''
+
+
+def extract_text_tags(fh, max_ifds=tiffmeta.MAX_IFDS, max_value_bytes=tiffmeta.MAX_TAG_BYTES):
+    """extract_text_tags.
+    Text tags of every IFD, see tiffmeta.read_text_tags.
+
+    Falls back to tifffile, over every page, for layouts the header-only
+    reader does not understand.
+
+    Returns:
+        Tuple[List[tiffmeta.TagValue], int]: values and IFDs walked
+    """
+    try:
+        return tiffmeta.read_text_tags(fh, max_ifds, max_value_bytes)
+    except tiffmeta.TiffLayoutError as e:
+        logger.info(f'Falling back to tifffile: {e}')
 
-    desc_tag = tags.get('ImageDescription', '')
-    return desc_tag
+    from tifffile import TiffFile
 
-def extract_ome_metadata():
-    raise NotImplementedError
+    values = []
+    ifds = 0
+    fh.seek(0)
+    with TiffFile(fh) as tif:
+        for page in tif.pages:
+            if ifds >= max_ifds:
+                break
+            for tag in page.tags.values():
+                if tag.dtype not in tiffmeta.TEXT_TYPES or tag.code in tiffmeta.SKIPPED_TAGS \
+                        or tag.count > max_value_bytes:
+                    continue
+                raw = tag.value.encode('utf-8') if isinstance(tag.value, str) else bytes(tag.value)
+                if tag.code == tiffmeta.EXIF_USER_COMMENT and raw[:8] in tiffmeta.USER_COMMENT_CODES:
+                    raw = raw[8:]
+                raw = raw.rstrip(b'\x00')
+                if tag.dtype == tiffmeta.UNDEFINED and not tiffmeta.is_printable(raw):
+                    continue
+                value = tiffmeta.decode_value(raw).strip()
+                if value:
+                    values.append(tiffmeta.TagValue(ifds, tag.code, tiffmeta.tag_name(tag.code), value))
+            ifds += 1
+    return values, ifds
+
+
+def extract_ome_metadata(description: str):
+    """extract_ome_metadata.
+    Free-text fields of OME-XML grouped by XPath, see omexml.iter_text_fields.
+
+    Args:
+        description (str): OME-XML ImageDescription
+
+    Returns:
+        Tuple[List[jsonleaves.PathValues], Dict]: distinct values per XPath
+            and counts of the fields read
+
+    Raises:
+        omexml.OMEXMLError: if description is not OME-XML
+    """
+    return jsonleaves.collect_leaves(omexml.iter_text_fields(description))
 
-def detect_mimetype():
-    # import mimetype
-    raise NotImplementedError
 
 def utf8len(s: str) -> int:
     return len(s.encode('utf-8'))
 
 
-def chunk_split(data: str, chunk_size=5000) -> List[str]:
+def chunk_split(data: str, chunk_size=BYTE_MAX) -> List[str]:
     """chunk_split.
-    This is good enough for now if everything is in English. Keep in mind, str position != byte_size of characters.
+    Split data into chunks of at most chunk_size UTF-8 bytes, breaking at
+    sentence or whitespace boundaries. See chunking.iter_chunks.
+
     Args:
         data (str): data
-        chunk_size:
+        chunk_size: byte limit per chunk
 
     Returns:
         List[str]:
     """
+    return [chunk.text for chunk in chunking.iter_chunks(data, max_bytes=chunk_size)]
 
-    chunks = []
-    if utf8len(data) > chunk_size:
-        for index in range(0, len(data), chunk_size):
-            chunks.append(data[index:index + chunk_size])
-    else:
-        chunks.append(data)
 
-    return chunks
+def detect_pii(data, window_size=BYTE_MAX, overlap=WINDOW_OVERLAP,
+               max_workers=COMPREHEND_WORKERS, deadline=None,
+               policy=PREFILTER_POLICY, stats=None, resume=None, save=None):
+    """detect_pii.
+    Detect PII in data with overlapping Comprehend windows.
 
+    Windows are sent concurrently under the shared AIMD limiter and their
+    entities are reassembled in order, rebased to whole-document character
+    offsets, and merged where found twice in an overlap. Chunks seen before
+    are answered from the chunk cache. A prefilter policy
+    other than 'off' screens windows locally first and skips Comprehend for
+    those it does not need.
 
-def detect_pii(data):
-    # If data byte size is greater than max text limit
-    # Split data up
+    data may also be an iterable of UTF-8 byte pieces (e.g. a streamed S3
+    body), which is chunked with bounded memory. A stream cannot be
+    pre-scanned as a whole, so confirm-hits falls back to skip-clean.
 
-    # split_data = chunk_split(data, chunk_size=5000)
-    split_data = chunk_split(data, chunk_size=2500)
+    With save, progress is checkpointed every checkpoint.SAVE_EVERY_CHUNKS
+    chunks and when the deadline passes. A scan resumed from such a
+    checkpoint is given the data from resume.byte_offset on, skips the
+    chunks before and keeps the entities found in them.
 
-    logger.info('Data size:{} '.format(utf8len(data)))
-    logger.info('Chunks: {}'.format(len(split_data)))
+    Args:
+        data (str | bytes | Iterable[bytes]): document text, its UTF-8
+            encoding or a stream of it
+        window_size (int): UTF-8 byte limit per Comprehend request
+        overlap (int): bytes shared by consecutive windows
+        max_workers (int): concurrent Comprehend requests
+        deadline (dispatch.Deadline): stop before the Lambda deadline
+        policy (str): one of prefilter.POLICIES
+        stats (dict): filled with chars/chunks sent to and skipped from Comprehend,
+            chunk cache hits/misses and the byte offset resumed from
+        resume (checkpoint.Checkpoint): progress of an earlier attempt
+        save: called with a checkpoint.Checkpoint of the progress so far
 
-    results = []
-    for i, chunk in enumerate(split_data):
-        pii_results = comprehend.detect_pii_entities(Text=chunk, LanguageCode='en')
-        print(i, chunk)
-        print(i, pii_results.get('Entities', []))
-        next_entities = pii_results.get('Entities', [])
-        if next_entities:
-            # Offset obj BeginOffset/EngoffSet by the chunksum
-            pass
+    Returns:
+        entities.EntityList: Comprehend entities with document offsets
 
-        results += next_entities
+    Raises:
+        dispatch.DeadlineExceeded: if the deadline passes first
+    """
+    if policy not in prefilter.POLICIES:
+        raise ValueError(f'Unknown prefilter policy {policy!r}, expected one of {prefilter.POLICIES}')
 
-    return results
+    stats = {} if stats is None else stats
+    stats.update(chars_sent=0, chars_skipped=0, chunks_sent=0, chunks_skipped=0,
+                 chunk_cache_hits=0, chunk_cache_misses=0,
+                 resumed_bytes=resume.byte_offset if resume is not None else 0)
+    screen = prefilter.get_prefilter() if policy != prefilter.OFF else None
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    is_text = isinstance(data, str)
+    if policy == prefilter.CONFIRM_HITS and (not is_text or resume is not None):
+        logger.info('Streamed or resumed document, using skip-clean instead of confirm-hits')
+        policy = prefilter.SKIP_CLEAN
+    # confirm-hits decides once for the whole document
+    send_document = policy != prefilter.CONFIRM_HITS or bool(screen.scan(data))
+    results = entities.EntityList()
+    # Offsets of data in the document, and progress so far
+    base_bytes = base_chars = 0
+    progress = checkpoint.Checkpoint(entities=results)
+    if resume is not None:
+        base_bytes, base_chars = resume.byte_offset, resume.char_offset
+        results.extend(resume.entities)
+        progress = checkpoint.Checkpoint(base_bytes, base_chars, resume.chunks, results)
 
+    def select(chunks):
+        for chunk in chunks:
+            send = send_document
+            if policy in (prefilter.SKIP_CLEAN, prefilter.LOCAL_ONLY):
+                hits = screen.scan(chunk.text)
+                if policy == prefilter.LOCAL_ONLY:
+                    results.extend(hits, base_chars + chunk.char_offset)
+                    send = False
+                else:
+                    send = screen.classify(chunk.text, hits) != prefilter.CLEAN
 
-def lambda_handler(event, context):
-    # Job parameters from S3 Batch Operations Event
-    jobId = event['job']['id']
-    invocationId = event['invocationId']
-    invocationSchemaVersion = event['invocationSchemaVersion']
+            outcome = 'sent' if send else 'skipped'
+            stats[f'chars_{outcome}'] += len(chunk.text)
+            stats[f'chunks_{outcome}'] += 1
+            if send:
+                yield chunk
 
-    # AWS S3 Key, Key Version, and Bucket ARN
-    taskId = event['tasks'][0]['taskId']
-    s3Key = event['tasks'][0]['s3Key']
-    s3VersionId = event['tasks'][0]['s3VersionId']
-    s3BucketArn = event['tasks'][0]['s3BucketArn']
-    s3Bucket = s3BucketArn.split(':::')[-1]
+    def comprehend(text):
+        return get_client('comprehend').detect_pii_entities(
+            Text=text, LanguageCode='en').get('Entities', [])
 
-    # Get Object
-    # Can read(), iter_lines(), iter_chunks(), returns byte
+    def detect(chunk):
+        found, hit = chunk_cache.get_or_compute(chunk.text, comprehend)
+        return chunk, found, hit
+
+    if is_text:
+        chunks = chunking.iter_chunks(data, max_bytes=window_size, overlap=overlap)
+    else:
+        chunks = chunking.iter_stream_chunks(data, max_bytes=window_size, overlap=overlap)
+    if resume is not None and resume.chunks:
+        # The first chunk is the last one the earlier attempt completed
+        chunks = itertools.islice(chunks, 1, None)
+    chunks = select(chunks)
+    saved_chunks = progress.chunks
     try:
-        if s3Key.endswith('.txt'):
-            obj = s3.get_object(Bucket=s3Bucket, Key=s3Key)
-            logger.info(f"Got '{s3Key}' from bucket '{s3Bucket}'")
-            data = obj['Body'].read().decode('utf-8')
-        elif s3Key.endswith('.ome.tiff') or s3Key.endswith('.ome.tif'):
-            obj = s3_resource.Object(bucket_name=s3Bucket, key=s3Key)
-            logger.info(f"Got '{s3Key}' from bucket '{s3Bucket}'")
-            with TiffFile(S3File(obj)) as tif:
-                tags = tif.pages[0].tags
-                desc_tag = tags.get('ImageDescription', '')
+        for chunk, next_entities, hit in dispatch.imap_ordered(detect, chunks, max_workers=max_workers,
+                                                               limiter=comprehend_limiter,
+                                                               deadline=deadline,
+                                                               executor=comprehend_executor):
+            stats['chunk_cache_hits' if hit else 'chunk_cache_misses'] += 1
+            if next_entities:
+                results.extend(next_entities, base_chars + chunk.char_offset)
+            progress = checkpoint.Checkpoint(base_bytes + chunk.byte_offset, base_chars + chunk.char_offset,
+                                             progress.chunks + 1, results)
+            if save is not None and progress.chunks - saved_chunks >= checkpoint.SAVE_EVERY_CHUNKS:
+                save(progress)
+                saved_chunks = progress.chunks
+    except dispatch.DeadlineExceeded:
+        if save is not None and progress.chunks > saved_chunks:
+            save(progress)
+        raise
 
-            data = desc_tag.value
-        # Handle .json/.story.json case
-        # Handle jpg, png case
-        # if data
+    logger.info('Chunks sent: {chunks_sent}, skipped: {chunks_skipped}'.format(**stats))
+    logger.info('Characters sent: {chars_sent}, skipped: {chars_skipped}'.format(**stats))
+    logger.info('Chunk cache hits: {chunk_cache_hits}, misses: {chunk_cache_misses}'.format(**stats))
 
+    return entities.merge_entities(results)
 
-        # sys.exit('BREAKPOINT')
-    except ClientError:
-        logger.exception(f"Couldn't get '{s3Key}' from '{s3Bucket}'")
+
+def needs_comprehend(text, policy=PREFILTER_POLICY):
+    """Whether detect_pii would send text, a single chunk, to Comprehend under policy."""
+    if policy == prefilter.OFF:
+        return True
+    if policy == prefilter.LOCAL_ONLY:
+        return False
+    screen = prefilter.get_prefilter()
+    hits = screen.scan(text)
+    if policy == prefilter.CONFIRM_HITS:
+        return bool(hits)
+    return screen.classify(text, hits) != prefilter.CLEAN
+
+
+def pack_pii(documents, window_size=BYTE_MAX, max_workers=COMPREHEND_WORKERS, deadline=None,
+             policy=PREFILTER_POLICY):
+    """pack_pii.
+    Detect PII in small documents several to a Comprehend request.
+
+    Documents that fit one window, that detect_pii would send and that the
+    chunk cache does not hold yet are packed up to window_size bytes (see
+    packing.pack_documents), and the entities of each request are split
+    back into the chunk cache per document. detect_pii on each document
+    then finds its only chunk cached, so per-document results are the same
+    as unpacked and only the number of requests drops. Documents left out
+    when time or Comprehend runs out are simply not cached.
+
+    Args:
+        documents (List[str]): document texts
+        window_size (int): UTF-8 byte limit per Comprehend request
+        max_workers (int): concurrent Comprehend requests
+        deadline (dispatch.Deadline): stop before the Lambda deadline
+        policy (str): one of prefilter.POLICIES
+
+    Returns:
+        int: Comprehend requests made
+    """
+    texts = [text for text in dict.fromkeys(documents)
+             if text and utf8len(text) <= window_size and needs_comprehend(text, policy)
+             and chunk_cache.get(text) is None]
+
+    def detect(pack):
+        found = get_client('comprehend').detect_pii_entities(
+            Text=pack.text, LanguageCode='en').get('Entities', [])
+        for index, document_entities in packing.split_entities(pack, found).items():
+            chunk_cache.put(texts[index], document_entities)
+        return pack
+
+    requests = 0
+    packs = packing.pack_documents(texts, window_size)
+    try:
+        for pack in dispatch.imap_ordered(detect, packs, max_workers=max_workers,
+                                          limiter=comprehend_limiter, deadline=deadline,
+                                          executor=comprehend_executor):
+            requests += 1
+    except (dispatch.DeadlineExceeded, ClientError) as e:
+        logger.warning(f"Stopped packing after {requests} requests: {e}")
+    logger.info(f'Packed {len(texts)} small documents into {requests} Comprehend requests')
+    return requests
+
+
+def sample_pii(s3_file, seed, deadline=None, stats=None):
+    """sample_pii.
+    Spot-check a large object by detecting PII in stratified byte windows.
+
+    The number of windows depends on the object's size tier and their
+    positions on seed, so repeat runs sample the same bytes. Windows are
+    fetched concurrently, one ranged GET each.
+
+    Args:
+        s3_file (S3File): object to sample
+        seed (int): see sampling.seed_for
+        deadline (dispatch.Deadline): stop before the Lambda deadline
+        stats (dict): detect_pii stats, summed over the windows
+
+    Returns:
+        Tuple[entities.EntityList, Dict]: entities, with offsets relative to
+            their window and the window's WindowByteOffset, and the coverage report
+    """
+    size = s3_file.size
+    windows = sampling.plan_windows(size, sampling.windows_for_size(size), seed)
+    stats = {} if stats is None else stats
+
+    found = entities.EntityList()
+    positive = 0
+    with ThreadPoolExecutor(max_workers=min(TASK_WORKERS, max(1, len(windows)))) as executor:
+        raw_windows = executor.map(lambda window: s3_file.read_range(*window), windows)
+        for (start, _), raw in zip(windows, raw_windows):
+            window_stats = {}
+            window_entities = detect_pii(sampling.decode_window(raw), deadline=deadline,
+                                         stats=window_stats)
+            for key, value in window_stats.items():
+                stats[key] = stats.get(key, 0) + value
+            if window_entities:
+                positive += 1
+            found.extend(window_entities, origin=start)
+
+    return found, sampling.coverage_report(size, windows, positive)
+
+
+def scan_table(pieces, delimiter, deadline=None, stats=None):
+    """scan_table.
+    Detect PII in a CSV/TSV stream column by column.
+
+    Rows are streamed and only each column's bounded set of distinct values
+    is sent to Comprehend, packed into as few requests as they fit.
+
+    Args:
+        pieces: UTF-8 byte pieces of the table
+        delimiter (str): field delimiter
+        deadline (dispatch.Deadline): stop before the Lambda deadline
+        stats (dict): detect_pii stats
+
+    Returns:
+        Dict: rows, values sent, sampled columns and the per-column report
+    """
+    columns, rows = tabular.profile_table(tabular.iter_text_lines(pieces), delimiter)
+    text, starts, owners = tabular.pack_values(columns)
+    found = detect_pii(text, deadline=deadline, stats=stats) if text else []
+    return {
+        'rows': rows,
+        'values_sent': len(starts),
+        'sampled_columns': [column.name for column in columns if column.sampled],
+        'columns': tabular.column_report(found, starts, owners),
+    }
+
+
+def scan_json(pieces, deadline=None, stats=None):
+    """scan_json.
+    Detect PII in the string values of a JSON stream, by JSON path.
+
+    Only string leaves are sent: keys, numbers and structure are dropped,
+    blobs skipped and each path's bounded set of distinct values sent once,
+    labelled with their path and packed into as few requests as they fit.
+
+    Args:
+        pieces: UTF-8 byte pieces of the document
+        deadline (dispatch.Deadline): stop before the Lambda deadline
+        stats (dict): detect_pii stats
+
+    Returns:
+        Dict: leaf counts, values sent, sampled paths and the per-path report
+
+    Raises:
+        jsonleaves.JSONLeafError: if the stream is not JSON
+    """
+    paths, counts = jsonleaves.collect_leaves(jsonleaves.iter_string_leaves(pieces))
+    text, starts, owners = tabular.pack_values(paths)
+    found = detect_pii(text, deadline=deadline, stats=stats) if text else []
+    return {
+        'leaves': counts['leaves'],
+        'blobs_skipped': counts['blobs'],
+        'values_sent': len(starts),
+        'sampled_paths': [path.name for path in paths if path.sampled],
+        'paths': tabular.column_report(found, starts, owners),
+    }
+
+
+def scan_ome(description, deadline=None, stats=None):
+    """scan_ome.
+    Detect PII in the free-text fields of OME-XML, by XPath.
+
+    Plane, TiffData and other pixel elements are never sent, and each
+    XPath's repeated values are sent once, labelled with the XPath.
+
+    Returns:
+        Dict: field counts, values sent and the per-XPath report
+
+    Raises:
+        omexml.OMEXMLError: if description is not OME-XML
+    """
+    xpaths, counts = extract_ome_metadata(description)
+    text, starts, owners = tabular.pack_values(xpaths)
+    found = detect_pii(text, deadline=deadline, stats=stats) if text else []
+    return {
+        'fields': counts['leaves'],
+        'values_sent': len(starts),
+        'xpaths': tabular.column_report(found, starts, owners),
+    }
+
+
+def scan_tiff_tags(fh, deadline=None, stats=None):
+    """scan_tiff_tags.
+    Detect PII in every text tag of every IFD of a TIFF, see
+    extract_text_tags.
+
+    OME-XML ImageDescriptions contribute their free-text fields by XPath,
+    other tags are reported as /TIFF/<tag name>. Values repeated across
+    pages are sent once.
+
+    Returns:
+        Dict: IFDs walked, tags read, values sent and the per-path report
+    """
+    tags, ifds = extract_text_tags(fh)
+    leaves = []
+    for tag in tags:
+        if tag.tag == tiffmeta.IMAGE_DESCRIPTION:
+            try:
+                leaves.extend(list(omexml.iter_text_fields(tag.value)))
+                continue
+            except omexml.OMEXMLError:
+                pass
+        leaves.append((f'/TIFF/{tag.name}', tag.value))
+
+    paths, _ = jsonleaves.collect_leaves(leaves)
+    text, starts, owners = tabular.pack_values(paths)
+    found = detect_pii(text, deadline=deadline, stats=stats) if text else []
+    return {
+        'ifds': ifds,
+        'tags': len(tags),
+        'values_sent': len(starts),
+        'xpaths': tabular.column_report(found, starts, owners),
+    }
+
+
+def iter_pieces(fileobj, read_size=streaming.STREAM_READ_SIZE):
+    """Read a file object in pieces of read_size bytes."""
+    return iter(lambda: fileobj.read(read_size), b'')
+
+
+def scan_member(name, fileobj, seekable, deadline=None):
+    """scan_member.
+    Detect PII in one archive member, dispatched on its extension.
+
+    Args:
+        name (str): member path inside the archive
+        fileobj: member contents
+        seekable (bool): whether fileobj supports seeking
+        deadline (dispatch.Deadline): stop before the Lambda deadline
+
+    Returns:
+        Dict: member result with a status of scanned, skipped or error
+    """
+    lower = name.lower()
+    result = {'member': name, 'status': 'scanned'}
+    try:
+        if archive.archive_kind(lower):
+            return archive.skipped(name, 'nested archive')
+        elif lower.endswith('.json'):
+            result.update(scan_json(iter_pieces(fileobj), deadline=deadline))
+        elif tabular.delimiter_for(lower):
+            result.update(scan_table(iter_pieces(fileobj), tabular.delimiter_for(lower),
+                                     deadline=deadline))
+        elif lower.endswith('.ome.tiff') or lower.endswith('.ome.tif'):
+            if not seekable:
+                data = fileobj.read(MAX_MEMBER_BUFFER + 1)
+                if len(data) > MAX_MEMBER_BUFFER:
+                    return archive.skipped(name, 'TIFF too large to buffer')
+                fileobj = io.BytesIO(data)
+            description = extract_image_description(fileobj)
+            try:
+                result.update(scan_ome(description, deadline=deadline))
+            except omexml.OMEXMLError:
+                result['entities'] = detect_pii(description, deadline=deadline)
+        elif lower.endswith(TEXT_EXTENSIONS):
+            result['entities'] = detect_pii(iter_pieces(fileobj), deadline=deadline)
+        else:
+            return archive.skipped(name, 'unsupported type')
+    except dispatch.DeadlineExceeded:
         raise
+    except Exception as e:
+        logger.exception(f"Couldn't scan member '{name}'")
+        return {'member': name, 'status': 'error', 'reason': f'{type(e).__name__}: {e}'}
+    return result
+
+
+def scan_archive(s3Bucket, s3Key, head, deadline=None, budget_bytes=archive.ARCHIVE_BYTE_BUDGET):
+    """scan_archive.
+    Detect PII in each member of a zip, tar(.gz) or gzip object.
+
+    Zip archives are read through S3File, fetching only the central
+    directory and the members scanned; tar and gzip objects are
+    decompressed as a stream that starts with the sniffed head. Members are
+    dispatched to the text, table or TIFF scanners until budget_bytes of
+    uncompressed data have been read.
+
+    Args:
+        head (ObjectHead): see fetch_head
+
+    Returns:
+        Dict: per-member results and the bytes scanned
+    """
+    budget = archive.ByteBudget(budget_bytes)
+
+    def scan(name, fileobj, seekable):
+        return scan_member(name, fileobj, seekable, deadline=deadline)
+
+    if head.mimetype == sniff.ZIP:
+        members = archive.scan_zip(lambda: object_file(s3Bucket, s3Key, head), scan, budget)
+    else:
+        reader = streaming.PieceReader(iter_object(s3Bucket, s3Key, head))
+        if head.mimetype == sniff.TAR:
+            members = archive.scan_tar(reader, scan, budget)
+        else:
+            members = archive.scan_gzip(reader, s3Key, scan, budget)
+
+    return {
+        'members': members,
+        'bytes_scanned': budget.used,
+        'budget_exhausted': budget.exhausted,
+    }
+
+
+class ObjectHead(NamedTuple):
+    """First bytes of an object and what they say about it."""
+    data: bytes
+    size: int
+    etag: str
+    mimetype: str
+
+    @property
+    def complete(self) -> bool:
+        return len(self.data) >= self.size
+
+
+def fetch_head(s3Bucket, s3Key, size=sniff.SNIFF_BYTES):
+    """fetch_head.
+    Fetch the first size bytes of an object with one ranged GET and sniff
+    its content type.
+
+    Returns:
+        ObjectHead:
+    """
+    try:
+        obj = get_client('s3').get_object(Bucket=s3Bucket, Key=s3Key, Range=f'bytes=0-{size - 1}')
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'InvalidRange':
+            raise
+        # Empty objects have no byte 0
+        return ObjectHead(b'', 0, '', sniff.detect_mimetype(b'', s3Key, complete=True))
+
+    data = obj['Body'].read()
+    content_range = obj.get('ContentRange')
+    total = int(content_range.rsplit('/', 1)[1]) if content_range else len(data)
+    mimetype = sniff.detect_mimetype(data, s3Key, complete=len(data) >= total)
+    logger.info(f"Sniffed '{s3Key}' from bucket '{s3Bucket}' as {mimetype}")
+    return ObjectHead(data, total, obj.get('ETag', ''), mimetype)
+
 
-    # Action
+def iter_object(s3Bucket, s3Key, head, read_size=streaming.STREAM_READ_SIZE, start=0):
+    """iter_object.
+    The object from byte start on as byte pieces, starting with what head.data
+    holds of it so that only the remaining bytes are fetched. The rest must
+    still have head's ETag.
+    """
+    if start < len(head.data):
+        yield head.data[start:]
+    if head.complete:
+        return
+    kwargs = {'IfMatch': head.etag} if head.etag else {}
+    body = get_client('s3').get_object(Bucket=s3Bucket, Key=s3Key,
+                                       Range=f'bytes={max(start, len(head.data))}-', **kwargs)['Body']
+    yield from body.iter_chunks(read_size)
+
+
+def object_file(s3Bucket, s3Key, head):
+    """S3File on an object, starting from what fetch_head already read of it."""
+    return S3File(get_client('s3'), s3Bucket, s3Key, head=head.data, size=head.size, etag=head.etag or None)
+
+
+def task_result(taskId, code, result_string):
+    return {
+        "taskId": taskId,
+        "resultCode": result_codes.get(code),
+        "resultString": result_string
+    }
+
+
+def object_cache_key(bucket, key):
+    """Content address of an object from a HEAD request, see resultcache.cache_key."""
+    head = get_client('s3').head_object(Bucket=bucket, Key=key)
+    return resultcache.cache_key(head['ETag'], head['ContentLength'], namespace=CACHE_NAMESPACE)
+
+
+def cached_result(cache_key):
+    try:
+        return result_cache.get(cache_key)
+    except Exception:
+        logger.exception(f"Result cache lookup failed for '{cache_key}'")
+        return None
+
+
+def store_result(cache_key, result_string):
+    try:
+        result_cache.put(cache_key, result_string)
+    except Exception:
+        logger.exception(f"Result cache store failed for '{cache_key}'")
+
+
+def finish_task(taskId, s3Bucket, s3Key, result, cache_key=None):
+    """finish_task.
+    Successful task result for a scan result.
+
+    resultString is canonical JSON bounded to report.RESULT_STRING_LIMIT,
+    entity lists summarized. With RESULTS_PREFIX set, the full result and
+    every entity are written to a sidecar object first and resultString
+    points to it.
+    """
+    if RESULTS_PREFIX:
+        result['sidecar'] = report.write_sidecar(get_client('s3'), RESULTS_PREFIX, s3Bucket, s3Key, result)
+    result_string = report.bounded(result)
+    if cache_key is not None:
+        store_result(cache_key, result_string)
+    return task_result(taskId, 'success', result_string)
+
+
+def entities_task(taskId, s3Bucket, s3Key, data, deadline=None, cache_key=None,
+                  checkpoints=None, resume=None):
+    """Task result listing the PII entities found in data, see detect_pii.
+
+    With checkpoints (checkpoint.TaskCheckpoint), progress is saved as it
+    goes and when time runs out, and the checkpoint is removed once the
+    task succeeds. data starts at resume's byte offset when resuming.
+    """
     logger.info(f'Detecting PII: {s3Key}')
-    pii_entities = detect_pii(data)
+    stats = {}
+    save = checkpoints.save if checkpoints is not None else None
+    try:
+        pii_entities = detect_pii(data, deadline=deadline, stats=stats, resume=resume, save=save)
+    except dispatch.DeadlineExceeded as e:
+        # Let S3 Batch retry the task rather than being killed mid-scan
+        logger.warning(f"Ran out of time on '{s3Key}': {e}")
+        return task_result(taskId, 'tf', str(e))
+    except ClientError as e:
+        logger.exception(f"Couldn't detect PII in '{s3Key}'")
+        return task_result(taskId, 'tf', str(e))
+
     logger.info('Entities: {}'.format(len(pii_entities)))
-    logger.info('PII detected:')
-    for entity in pii_entities:
-        print(entity)
-
-    # Prepare results
-    results = []
-    # if pii_entities:
-    results.append({
-        "taskId": taskId,
-        "resultCode": result_codes.get('success'),
-        "resultString": str(pii_entities)
-    })
+    logger.info(f"'{s3Key}' scan report: {stats}")
+
+    result = finish_task(taskId, s3Bucket, s3Key, {'entities': pii_entities, 'stats': stats}, cache_key)
+    if checkpoints is not None:
+        checkpoints.discard()
+    return result
+
+
+def sample_task(taskId, s3Bucket, s3Key, head, deadline=None, cache_key=None):
+    """Task result for a sampled scan, escalated to a full scan if configured."""
+    logger.info(f'Sampling PII: {s3Key}')
+    stats = {}
+    try:
+        pii_entities, coverage = sample_pii(object_file(s3Bucket, s3Key, head),
+                                            sampling.seed_for(s3Key, head.etag),
+                                            deadline=deadline, stats=stats)
+    except dispatch.DeadlineExceeded as e:
+        logger.warning(f"Ran out of time on '{s3Key}': {e}")
+        return task_result(taskId, 'tf', str(e))
+    logger.info(f"'{s3Key}' sample report: {coverage}, scan report: {stats}")
+
+    if coverage['escalate'] and SAMPLE_ESCALATE:
+        logger.info(f"PHI found in sample of '{s3Key}', escalating to a full scan")
+        data = streaming.prefetch(iter_object(s3Bucket, s3Key, head))
+        try:
+            pii_entities = detect_pii(data, deadline=deadline)
+        except dispatch.DeadlineExceeded as e:
+            logger.warning(f"Ran out of time on '{s3Key}': {e}")
+            return task_result(taskId, 'tf', str(e))
+        coverage['escalated'] = True
+
+    return finish_task(taskId, s3Bucket, s3Key, {'sample': coverage, 'entities': pii_entities, 'stats': stats},
+                       cache_key)
+
+
+def text_task(taskId, s3Bucket, s3Key, head, deadline=None, cache_key=None, checkpoints=None):
+    """Task result for a UTF-8 text object, sampled or streamed when large.
+
+    A full scan is checkpointed with checkpoints and a retry resumes from
+    the last checkpoint, fetching only the bytes from there on.
+    """
+    if SCAN_MODE == 'sample' and sampling.windows_for_size(head.size) > 0:
+        return sample_task(taskId, s3Bucket, s3Key, head, deadline, cache_key)
+
+    resume = checkpoints.load() if checkpoints is not None else None
+    start = resume.byte_offset if resume is not None else 0
+    pieces = iter_object(s3Bucket, s3Key, head, start=start)
+    if head.size - start > STREAM_MIN_SIZE:
+        # Download the next pieces while detecting on the current one
+        data = streaming.prefetch(pieces)
+    else:
+        data = b''.join(pieces).decode('utf-8')
+    return entities_task(taskId, s3Bucket, s3Key, data, deadline, cache_key,
+                         checkpoints=checkpoints, resume=resume)
+
+
+def json_task(taskId, s3Bucket, s3Key, head, deadline=None, cache_key=None, checkpoints=None):
+    """Task result for a JSON object, see scan_json.
+
+    Falls back to text_task, which streams and checkpoints, if the object
+    does not parse or is larger than JSON_PATH_MAX_SIZE. A scan by path
+    cannot resume, so one that runs out of time leaves an empty checkpoint
+    and the retry scans the object as text.
+    """
+    if head.size > JSON_PATH_MAX_SIZE or checkpoints is not None and checkpoints.load() is not None:
+        return text_task(taskId, s3Bucket, s3Key, head, deadline, cache_key, checkpoints)
+
+    logger.info(f'Detecting PII per JSON path: {s3Key}')
+    stats = {}
+    pieces = streaming.prefetch(iter_object(s3Bucket, s3Key, head))
+    try:
+        result = scan_json(pieces, deadline=deadline, stats=stats)
+    except dispatch.DeadlineExceeded as e:
+        logger.warning(f"Ran out of time on '{s3Key}': {e}")
+        pieces.close()
+        if checkpoints is not None:
+            checkpoints.save(checkpoint.Checkpoint())
+        return task_result(taskId, 'tf', str(e))
+    except jsonleaves.JSONLeafError as e:
+        logger.warning(f"'{s3Key}' is not JSON ({e}), scanning it as text")
+        pieces.close()
+        return text_task(taskId, s3Bucket, s3Key, head, deadline, cache_key, checkpoints)
+    logger.info(f"'{s3Key}' scan report: {stats}")
+    for path, types in result['paths'].items():
+        logger.info(f"'{s3Key}' path '{path}' contains {', '.join(types)}")
+
+    result['stats'] = stats
+    return finish_task(taskId, s3Bucket, s3Key, result, cache_key)
+
+
+def tiff_task(taskId, s3Bucket, s3Key, head, deadline=None, cache_key=None, checkpoints=None):
+    """Task result for a TIFF object's ImageDescription (or every text tag, see TIFF_SCAN), by XPath."""
+    fh = object_file(s3Bucket, s3Key, head)
+    stats = {}
+    try:
+        if TIFF_SCAN == 'all':
+            logger.info(f'Detecting PII in every TIFF text tag: {s3Key}')
+            result = scan_tiff_tags(fh, deadline=deadline, stats=stats)
+        else:
+            description = extract_image_description(fh)
+            logger.info(f'Detecting PII per OME-XML field: {s3Key}')
+            result = scan_ome(description, deadline=deadline, stats=stats)
+    except dispatch.DeadlineExceeded as e:
+        logger.warning(f"Ran out of time on '{s3Key}': {e}")
+        return task_result(taskId, 'tf', str(e))
+    except omexml.OMEXMLError as e:
+        logger.info(f"'{s3Key}' ImageDescription is not OME-XML ({e}), scanning it as text")
+        return entities_task(taskId, s3Bucket, s3Key, description, deadline, cache_key)
+    logger.info(f"'{s3Key}' scan report: {stats}")
+    for xpath, types in result['xpaths'].items():
+        logger.info(f"'{s3Key}' field '{xpath}' contains {', '.join(types)}")
+
+    result['stats'] = stats
+    return finish_task(taskId, s3Bucket, s3Key, result, cache_key)
+
+
+def table_task(taskId, s3Bucket, s3Key, head, deadline=None, cache_key=None, checkpoints=None):
+    """Task result for a CSV/TSV object, see scan_table."""
+    logger.info(f'Detecting PII per column: {s3Key}')
+    delimiter = '\t' if head.mimetype == sniff.TSV else ','
+    stats = {}
+    pieces = streaming.prefetch(iter_object(s3Bucket, s3Key, head))
+    try:
+        result = scan_table(pieces, delimiter, deadline=deadline, stats=stats)
+    except dispatch.DeadlineExceeded as e:
+        logger.warning(f"Ran out of time on '{s3Key}': {e}")
+        return task_result(taskId, 'tf', str(e))
+    logger.info(f"'{s3Key}' scan report: {stats}")
+    for column, types in result['columns'].items():
+        logger.info(f"'{s3Key}' column '{column}' contains {', '.join(types)}")
+
+    result['stats'] = stats
+    return finish_task(taskId, s3Bucket, s3Key, result, cache_key)
+
+
+def archive_task(taskId, s3Bucket, s3Key, head, deadline=None, cache_key=None, checkpoints=None):
+    """Task result for an archive object, see scan_archive."""
+    logger.info(f'Detecting PII per archive member: {s3Key}')
+    try:
+        result = scan_archive(s3Bucket, s3Key, head, deadline=deadline)
+    except dispatch.DeadlineExceeded as e:
+        logger.warning(f"Ran out of time on '{s3Key}': {e}")
+        return task_result(taskId, 'tf', str(e))
+    except archive.ArchiveError as e:
+        logger.exception(f"Couldn't read archive '{s3Key}'")
+        return task_result(taskId, 'pf', f'{type(e).__name__}: {e}')
+
+    return finish_task(taskId, s3Bucket, s3Key, result, cache_key)
+
+
+def skip_task(taskId, s3Bucket, s3Key, head, deadline=None, cache_key=None, checkpoints=None):
+    """Task result for content no extractor handles, only its head was fetched.
+
+    Reported as a success, like skipped archive members: S3 Batch stops a
+    job once most of its tasks fail, which a bucket of mostly images would.
+    """
+    logger.info(f"Skipping '{s3Key}' ({head.mimetype})")
+    return task_result(taskId, 'success', report.bounded({'skipped': head.mimetype}))
+
+
+# Extractor per sniffed mimetype, see sniff.detect_mimetype. Each is called
+# as extractor(taskId, s3Bucket, s3Key, head, deadline, cache_key, checkpoints)
+# and returns the task result; anything unlisted goes to skip_task.
+# checkpoints is a checkpoint.TaskCheckpoint, or None when disabled.
+EXTRACTORS = {
+    sniff.TEXT: text_task,
+    sniff.JSON: json_task,
+    sniff.CSV: table_task,
+    sniff.TSV: table_task,
+    sniff.TIFF: tiff_task,
+    sniff.ZIP: archive_task,
+    sniff.TAR: archive_task,
+    sniff.GZIP: archive_task,
+}
+
+
+def process_task(task, deadline=None, jobId=None, small=None):
+    """process_task.
+    Fetch one S3 Batch task's object and detect PII in it.
+
+    The object's content type is sniffed from its first bytes (one ranged
+    GET) and the task is handed to the matching entry of EXTRACTORS, which
+    reuses those bytes. Errors are turned into the task's resultCode so one
+    bad object does not fail the rest of the invocation. With a result
+    cache configured, an object whose content was scanned before is
+    answered from the cache after a single HEAD request. With
+    CHECKPOINT_PREFIX set, scans are checkpointed under the job and task ID
+    and the object's ETag, so a retry picks up where the last attempt
+    stopped.
+
+    Small text objects (PACK_OBJECT_BYTES) are set aside in small for
+    scan_small_objects instead when it is given.
+
+    Args:
+        task (dict): S3 Batch task
+        deadline (dispatch.Deadline): stop before the Lambda deadline
+        jobId (str): S3 Batch job ID
+        small (list): collects (taskId, s3Bucket, s3Key, head, cache_key)
+            of small text objects
+
+    Returns:
+        dict: S3 Batch task result, None if the object was set aside in small
+    """
+    # AWS S3 Key, Key Version, and Bucket ARN
+    taskId = task['taskId']
+    s3Key = task['s3Key']
+    s3VersionId = task['s3VersionId']
+    s3BucketArn = task['s3BucketArn']
+    s3Bucket = s3BucketArn.split(':::')[-1]
+
+    cache_key = None
+    try:
+        if result_cache is not None:
+            cache_key = object_cache_key(s3Bucket, s3Key)
+            cached = cached_result(cache_key)
+            if cached is not None:
+                logger.info(f"Replaying cached result for '{s3Key}'")
+                return task_result(taskId, 'success', cached)
+
+        head = fetch_head(s3Bucket, s3Key)
+        if (small is not None and head.mimetype == sniff.TEXT and head.complete
+                and head.size <= PACK_OBJECT_BYTES):
+            small.append((taskId, s3Bucket, s3Key, head, cache_key))
+            return None
+        checkpoints = None
+        if CHECKPOINT_PREFIX and jobId and head.etag:
+            checkpoints = checkpoint.TaskCheckpoint(get_client('s3'), CHECKPOINT_PREFIX, jobId, taskId,
+                                                    head.etag, namespace=CACHE_NAMESPACE)
+        extractor = EXTRACTORS.get(head.mimetype, skip_task)
+        return extractor(taskId, s3Bucket, s3Key, head, deadline, cache_key, checkpoints)
+    except ClientError as e:
+        logger.exception(f"Couldn't get '{s3Key}' from '{s3Bucket}'")
+        code = e.response.get('Error', {}).get('Code')
+        return task_result(taskId, 'pf' if code in PERMANENT_ERROR_CODES else 'tf', str(e))
+
+
+def scan_small_objects(small, deadline=None):
+    """scan_small_objects.
+    Task results for the small text objects process_task set aside,
+    Comprehend requests shared between them, see pack_pii.
+
+    Args:
+        small (list): (taskId, s3Bucket, s3Key, head, cache_key) per object
+        deadline (dispatch.Deadline): stop before the Lambda deadline
+
+    Returns:
+        Dict[str, dict]: S3 Batch task result per taskId
+    """
+    texts = [head.data.decode('utf-8') for _, _, _, head, _ in small]
+    try:
+        pack_pii(texts, deadline=deadline)
+    except Exception:
+        # Packing only saves requests, each task still scans its own text
+        logger.exception('Packing small objects failed, scanning them one by one')
+
+    results = {}
+    for (taskId, s3Bucket, s3Key, _, cache_key), text in zip(small, texts):
+        try:
+            results[taskId] = entities_task(taskId, s3Bucket, s3Key, text, deadline, cache_key)
+        except Exception as e:
+            logger.exception(f"Task '{taskId}' failed")
+            results[taskId] = task_result(taskId, 'pf', f'{type(e).__name__}: {e}')
+    return results
+
+
+def lambda_handler(event, context):
+    # Job parameters from S3 Batch Operations Event
+    jobId = event['job']['id']
+    invocationId = event['invocationId']
+    invocationSchemaVersion = event['invocationSchemaVersion']
+    tasks = event['tasks']
+    deadline = dispatch.Deadline.from_context(context)
+    # Small text objects, scanned together once every task is sniffed
+    small = [] if PACK_OBJECT_BYTES else None
+
+    def run(task):
+        try:
+            return process_task(task, deadline=deadline, jobId=jobId, small=small)
+        except Exception as e:
+            logger.exception(f"Task '{task['taskId']}' failed")
+            return task_result(task['taskId'], 'pf', f'{type(e).__name__}: {e}')
+
+    # Prepare results, one per task in event order
+    with ThreadPoolExecutor(max_workers=max(1, min(TASK_WORKERS, len(tasks)))) as executor:
+        results = list(executor.map(run, tasks))
+    if small:
+        packed = scan_small_objects(small, deadline=deadline)
+        results = [packed[task['taskId']] if result is None else result
+                   for task, result in zip(tasks, results)]
 
     return {
         'invocationSchemaVersion': invocationSchemaVersion,
@@ -0,0 +1,178 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+# Uncompressed bytes scanned per archive, members past it are skipped
+ARCHIVE_BYTE_BUDGET = 512 * 1024 * 1024
+# Zip members scanned at once
+ARCHIVE_WORKERS = 4
+
+ZIP = 'zip'
+TAR = 'tar'
+GZIP = 'gz'
+KINDS = (
+    ('.zip', ZIP),
+    ('.tar.gz', TAR),
+    ('.tgz', TAR),
+    ('.tar', TAR),
+    ('.gz', GZIP),
+)
+
+
+class ArchiveError(ValueError):
+    """The archive itself could not be read."""
+
+
+def archive_kind(key: str):
+    """Archive kind of a key by extension, None if it is not an archive."""
+    lower = key.lower()
+    for extension, kind in KINDS:
+        if lower.endswith(extension):
+            return kind
+    return None
+
+
+class ByteBudget:
+    """Thread-safe count of the uncompressed bytes left to scan."""
+    def __init__(self, total: int = ARCHIVE_BYTE_BUDGET):
+        self.total = total
+        self.remaining = total
+        self.exhausted = False
+        self._lock = threading.Lock()
+
+    @property
+    def used(self) -> int:
+        return self.total - self.remaining
+
+    def take(self, size: int) -> bool:
+        """Reserve size bytes, False (and nothing taken) if they do not fit."""
+        with self._lock:
+            if size > self.remaining:
+                self.exhausted = True
+                return False
+            self.remaining -= size
+            return True
+
+
+class BudgetReader:
+    """File wrapper that stops reading when the budget runs out."""
+    def __init__(self, fileobj, budget: ByteBudget):
+        self.fileobj = fileobj
+        self.budget = budget
+        self.truncated = False
+
+    def read(self, size: int = -1) -> bytes:
+        if self.truncated:
+            return b''
+        data = self.fileobj.read(size)
+        if data and not self.budget.take(len(data)):
+            data = data[:self.budget.remaining]
+            self.budget.take(len(data))
+            self.truncated = True
+        return data
+
+
+def skipped(name: str, reason: str) -> Dict:
+    return {'member': name, 'status': 'skipped', 'reason': reason}
+
+
+def scan_zip(open_file: Callable, scan_member: Callable, budget: ByteBudget,
+             workers: int = ARCHIVE_WORKERS) -> List[Dict]:
+    """scan_zip.
+    Scan the members of a zip archive concurrently.
+
+    Only the central directory and the members' own bytes are read, so on
+    an S3File the archive is never downloaded whole. Each worker opens its
+    own handle since file positions are not shareable between threads.
+
+    Args:
+        open_file: returns a new seekable handle on the archive, e.g. S3File
+        scan_member: scan_member(name, fileobj, seekable) -> Dict
+        budget (ByteBudget): uncompressed bytes left to scan
+        workers (int): members scanned at once
+
+    Returns:
+        List[Dict]: one result per file member, in archive order
+
+    Raises:
+        ArchiveError: if the central directory cannot be read
+    """
+    import zipfile
+
+    try:
+        with zipfile.ZipFile(open_file()) as archive:
+            members = [info for info in archive.infolist() if not info.is_dir()]
+    except zipfile.BadZipFile as e:
+        raise ArchiveError(f'Bad zip file: {e}') from e
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def run(info):
+        if not budget.take(info.file_size):
+            return skipped(info.filename, 'byte budget exhausted')
+        handle = getattr(local, 'archive', None)
+        if handle is None:
+            handle = local.archive = zipfile.ZipFile(open_file())
+            with handles_lock:
+                handles.append(handle)
+        with handle.open(info) as member:
+            return scan_member(info.filename, member, True)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(members)))) as executor:
+            return list(executor.map(run, members))
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def scan_tar(fileobj, scan_member: Callable, budget: ByteBudget) -> List[Dict]:
+    """scan_tar.
+    Scan the members of a (possibly gzipped) tar stream in order.
+
+    The archive is decompressed as a stream, so fileobj only needs read(),
+    e.g. an S3 StreamingBody.
+
+    Raises:
+        ArchiveError: if the tar stream is corrupt
+    """
+    import tarfile
+
+    results = []
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                if not budget.take(info.size):
+                    results.append(skipped(info.name, 'byte budget exhausted'))
+                    continue
+                results.append(scan_member(info.name, archive.extractfile(info), False))
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise ArchiveError(f'Bad tar stream: {e}') from e
+    return results
+
+
+def scan_gzip(fileobj, name: str, scan_member: Callable, budget: ByteBudget) -> List[Dict]:
+    """scan_gzip.
+    Scan the single member of a gzip stream, decompressed as it is read.
+
+    The uncompressed size is unknown up front, so the member is truncated
+    where the budget runs out. A corrupt stream shows up as the member's
+    error result.
+    """
+    import gzip
+
+    member_name = name[:-len('.gz')] if name.lower().endswith('.gz') else name
+    reader = BudgetReader(gzip.GzipFile(fileobj=fileobj, mode='rb'), budget)
+    result = scan_member(member_name, reader, False)
+    if reader.truncated:
+        result['truncated'] = True
+    return [result]
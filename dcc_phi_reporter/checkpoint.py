@@ -0,0 +1,156 @@
+import gzip
+import json
+import logging
+
+from typing import Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+try:
+    from .entities import EntityList
+except ImportError:  # Lambda loads app.py as a top-level module
+    from entities import EntityList
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+CHECKPOINT_SUFFIX = '.checkpoint.json.gz'
+# Chunks completed between two saves while a scan is running
+SAVE_EVERY_CHUNKS = 64
+VERSION = 1
+
+
+class Checkpoint:
+    """How far a detect_pii scan of one object got.
+
+    byte_offset and char_offset are where the last completed chunk starts
+    in the object, and entities holds everything found up to and including
+    it. Chunking is deterministic from a chunk start, so a resumed scan
+    chunks the object from byte_offset and drops the first chunk.
+
+    Args:
+        byte_offset (int): object byte offset of the last completed chunk
+        char_offset (int): its character offset
+        chunks (int): chunks completed so far
+        entities (EntityList): entities with document offsets
+        namespace (str): detector settings, a checkpoint is only resumed
+            under the same ones
+    """
+    __slots__ = ('byte_offset', 'char_offset', 'chunks', 'entities', 'namespace')
+
+    def __init__(self, byte_offset: int = 0, char_offset: int = 0, chunks: int = 0,
+                 entities: EntityList = None, namespace: str = ''):
+        self.byte_offset = byte_offset
+        self.char_offset = char_offset
+        self.chunks = chunks
+        self.entities = EntityList() if entities is None else entities
+        self.namespace = namespace
+
+    def __repr__(self):
+        return "<%s byte_offset=%d chunks=%d entities=%d>" % (
+            type(self).__name__, self.byte_offset, self.chunks, len(self.entities))
+
+    def encode(self) -> bytes:
+        """Gzipped JSON, entities as [type, begin, end, score] rows."""
+        found = self.entities
+        state = {
+            'version': VERSION,
+            'namespace': self.namespace,
+            'byte_offset': self.byte_offset,
+            'char_offset': self.char_offset,
+            'chunks': self.chunks,
+            'entities': [[found.types[type_id], begin, end, score] for type_id, begin, end, score
+                         in zip(found.type_ids, found.begins, found.ends, found.scores)],
+        }
+        return gzip.compress(json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def decode(cls, data: bytes) -> 'Checkpoint':
+        state = json.loads(gzip.decompress(data))
+        if state.get('version') != VERSION:
+            raise ValueError(f"Unsupported checkpoint version {state.get('version')!r}")
+        found = EntityList()
+        for entity_type, begin, end, score in state['entities']:
+            found.append(entity_type, begin, end, score)
+        return cls(state['byte_offset'], state['char_offset'], state['chunks'], found,
+                   state['namespace'])
+
+
+def checkpoint_location(checkpoint_prefix: str, jobId: str, taskId: str, etag: str) -> Tuple[str, str]:
+    """(bucket, key) of a task's checkpoint under an s3://bucket/prefix."""
+    if not checkpoint_prefix.startswith('s3://'):
+        raise ValueError(f'Checkpoint prefix must be s3://bucket/prefix, got {checkpoint_prefix!r}')
+    bucket, _, prefix = checkpoint_prefix[len('s3://'):].partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    etag = etag.strip('"')
+    return bucket, f'{prefix}{jobId}/{taskId}/{etag}{CHECKPOINT_SUFFIX}'
+
+
+class TaskCheckpoint:
+    """Checkpoint of one S3 Batch task's object, keyed by job, task and ETag.
+
+    Retries of a task keep its job and task ID, and a changed object gets
+    a new ETag, so a retry finds the state its previous attempt saved and
+    never state for other content. Storage errors are logged and otherwise
+    ignored: a lost checkpoint only costs a rescan.
+
+    Args:
+        s3_client: S3 client
+        checkpoint_prefix (str): s3://bucket/prefix
+        jobId (str): S3 Batch job ID
+        taskId (str): S3 Batch task ID
+        etag (str): ETag of the object being scanned
+        namespace (str): detector settings, see Checkpoint
+    """
+    def __init__(self, s3_client, checkpoint_prefix: str, jobId: str, taskId: str, etag: str,
+                 namespace: str = ''):
+        self.s3_client = s3_client
+        self.bucket, self.key = checkpoint_location(checkpoint_prefix, jobId, taskId, etag)
+        self.namespace = namespace
+        # Whether a checkpoint was loaded or saved, i.e. there is one to discard
+        self.exists = False
+
+    def __repr__(self):
+        return "<%s s3://%s/%s>" % (type(self).__name__, self.bucket, self.key)
+
+    def load(self) -> Optional[Checkpoint]:
+        """The saved checkpoint, None if there is none or it does not apply."""
+        try:
+            data = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)['Body'].read()
+            saved = Checkpoint.decode(data)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                logger.exception(f"Couldn't load checkpoint {self}")
+            return None
+        except (ValueError, KeyError, OSError):
+            logger.exception(f"Ignoring unreadable checkpoint {self}")
+            return None
+        if saved.namespace != self.namespace:
+            logger.info(f'Ignoring checkpoint {self} saved under settings {saved.namespace!r}')
+            return None
+        self.exists = True
+        logger.info(f'Resuming from {saved}')
+        return saved
+
+    def save(self, checkpoint: Checkpoint):
+        checkpoint.namespace = self.namespace
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=checkpoint.encode(),
+                                      ContentType='application/json', ContentEncoding='gzip')
+        except ClientError:
+            logger.exception(f"Couldn't save checkpoint {self}")
+            return
+        self.exists = True
+        logger.info(f'Saved {checkpoint} to {self}')
+
+    def discard(self):
+        """Delete the checkpoint once the scan is done, if there is one."""
+        if not self.exists:
+            return
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=self.key)
+        except ClientError:
+            logger.exception(f"Couldn't delete checkpoint {self}")
+            return
+        self.exists = False
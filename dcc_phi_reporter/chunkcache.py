@@ -0,0 +1,122 @@
+import json
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+CHUNK_CACHE_SIZE = 4096
+
+
+class ChunkCache:
+    """Memoizes Comprehend entities per chunk of text.
+
+    An in-memory LRU lives as long as the warm Lambda container; an
+    optional persistent tier (any resultcache.ResultCache) is consulted on
+    a miss and shared across containers. Entities are stored relative to
+    the chunk so they can be rebased wherever the same text shows up again.
+
+    Chunks are keyed on a SHA-256 of their exact text. Normalizing the text
+    (whitespace, case) before hashing would make cached offsets wrong.
+
+    Args:
+        max_entries (int): in-memory LRU size
+        persistent (resultcache.ResultCache): optional second tier
+        namespace (str): settings the entities depend on, e.g. language
+    """
+    def __init__(self, max_entries: int = CHUNK_CACHE_SIZE, persistent=None, namespace: str = 'en'):
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Keys being computed by get_or_compute, set once they are cached
+        self._pending = {}
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return f'chunk|{self.namespace}|{digest}'
+
+    def get(self, text: str) -> Optional[List[Dict]]:
+        found = self._lookup(self.key(text))
+        if found is None:
+            with self._lock:
+                self.misses += 1
+        return found
+
+    def get_or_compute(self, text: str, compute: Callable[[str], List[Dict]]) -> Tuple[List[Dict], bool]:
+        """get_or_compute.
+        Cached entities for text, else compute(text) stored in the cache.
+
+        Concurrent callers with the same text wait for the first one, so
+        repeated chunks in flight at once still cost one Comprehend call.
+
+        Returns:
+            Tuple[List[Dict], bool]: entities and whether they came from the cache
+        """
+        key = self.key(text)
+        while True:
+            found = self._lookup(key)
+            if found is not None:
+                return found, True
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Someone else is computing it, look again once they are done
+            pending.wait()
+
+        try:
+            found = compute(text)
+            self.put(text, found)
+        finally:
+            with self._lock:
+                self.misses += 1
+                del self._pending[key]
+            pending.set()
+        return found, False
+
+    def _lookup(self, key: str) -> Optional[List[Dict]]:
+        with self._lock:
+            found = self._entries.get(key)
+            if found is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return found
+
+        if self.persistent is not None:
+            try:
+                stored = self.persistent.get(key)
+            except Exception:
+                logger.exception('Chunk cache lookup failed')
+                stored = None
+            if stored is not None:
+                found = json.loads(stored)
+                self._remember(key, found)
+                with self._lock:
+                    self.hits += 1
+                return found
+        return None
+
+    def put(self, text: str, found: List[Dict]):
+        key = self.key(text)
+        self._remember(key, found)
+        if self.persistent is not None:
+            try:
+                self.persistent.put(key, json.dumps(found))
+            except Exception:
+                logger.exception('Chunk cache store failed')
+
+    def _remember(self, key: str, found: List[Dict]):
+        with self._lock:
+            self._entries[key] = found
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,157 @@
+import logging
+
+from typing import Iterable, Iterator, NamedTuple, Union
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+SENTENCE_ENDS = (b'. ', b'? ', b'! ', b'\n')
+WHITESPACE = (b' ', b'\t', b'\n', b'\r')
+
+
+class Chunk(NamedTuple):
+    text: str
+    byte_offset: int
+    char_offset: int
+
+    @property
+    def byte_size(self) -> int:
+        return len(self.text.encode('utf-8'))
+
+
+def _char_boundary(buf, start: int, end: int) -> int:
+    """Move end back so it does not split a UTF-8 sequence."""
+    while end > start and (buf[end] & 0xC0) == 0x80:
+        end -= 1
+    return end
+
+
+def find_break(buf, start: int, end: int) -> int:
+    """find_break.
+    Pick where to end a chunk that would otherwise run to buf[end].
+
+    Prefers a sentence boundary in the second half of the window, then the
+    last whitespace, and only cuts mid-word (on a character boundary) when
+    the window holds no whitespace at all.
+
+    Returns:
+        int: exclusive end of the chunk, start < result <= end
+    """
+    floor = start + (end - start) // 2
+    cut = -1
+    for sep in SENTENCE_ENDS:
+        index = buf.rfind(sep, floor, end)
+        if index >= 0:
+            cut = max(cut, index + len(sep))
+    if cut > start:
+        return cut
+
+    cut = max(buf.rfind(sep, start, end) for sep in WHITESPACE) + 1
+    if cut > start:
+        return cut
+
+    return _char_boundary(buf, start, end)
+
+
+def _check_limits(max_bytes: int, overlap: int):
+    if max_bytes < 4:
+        raise ValueError(f'max_bytes must be at least 4 (got {max_bytes})')
+    if overlap < 0 or overlap > max_bytes // 4:
+        raise ValueError(f'overlap must be between 0 and max_bytes // 4 (got {overlap})')
+
+
+def _decode(buf, start: int, end: int) -> str:
+    with memoryview(buf) as view, view[start:end] as part:
+        return str(part, 'utf-8')
+
+
+def iter_chunks(data: Union[str, bytes], max_bytes: int, overlap: int = 0) -> Iterator[Chunk]:
+    """iter_chunks.
+    Split data into chunks of at most max_bytes UTF-8 bytes.
+
+    Works on the encoded buffer so the limit is exact, breaks at sentence or
+    whitespace boundaries, and yields lazily. Without overlap the chunks
+    concatenate back to the original text; with overlap each chunk after the
+    first starts about overlap bytes before the previous one ended, so text
+    at a boundary is seen whole by at least one chunk.
+
+    Args:
+        data (str | bytes): text, or its UTF-8 encoding
+        max_bytes (int): byte limit per chunk
+        overlap (int): bytes shared between consecutive chunks
+
+    Yields:
+        Chunk: chunk text with its byte and character offset in data
+    """
+    _check_limits(max_bytes, overlap)
+    buf = data.encode('utf-8') if isinstance(data, str) else data
+    view = memoryview(buf)
+    pieces = (view[index:index + max_bytes] for index in range(0, len(buf), max_bytes))
+    return iter_stream_chunks(pieces, max_bytes, overlap=overlap)
+
+
+def iter_stream_chunks(pieces: Iterable[bytes], max_bytes: int, overlap: int = 0) -> Iterator[Chunk]:
+    """iter_stream_chunks.
+    iter_chunks over a stream of UTF-8 byte pieces of any size.
+
+    Only a rolling buffer of about max_bytes plus one piece is held, so
+    memory stays flat however long the stream is. Chunks end on character
+    boundaries, so each one is decoded on its own as it is cut.
+
+    Args:
+        pieces: UTF-8 bytes, e.g. StreamingBody.iter_chunks()
+        max_bytes (int): byte limit per chunk
+        overlap (int): bytes shared between consecutive chunks
+
+    Yields:
+        Chunk: chunk text with its byte and character offset in the stream
+    """
+    _check_limits(max_bytes, overlap)
+    pieces = iter(pieces)
+    buf = bytearray()
+    byte_offset = 0
+    char_offset = 0
+    eof = False
+    while True:
+        while not eof and len(buf) <= max_bytes:
+            piece = next(pieces, None)
+            if piece is None:
+                eof = True
+            else:
+                buf += piece
+        if not buf:
+            return
+
+        if eof and len(buf) <= max_bytes:
+            end = len(buf)
+        else:
+            end = find_break(buf, 0, max_bytes)
+
+        text = _decode(buf, 0, end)
+        yield Chunk(text, byte_offset, char_offset)
+
+        if eof and end == len(buf):
+            return
+
+        next_start = end
+        if overlap:
+            next_start = _overlap_start(buf, 0, end, overlap)
+        char_offset += len(text) - len(_decode(buf, next_start, end))
+        byte_offset += next_start
+        del buf[:next_start]
+
+
+def _overlap_start(buf, start: int, end: int, overlap: int) -> int:
+    """Start of the next chunk, at least overlap bytes before end on a word boundary."""
+    floor = end - overlap
+    if floor - start <= overlap:
+        # Chunk too short to share, overlapping would barely make progress
+        return end
+
+    lower = max(start + 1, end - 2 * overlap)
+    cut = max(buf.rfind(sep, lower, floor) for sep in WHITESPACE) + 1
+    if cut > lower:
+        return cut
+    cut = _char_boundary(buf, start, floor)
+    # A multibyte character can span the whole overlap, backing up to start
+    return cut if cut > start else end
@@ -0,0 +1,198 @@
+import time
+import random
+import logging
+import threading
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Callable, Iterable, Iterator, Optional
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+THROTTLE_CODES = {
+    'ThrottlingException',
+    'Throttling',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'SlowDown',
+}
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 0.1  # seconds
+BACKOFF_CAP = 5.0  # seconds
+# Stop this long before Lambda would kill the invocation
+DEADLINE_MARGIN_MS = 3000
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there is not enough invocation time left to keep going."""
+
+
+class Deadline:
+    """Tracks the remaining Lambda invocation time.
+
+    Args:
+        remaining_ms: callable returning milliseconds left, e.g.
+            context.get_remaining_time_in_millis
+        margin_ms (int): time kept in reserve to report results
+    """
+    def __init__(self, remaining_ms: Callable[[], int], margin_ms: int = DEADLINE_MARGIN_MS):
+        self.remaining_ms = remaining_ms
+        self.margin_ms = margin_ms
+
+    @classmethod
+    def from_context(cls, context, margin_ms: int = DEADLINE_MARGIN_MS):
+        """Build a Deadline from a Lambda context, None if it has no clock."""
+        remaining_ms = getattr(context, 'get_remaining_time_in_millis', None)
+        if remaining_ms is None:
+            return None
+        return cls(remaining_ms, margin_ms=margin_ms)
+
+    def seconds_left(self) -> float:
+        return max(0, self.remaining_ms() - self.margin_ms) / 1000
+
+    def expired(self) -> bool:
+        return self.remaining_ms() <= self.margin_ms
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(f'{self.remaining_ms()}ms left, stopping early')
+
+
+class AdaptiveLimiter:
+    """Concurrency limit adjusted by additive-increase/multiplicative-decrease.
+
+    Each successful call raises the limit by about one slot per limit's
+    worth of calls; each throttled call halves it.
+
+    Args:
+        max_limit (int): upper bound, normally the worker pool size
+        min_limit (int): lower bound
+    """
+    def __init__(self, max_limit: int, min_limit: int = 1, decrease: float = 0.5):
+        if max_limit < min_limit or min_limit < 1:
+            raise ValueError(f'Invalid limits: min {min_limit}, max {max_limit}')
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease = decrease
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.in_flight < int(self.limit), timeout=timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+def is_throttle(error: Exception) -> bool:
+    return isinstance(error, ClientError) and \
+        error.response.get('Error', {}).get('Code') in THROTTLE_CODES
+
+
+def backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff in seconds."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def call_with_retries(fn: Callable, item, limiter: AdaptiveLimiter,
+                      deadline: Optional[Deadline] = None, max_attempts: int = MAX_ATTEMPTS):
+    """call_with_retries.
+    Call fn(item) within the limiter, backing off and retrying on throttling.
+
+    Raises:
+        DeadlineExceeded: if the deadline passes before fn succeeds
+    """
+    attempt = 0
+    while True:
+        if deadline is not None:
+            deadline.check()
+        timeout = deadline.seconds_left() if deadline is not None else None
+        if not limiter.acquire(timeout=timeout):
+            raise DeadlineExceeded('Timed out waiting for a free slot')
+
+        throttled = False
+        try:
+            return fn(item)
+        except ClientError as e:
+            if not is_throttle(e) or attempt + 1 >= max_attempts:
+                raise
+            throttled = True
+        finally:
+            limiter.release(throttled=throttled)
+
+        delay = backoff(attempt)
+        attempt += 1
+        logger.info(f'Throttled, retry {attempt} in {delay:.2f}s (limit {limiter.limit:.1f})')
+        if deadline is not None and delay >= deadline.seconds_left():
+            raise DeadlineExceeded('Not enough time left to retry')
+        time.sleep(delay)
+
+
+def _result(future: Future, deadline: Optional[Deadline] = None):
+    """The future's result, waiting no longer than the deadline allows."""
+    if deadline is None:
+        return future.result()
+    try:
+        return future.result(timeout=deadline.seconds_left())
+    except TimeoutError:
+        future.cancel()
+        raise DeadlineExceeded('Timed out waiting for a call in flight') from None
+
+
+def imap_ordered(fn: Callable, items: Iterable, max_workers: int,
+                 limiter: Optional[AdaptiveLimiter] = None,
+                 deadline: Optional[Deadline] = None,
+                 executor: Optional[ThreadPoolExecutor] = None) -> Iterator:
+    """imap_ordered.
+    Apply fn to items concurrently and yield the results in input order.
+
+    At most 2 * max_workers items are pulled from items ahead of the
+    consumer, so a lazy iterable stays lazy.
+
+    Args:
+        fn: function of one item
+        items: iterable of items
+        max_workers (int): pool size
+        limiter (AdaptiveLimiter): shared limiter, one per call if None
+        deadline (Deadline): stop before the Lambda deadline
+        executor (ThreadPoolExecutor): shared pool, one per call if None
+
+    Raises:
+        DeadlineExceeded: if the deadline passes before all items are done
+    """
+    limiter = limiter or AdaptiveLimiter(max_workers)
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    pending = deque()
+    try:
+        for item in items:
+            if deadline is not None:
+                deadline.check()
+            pending.append(executor.submit(call_with_retries, fn, item, limiter, deadline))
+            while len(pending) >= 2 * max_workers:
+                yield _result(pending.popleft(), deadline)
+        while pending:
+            yield _result(pending.popleft(), deadline)
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            # Don't wait out a call still running past the deadline
+            executor.shutdown(wait=False)
@@ -0,0 +1,152 @@
+import heapq
+import logging
+
+from array import array
+from typing import Dict, Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+
+def rebase_entities(entities: Iterable[Dict], char_offset: int) -> List[Dict]:
+    """rebase_entities.
+    Shift chunk-relative Comprehend entities to whole-document offsets.
+
+    Args:
+        entities: Comprehend entity dicts for one chunk
+        char_offset (int): character offset of the chunk in the document
+
+    Returns:
+        List[Dict]: copies of the entities with BeginOffset/EndOffset shifted
+    """
+    rebased = []
+    for entity in entities:
+        entity = dict(entity)
+        entity['BeginOffset'] += char_offset
+        entity['EndOffset'] += char_offset
+        rebased.append(entity)
+    return rebased
+
+
+class EntityList:
+    """Entities held as parallel arrays rather than one dict each.
+
+    A dict per entity costs a few hundred bytes; here an entity is a type
+    id, two offsets and a score, about 26 bytes, so PHI-dense documents
+    stay flat in memory. Entities found in a window of a larger object
+    (sampling) also keep the window's byte offset, see origins.
+
+    Iterating yields Comprehend-style entity dicts, built on the fly.
+    """
+    __slots__ = ('types', '_type_ids', 'type_ids', 'begins', 'ends', 'scores', 'origins')
+
+    def __init__(self, entities: Iterable[Dict] = ()):
+        self.types = []
+        self._type_ids = {}
+        self.type_ids = array('H')
+        self.begins = array('q')
+        self.ends = array('q')
+        self.scores = array('d')
+        self.origins = None
+        self.extend(entities)
+
+    def __len__(self) -> int:
+        return len(self.begins)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, i: int) -> Dict:
+        entity = {
+            'Score': self.scores[i],
+            'Type': self.types[self.type_ids[i]],
+            'BeginOffset': self.begins[i],
+            'EndOffset': self.ends[i],
+        }
+        if self.origins is not None:
+            entity['WindowByteOffset'] = self.origins[i]
+        return entity
+
+    def type_id(self, entity_type: str) -> int:
+        type_id = self._type_ids.get(entity_type)
+        if type_id is None:
+            type_id = self._type_ids[entity_type] = len(self.types)
+            self.types.append(entity_type)
+        return type_id
+
+    def append(self, entity_type: str, begin: int, end: int, score: float, origin: int = None):
+        if origin is not None and self.origins is None:
+            self.origins = array('q', bytes(8 * len(self)))
+        self.type_ids.append(self.type_id(entity_type))
+        self.begins.append(begin)
+        self.ends.append(end)
+        self.scores.append(score)
+        if self.origins is not None:
+            self.origins.append(origin or 0)
+
+    def extend(self, entities: Iterable[Dict], char_offset: int = 0, origin: int = None):
+        """Append entity dicts, shifting their offsets by char_offset."""
+        for entity in entities:
+            self.append(entity['Type'], entity['BeginOffset'] + char_offset,
+                        entity['EndOffset'] + char_offset, entity['Score'],
+                        entity.get('WindowByteOffset', origin))
+
+    def summary(self, top_k: int = 10) -> Dict:
+        """summary.
+        Counts and highest score per type plus the top_k highest-scoring
+        entities as [type, begin, end, score] (and window offset when
+        sampled), in document order.
+        """
+        types = {}
+        for type_id, score in zip(self.type_ids, self.scores):
+            entry = types.setdefault(self.types[type_id], {'count': 0, 'score': 0.0})
+            entry['count'] += 1
+            entry['score'] = max(entry['score'], round(score, 4))
+
+        top = heapq.nlargest(top_k, range(len(self)), key=lambda i: (self.scores[i], -i))
+        offsets = []
+        for i in sorted(top):
+            item = [self.types[self.type_ids[i]], self.begins[i], self.ends[i], round(self.scores[i], 4)]
+            if self.origins is not None:
+                item.append(self.origins[i])
+            offsets.append(item)
+        return {'count': len(self), 'types': types, 'top': offsets}
+
+
+def merge_entities(entities: Iterable[Dict]) -> EntityList:
+    """merge_entities.
+    Deduplicate entities found more than once in overlapping windows.
+
+    Entities are indexed by (Type, BeginOffset) and swept in order; entities
+    of the same type whose spans overlap are merged into one spanning both
+    with the higher score. This also joins an entity truncated at one
+    window's edge with its complete copy from the next window. O(n log n).
+
+    Args:
+        entities: EntityList or entity dicts with whole-document offsets
+
+    Returns:
+        EntityList: merged entities ordered by BeginOffset
+    """
+    if not isinstance(entities, EntityList):
+        entities = EntityList(entities)
+    types, begins, ends, scores = entities.types, entities.begins, entities.ends, entities.scores
+    index = sorted(range(len(entities)),
+                   key=lambda i: (types[entities.type_ids[i]], begins[i], ends[i]))
+
+    # Runs of overlapping same-type entities as [type id, begin, end, score]
+    runs = []
+    for i in index:
+        current = runs[-1] if runs else None
+        if (current is not None and entities.type_ids[i] == current[0]
+                and begins[i] < current[2]):
+            current[2] = max(current[2], ends[i])
+            current[3] = max(current[3], scores[i])
+            continue
+        runs.append([entities.type_ids[i], begins[i], ends[i], scores[i]])
+
+    runs.sort(key=lambda run: (run[1], run[2]))
+    merged = EntityList()
+    for type_id, begin, end, score in runs:
+        merged.append(types[type_id], begin, end, score)
+    return merged
@@ -0,0 +1,290 @@
+import re
+import codecs
+import random
+import logging
+
+from json.decoder import scanstring
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+try:
+    from .tabular import DISTINCT_CAP, SAMPLE_SIZE
+except ImportError:  # Lambda loads app.py as a top-level module
+    from tabular import DISTINCT_CAP, SAMPLE_SIZE
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+# Strings at least this long with no whitespace and only base64/hex
+# characters are treated as binary blobs and not sent
+BLOB_MIN_CHARS = 256
+BLOB = re.compile(r'[A-Za-z0-9+/=_\-]*')
+DATA_URI = 'data:'
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Body of a JSON string up to (not including) its closing quote or a
+# trailing backslash whose escaped character has not arrived yet
+STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+SCALAR = re.compile(r'[^\s,\]\}:]+')
+_LITERAL = r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null'
+LITERAL = re.compile(_LITERAL)
+# Comma-separated literals, skipped in one match inside arrays
+LITERAL_RUN = re.compile(rf'(?:{_LITERAL})(?:[ \t\n\r]*,[ \t\n\r]*(?:{_LITERAL}))*')
+RUN_ENDS = (' ', '\t', '\n', '\r', ',', ']')
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*\Z')
+
+# Parser states
+VALUE = 'value'
+VALUE_OR_END = 'value or ]'
+KEY = 'key'
+KEY_OR_END = 'key or }'
+AFTER = 'after value'
+
+
+class JSONLeafError(ValueError):
+    """The stream is not (a sequence of) JSON documents."""
+
+
+def child_path(path: str, key) -> str:
+    """Path of an object member (key str) or array element (key None), arrays as [*]."""
+    if key is None:
+        return f'{path}[*]'
+    if IDENTIFIER.match(key):
+        return f'{path}.{key}'
+    return f'{path}[{key!r}]'
+
+
+def is_blob(value: str) -> bool:
+    """Whether a string leaf looks like base64/hex data rather than text."""
+    if value.startswith(DATA_URI):
+        return True
+    return len(value) >= BLOB_MIN_CHARS and BLOB.fullmatch(value) is not None
+
+
+class _Buffer:
+    """Text decoded incrementally from UTF-8 byte pieces, consumed from pos."""
+    def __init__(self, pieces: Iterable[bytes]):
+        self._pieces = iter(pieces)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Append the next piece, False at the end of the stream."""
+        if self.eof:
+            return False
+        piece = next(self._pieces, None)
+        if piece is None:
+            self.eof = True
+            added = self._decoder.decode(b'', final=True)
+        else:
+            added = self._decoder.decode(piece)
+        # Drop what has been consumed before growing the buffer
+        if self.pos > len(self.text) // 2:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        self.text += added
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character, '' at the end of the stream."""
+        while True:
+            self.pos = WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise JSONLeafError(f'Expected {char!r} at offset {self.pos}')
+        self.pos += 1
+
+    def string(self) -> str:
+        """Consume the string starting at pos and return its value."""
+        end = self.pos + 1
+        while True:
+            end = STRING_BODY.match(self.text, end).end()
+            if end < len(self.text) and self.text[end] == '"':
+                break
+            # Scanning resumes where it stopped, so long strings stay linear;
+            # fill() may drop the text before pos, which is where the string starts
+            start = self.pos
+            if not self.fill():
+                raise JSONLeafError(f'Unterminated string at offset {start}')
+            end -= start - self.pos
+
+        start = self.pos
+        self.pos = end + 1
+        raw = self.text[start + 1:end]
+        if '\\' not in raw:
+            return raw
+        try:
+            return scanstring(self.text, start + 1, False)[0]
+        except ValueError as e:
+            raise JSONLeafError(str(e)) from e
+
+    def scalar(self, in_array: bool = False):
+        """Consume a number, true, false or null at pos.
+
+        In an array a whole run of them is consumed at once, which keeps
+        numeric arrays cheap.
+        """
+        if in_array:
+            match = LITERAL_RUN.match(self.text, self.pos)
+            # A run cut off by the end of the buffer may continue in the next piece
+            if match is not None and self.text[match.end():match.end() + 1] in RUN_ENDS:
+                self.pos = match.end()
+                return
+        while True:
+            match = SCALAR.match(self.text, self.pos)
+            if match is None:
+                raise JSONLeafError(f'Unexpected {self.text[self.pos]!r} at offset {self.pos}')
+            if match.end() < len(self.text) or not self.fill():
+                if not LITERAL.fullmatch(match.group()):
+                    raise JSONLeafError(f'Unexpected {match.group()!r} at offset {self.pos}')
+                self.pos = match.end()
+                return
+
+
+def iter_string_leaves(pieces: Iterable[bytes]) -> Iterator[Tuple[str, str]]:
+    """iter_string_leaves.
+    Walk a JSON stream and yield its string values with their paths.
+
+    The document is never held whole: the walk keeps a stack of the
+    enclosing containers and a buffer of undecoded text. Object keys only
+    become part of paths, and numbers, booleans and nulls are skipped, so
+    numeric arrays cost nothing. Concatenated documents (JSON Lines) are
+    walked one after the other.
+
+    Args:
+        pieces: UTF-8 byte pieces of the document
+
+    Yields:
+        Tuple[str, str]: (path like '$.scenes[*].text', value)
+
+    Raises:
+        JSONLeafError: if the stream is not JSON
+    """
+    buffer = _Buffer(pieces)
+    # One (path, is_array) per open container
+    stack = []
+    path = '$'
+    state = VALUE
+    while True:
+        char = buffer.peek()
+        if not char:
+            if stack or state != AFTER:
+                raise JSONLeafError('Unexpected end of document')
+            return
+
+        if state == VALUE_OR_END and char == ']' or state == KEY_OR_END and char == '}':
+            buffer.pos += 1
+            path = stack.pop()[0]
+            state = AFTER
+        elif state in (VALUE, VALUE_OR_END):
+            if char == '{':
+                buffer.pos += 1
+                stack.append((path, False))
+                state = KEY_OR_END
+            elif char == '[':
+                buffer.pos += 1
+                stack.append((path, True))
+                path = child_path(path, None)
+                state = VALUE_OR_END
+            elif char == '"':
+                yield path, buffer.string()
+                state = AFTER
+            else:
+                buffer.scalar(in_array=bool(stack) and stack[-1][1])
+                state = AFTER
+        elif state in (KEY, KEY_OR_END):
+            if char != '"':
+                raise JSONLeafError(f'Expected a key at offset {buffer.pos}')
+            key = buffer.string()
+            buffer.expect(':')
+            path = child_path(stack[-1][0], key)
+            state = VALUE
+        elif not stack:
+            # Another document follows
+            path = '$'
+            state = VALUE
+        elif char == ',':
+            buffer.pos += 1
+            state = VALUE if stack[-1][1] else KEY
+        elif char == (']' if stack[-1][1] else '}'):
+            buffer.pos += 1
+            path = stack.pop()[0]
+        else:
+            raise JSONLeafError(f'Unexpected {char!r} at offset {buffer.pos}')
+
+
+class PathValues:
+    """Bounded distinct string values found at one JSON path.
+
+    Like tabular.ColumnValues, values are collected exactly, in the order
+    seen, until DISTINCT_CAP distinct values have been seen, then a
+    reservoir sample of the remaining values is kept. Values are not
+    truncated, a long string leaf is text to scan whole.
+    """
+    __slots__ = ('name', 'distinct', 'sample', 'overflow_seen', 'seen', 'cap', 'sample_size', '_rng')
+
+    def __init__(self, name: str, cap: int = DISTINCT_CAP, sample_size: int = SAMPLE_SIZE, seed: int = 0):
+        self.name = name
+        self.distinct = {}
+        self.sample = []
+        self.overflow_seen = 0
+        self.seen = 0
+        self.cap = cap
+        self.sample_size = sample_size
+        self._rng = random.Random(seed)
+
+    @property
+    def sampled(self) -> bool:
+        return self.overflow_seen > 0
+
+    def add(self, value: str):
+        self.seen += 1
+        if value in self.distinct:
+            return
+        if len(self.distinct) < self.cap:
+            self.distinct[value] = None
+            return
+        # Reservoir sample of values past the cap
+        self.overflow_seen += 1
+        if len(self.sample) < self.sample_size:
+            self.sample.append(value)
+        else:
+            index = self._rng.randrange(self.overflow_seen)
+            if index < self.sample_size:
+                self.sample[index] = value
+
+    def values(self) -> List[str]:
+        # Sampled values are never among the distinct ones, but may repeat
+        return list(self.distinct) + list(dict.fromkeys(self.sample))
+
+
+def collect_leaves(leaves: Iterable[Tuple[str, str]]) -> Tuple[List[PathValues], Dict]:
+    """collect_leaves.
+    Group string leaves by path, dropping blanks, blobs and repeats.
+
+    Returns:
+        Tuple[List[PathValues], Dict]: paths in document order and counts of
+            leaves seen, kept and skipped as blobs
+    """
+    paths = {}
+    counts = {'leaves': 0, 'blobs': 0}
+    for path, value in leaves:
+        counts['leaves'] += 1
+        value = value.strip()
+        if not value:
+            continue
+        if is_blob(value):
+            counts['blobs'] += 1
+            continue
+        values = paths.get(path)
+        if values is None:
+            values = paths[path] = PathValues(path)
+        values.add(value)
+    counts['distinct'] = sum(len(values.distinct) for values in paths.values())
+    return list(paths.values()), counts
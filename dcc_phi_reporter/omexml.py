@@ -0,0 +1,89 @@
+import io
+import logging
+
+from typing import Iterator, Tuple
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+ROOT = 'OME'
+# Attributes that hold names or free text wherever they appear
+FREE_TEXT_ATTRIBUTES = frozenset({
+    'Name', 'Description', 'FirstName', 'MiddleName', 'LastName', 'Email', 'Institution',
+    'UserName', 'Text', 'K',
+})
+# Elements whose text is free text wherever they appear
+FREE_TEXT_ELEMENTS = frozenset({'Description', 'Text'})
+# Every element text under these is kept (annotation and original metadata values)
+FREE_TEXT_SECTIONS = frozenset({'StructuredAnnotations'})
+# Pixel geometry and storage, repeated per plane and never free text
+SKIPPED_ELEMENTS = frozenset({'Plane', 'TiffData', 'BinData', 'UUID', 'MetadataOnly', 'BinaryFile'})
+
+
+class OMEXMLError(ValueError):
+    """The ImageDescription is not OME-XML."""
+
+
+def local_name(tag: str) -> str:
+    """Tag or attribute name without its '{namespace}' prefix."""
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_text_fields(description: str) -> Iterator[Tuple[str, str]]:
+    """iter_text_fields.
+    Walk OME-XML and yield the fields that can hold free text.
+
+    The XML is parsed incrementally and every element is cleared once
+    read, so no tree is built. Plane, TiffData and similar pixel elements
+    are skipped whole. XPaths carry no positions, so repeated elements
+    share a path; OriginalMetadata values are keyed by their Key, e.g.
+    /OME/StructuredAnnotations/XMLAnnotation/Value/OriginalMetadata[Key='Patient']/Value.
+
+    Args:
+        description (str): OME-XML, e.g. a TIFF ImageDescription
+
+    Yields:
+        Tuple[str, str]: (xpath, text)
+
+    Raises:
+        OMEXMLError: if description is not XML with an OME root
+    """
+    path = []
+    # Depth inside skipped elements
+    skipping = 0
+    original_key = None
+    try:
+        for event, element in ElementTree.iterparse(io.BytesIO(description.encode('utf-8')),
+                                                    events=('start', 'end')):
+            name = local_name(element.tag)
+            if event == 'start':
+                if not path and name != ROOT:
+                    raise OMEXMLError(f'Root element is {name}, not {ROOT}')
+                path.append(name)
+                if skipping or name in SKIPPED_ELEMENTS:
+                    skipping += 1
+                    continue
+                xpath = '/' + '/'.join(path)
+                for attribute, value in element.attrib.items():
+                    attribute = local_name(attribute)
+                    if attribute in FREE_TEXT_ATTRIBUTES and value.strip():
+                        yield f'{xpath}/@{attribute}', value
+                continue
+
+            if skipping:
+                skipping -= 1
+            else:
+                text = (element.text or '').strip()
+                parent = path[-2] if len(path) > 1 else None
+                if parent == 'OriginalMetadata' and name == 'Key':
+                    original_key = text
+                elif parent == 'OriginalMetadata' and name == 'Value':
+                    if text:
+                        yield '/' + '/'.join(path[:-1]) + f'[Key={original_key!r}]/Value', text
+                elif text and (name in FREE_TEXT_ELEMENTS or FREE_TEXT_SECTIONS.intersection(path)):
+                    yield '/' + '/'.join(path), text
+            path.pop()
+            element.clear()
+    except ElementTree.ParseError as e:
+        raise OMEXMLError(str(e)) from e
@@ -0,0 +1,84 @@
+import bisect
+import logging
+
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+# Put between packed documents so no sentence runs from one into the next
+SEPARATOR = '\n\n'
+
+
+class Pack(NamedTuple):
+    """Documents concatenated into one Comprehend request.
+
+    spans holds (document index, start, end) character ranges in text, in
+    order, with SEPARATOR between consecutive ranges.
+    """
+    text: str
+    spans: List[Tuple[int, int, int]]
+
+
+def pack_documents(documents: Sequence[str], max_bytes: int, separator: str = SEPARATOR) -> Iterator[Pack]:
+    """pack_documents.
+    Greedily concatenate documents, in order, into texts of at most max_bytes UTF-8 bytes.
+
+    Args:
+        documents: texts, each at most max_bytes UTF-8 bytes
+        max_bytes (int): byte limit per pack, e.g. the Comprehend request limit
+        separator (str): put between documents
+
+    Yields:
+        Pack: one per request
+
+    Raises:
+        ValueError: if a document is longer than max_bytes on its own
+    """
+    separator_bytes = len(separator.encode('utf-8'))
+    parts, spans = [], []
+    chars = size = 0
+    for index, document in enumerate(documents):
+        document_bytes = len(document.encode('utf-8'))
+        if document_bytes > max_bytes:
+            raise ValueError(f'Document {index} is {document_bytes} bytes, over the {max_bytes} byte limit')
+        if parts and size + separator_bytes + document_bytes > max_bytes:
+            yield Pack(''.join(parts), spans)
+            parts, spans = [], []
+            chars = size = 0
+        if parts:
+            parts.append(separator)
+            chars += len(separator)
+            size += separator_bytes
+        parts.append(document)
+        spans.append((index, chars, chars + len(document)))
+        chars += len(document)
+        size += document_bytes
+    if parts:
+        yield Pack(''.join(parts), spans)
+
+
+def split_entities(pack: Pack, found: Iterable[Dict]) -> Dict[int, List[Dict]]:
+    """split_entities.
+    Hand the entities found in a pack back to the documents they start in.
+
+    Offsets become relative to the document, entities that run past its
+    end are cut at it and entities starting in a separator are dropped.
+
+    Returns:
+        Dict[int, List[Dict]]: entities per document index, every document of the pack included
+    """
+    starts = [start for _, start, _ in pack.spans]
+    split = {index: [] for index, _, _ in pack.spans}
+    for entity in found:
+        position = bisect.bisect_right(starts, entity['BeginOffset']) - 1
+        if position < 0:
+            continue
+        index, start, end = pack.spans[position]
+        if entity['BeginOffset'] >= end:
+            continue
+        entity = dict(entity)
+        entity['BeginOffset'] -= start
+        entity['EndOffset'] = min(entity['EndOffset'], end) - start
+        split[index].append(entity)
+    return split
@@ -0,0 +1,140 @@
+import re
+import logging
+
+from collections import deque
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+# Prefilter policies
+OFF = 'off'
+SKIP_CLEAN = 'skip-clean'  # send only chunks with hits or free text
+CONFIRM_HITS = 'confirm-hits'  # send the whole document only if it has hits
+LOCAL_ONLY = 'local-only'  # never call Comprehend, report local hits
+POLICIES = (OFF, SKIP_CLEAN, CONFIRM_HITS, LOCAL_ONLY)
+
+# Chunk classes
+HIT = 'hit'
+CLEAN = 'clean'
+AMBIGUOUS = 'ambiguous'
+
+# Score given to local matches, below what Comprehend reports for the same text
+LOCAL_SCORE = 0.5
+# Chunks with fewer letters than this are numeric/structural, not free text
+CLEAN_ALPHA_RATIO = 0.25
+
+PATTERNS = {
+    'SSN': r'(?<!\d)\d{3}-\d{2}-\d{4}(?!\d)',
+    'MRN': r'\b(?i:MRN)[:#\s]*\d{5,10}\b',
+    'EMAIL': r'\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b',
+    'PHONE': r'(?<![\d-])(?:\+?1[-.\s]?)?(?:\(\d{3}\)\s?|\d{3}[-.\s])\d{3}[-.\s]\d{4}(?![\d-])',
+    'DATE_TIME': r'\b(?:\d{1,2}[/-]\d{1,2}[/-](?:\d{4}|\d{2})|\d{4}-\d{2}-\d{2})\b',
+    'ADDRESS': r'\b[A-Z]{2}\s+\d{5}(?:-\d{4})?\b',  # state + ZIP
+}
+
+DEFAULT_NAMES = (
+    'james', 'john', 'robert', 'michael', 'william', 'david', 'richard', 'joseph',
+    'thomas', 'charles', 'christopher', 'daniel', 'matthew', 'anthony', 'mark',
+    'mary', 'patricia', 'jennifer', 'linda', 'elizabeth', 'barbara', 'susan',
+    'jessica', 'sarah', 'karen', 'nancy', 'lisa', 'betty', 'margaret', 'sandra',
+    'smith', 'johnson', 'williams', 'brown', 'jones', 'garcia', 'miller', 'davis',
+    'rodriguez', 'martinez', 'hernandez', 'lopez', 'gonzalez', 'wilson', 'anderson',
+)
+
+
+class AhoCorasick:
+    """Multi-string matcher finding every dictionary word in one pass.
+
+    Matching is case-insensitive and only whole words are reported.
+    """
+    def __init__(self, words: Iterable[str]):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for word in words:
+            self._add(word.lower())
+        self._build()
+
+    def _add(self, word: str):
+        state = 0
+        for char in word:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        self._out[state] = self._out[state] + (len(word),)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def finditer(self, text: str):
+        """Yield (begin, end) of each whole-word dictionary match."""
+        lowered = text.lower()
+        state = 0
+        for index, char in enumerate(lowered):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length in self._out[state]:
+                begin = index + 1 - length
+                if (begin == 0 or not lowered[begin - 1].isalnum()) and \
+                        (index + 1 == len(lowered) or not lowered[index + 1].isalnum()):
+                    yield begin, index + 1
+
+
+class Prefilter:
+    """Local regex and names-dictionary screen run ahead of Comprehend.
+
+    Args:
+        names: dictionary of names, matched as whole words
+    """
+    def __init__(self, names: Iterable[str] = DEFAULT_NAMES):
+        self.pattern = re.compile('|'.join(f'(?P<{name}>{regex})'
+                                           for name, regex in PATTERNS.items()))
+        self.names = AhoCorasick(names)
+
+    def scan(self, text: str) -> List[Dict]:
+        """Return local hits in text as Comprehend-style entities."""
+        hits = [entity(match.lastgroup, match.start(), match.end())
+                for match in self.pattern.finditer(text)]
+        hits += [entity('NAME', begin, end) for begin, end in self.names.finditer(text)]
+        return hits
+
+    @staticmethod
+    def classify(text: str, hits: List[Dict]) -> str:
+        """Classify a chunk as HIT, CLEAN (no hits, little free text) or AMBIGUOUS."""
+        if hits:
+            return HIT
+        if not text:
+            return CLEAN
+        letters = sum(1 for char in text if char.isalpha())
+        return CLEAN if letters / len(text) < CLEAN_ALPHA_RATIO else AMBIGUOUS
+
+
+def entity(entity_type: str, begin: int, end: int) -> Dict:
+    return {'Score': LOCAL_SCORE, 'Type': entity_type, 'BeginOffset': begin, 'EndOffset': end}
+
+
+_prefilter = None
+
+
+def get_prefilter() -> Prefilter:
+    """Prefilter compiled once per container."""
+    global _prefilter
+    if _prefilter is None:
+        _prefilter = Prefilter()
+    return _prefilter
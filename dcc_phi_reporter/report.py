@@ -0,0 +1,134 @@
+import io
+import gzip
+import json
+import logging
+
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    from .entities import EntityList
+except ImportError:  # Lambda loads app.py as a top-level module
+    from entities import EntityList
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+# Longest resultString written to the S3 Batch completion report
+RESULT_STRING_LIMIT = 1024
+# Highest-scoring entity offsets kept per entity list in the summary
+TOP_K = 10
+# Keys holding per-column/path {name: {type: {'count', 'score'}}} reports
+NAMED_REPORTS = ('columns', 'paths', 'xpaths')
+# Scan counters, dropped before the entity summaries when over the limit
+STATS_KEY = 'stats'
+SIDECAR_SUFFIX = '.entities.jsonl.gz'
+
+
+def encode(result: Dict, top_k: int = TOP_K) -> str:
+    """Canonical JSON of a result, entity lists replaced by their summary."""
+    def default(value):
+        if isinstance(value, EntityList):
+            return value.summary(top_k)
+        raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+    return json.dumps(result, default=default, sort_keys=True, separators=(',', ':'),
+                      ensure_ascii=False)
+
+
+def iter_entity_lists(result: Dict) -> Iterator[Tuple[Optional[str], EntityList]]:
+    """(archive member or None, entities) for every entity list in a result."""
+    if isinstance(result.get('entities'), EntityList):
+        yield None, result['entities']
+    for member in result.get('members', ()):
+        if isinstance(member.get('entities'), EntityList):
+            yield member['member'], member['entities']
+
+
+def type_totals(result: Dict) -> Dict[str, Dict]:
+    """Entity counts and highest score per type over the whole result."""
+    totals = {}
+
+    def add(entity_type, count, score):
+        entry = totals.setdefault(entity_type, {'count': 0, 'score': 0.0})
+        entry['count'] += count
+        entry['score'] = max(entry['score'], score)
+
+    for _, found in iter_entity_lists(result):
+        for entity_type, entry in found.summary(top_k=0)['types'].items():
+            add(entity_type, entry['count'], entry['score'])
+    for part in [result] + list(result.get('members', ())):
+        for key in NAMED_REPORTS:
+            for types in part.get(key, {}).values():
+                for entity_type, entry in types.items():
+                    add(entity_type, entry['count'], entry['score'])
+    return totals
+
+
+def bounded(result: Dict, limit: int = None) -> str:
+    """bounded.
+    Encode a result in at most limit characters, dropping detail as needed.
+
+    The full result is tried first, then without top offsets, then without
+    its scan stats; past that only its scalar fields, the sidecar pointer
+    and per-type totals are kept, with 'truncated' set. The sidecar, if
+    any, always has everything.
+
+    Returns:
+        str: canonical JSON
+    """
+    limit = RESULT_STRING_LIMIT if limit is None else limit
+    for top_k in (TOP_K, 0):
+        encoded = encode(result, top_k)
+        if len(encoded) <= limit:
+            return encoded
+    if STATS_KEY in result:
+        encoded = encode({key: value for key, value in result.items() if key != STATS_KEY}, 0)
+        if len(encoded) <= limit:
+            return encoded
+
+    compact = {key: value for key, value in result.items()
+               if isinstance(value, (str, int, float, bool)) or value is None}
+    compact['truncated'] = True
+    types = sorted(type_totals(result).items(), key=lambda item: -item[1]['count'])
+    while True:
+        compact['types'] = dict(types)
+        encoded = encode(compact)
+        if len(encoded) <= limit or not types:
+            return encoded
+        types.pop()
+
+
+def sidecar_lines(result: Dict) -> Iterator[bytes]:
+    """JSON lines of a sidecar: the result (summaries, full top) then one line per entity."""
+    yield encode(result, top_k=TOP_K).encode('utf-8') + b'\n'
+    for member, found in iter_entity_lists(result):
+        for entity in found:
+            if member is not None:
+                entity['Member'] = member
+            yield json.dumps(entity, sort_keys=True, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def sidecar_location(results_prefix: str, s3Bucket: str, s3Key: str) -> Tuple[str, str]:
+    """(bucket, key) of the sidecar of s3://s3Bucket/s3Key under an s3://bucket/prefix."""
+    if not results_prefix.startswith('s3://'):
+        raise ValueError(f'Results prefix must be s3://bucket/prefix, got {results_prefix!r}')
+    bucket, _, prefix = results_prefix[len('s3://'):].partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    return bucket, f'{prefix}{s3Bucket}/{s3Key}{SIDECAR_SUFFIX}'
+
+
+def write_sidecar(s3_client, results_prefix: str, s3Bucket: str, s3Key: str, result: Dict) -> str:
+    """write_sidecar.
+    Write the full result and every entity as gzipped JSON lines.
+
+    Returns:
+        str: s3:// url of the sidecar object
+    """
+    bucket, key = sidecar_location(results_prefix, s3Bucket, s3Key)
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as out:
+        out.writelines(sidecar_lines(result))
+    s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue(),
+                         ContentType='application/x-ndjson', ContentEncoding='gzip')
+    return f's3://{bucket}/{key}'
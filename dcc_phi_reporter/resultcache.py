@@ -0,0 +1,122 @@
+import time
+import sqlite3
+import logging
+import threading
+
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+SQLITE_SCHEME = 'sqlite://'
+DYNAMODB_SCHEME = 'dynamodb://'
+
+
+def cache_key(etag: str, size: int, namespace: str = '') -> str:
+    """cache_key.
+    Content address for an S3 object's scan result.
+
+    The ETag is the MD5 of single-part uploads but depends on the part
+    sizes of multipart ones, so copies uploaded differently miss each
+    other's entries; that only costs a rescan. S3's SHA-256 checksum has
+    the same problem, multipart objects get a composite "-N" checksum.
+
+    Args:
+        etag (str): S3 ETag
+        size (int): ContentLength
+        namespace (str): detector settings the result depends on
+
+    Returns:
+        str:
+    """
+    etag = etag.strip('"')
+    return f'{namespace}|etag:{etag}|{size}'
+
+
+class ResultCache:
+    """Maps cache keys to stored scan results."""
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def put(self, key: str, value: str):
+        raise NotImplementedError
+
+
+class SQLiteResultCache(ResultCache):
+    """Local-file backend for tests and batch runs.
+
+    Args:
+        path (str): database file, ':memory:' for a throwaway cache
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS results '
+                               '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)')
+
+    def __repr__(self):
+        return "<%s path=%r>" % (type(self).__name__, self.path)
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)',
+                               (key, value, time.time()))
+
+
+class DynamoDBResultCache(ResultCache):
+    """DynamoDB backend for production, partition key 'cache_key' (S).
+
+    Args:
+        table_name (str): table name
+        client: DynamoDB client, created on first use if None
+    """
+    def __init__(self, table_name: str, client=None):
+        self.table_name = table_name
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client('dynamodb')
+        return self._client
+
+    def __repr__(self):
+        return "<%s table_name=%r>" % (type(self).__name__, self.table_name)
+
+    def get(self, key):
+        item = self.client.get_item(TableName=self.table_name,
+                                    Key={'cache_key': {'S': key}}).get('Item')
+        return item['result']['S'] if item else None
+
+    def put(self, key, value):
+        self.client.put_item(TableName=self.table_name, Item={
+            'cache_key': {'S': key},
+            'result': {'S': value},
+            'created': {'N': str(int(time.time()))},
+        })
+
+
+def from_url(url: Optional[str]) -> Optional[ResultCache]:
+    """from_url.
+    Build a cache from 'sqlite://<path>' or 'dynamodb://<table>'.
+
+    Returns:
+        ResultCache: None if url is empty
+    """
+    if not url:
+        return None
+    if url.startswith(SQLITE_SCHEME):
+        return SQLiteResultCache(url[len(SQLITE_SCHEME):])
+    if url.startswith(DYNAMODB_SCHEME):
+        return DynamoDBResultCache(url[len(DYNAMODB_SCHEME):])
+    raise ValueError(f'Unsupported result cache url {url!r}')
@@ -0,0 +1,114 @@
+import zlib
+import logging
+
+try:
+    from . import archive, tabular
+except ImportError:  # Lambda loads app.py as a top-level module
+    import archive
+    import tabular
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+# Bytes fetched to sniff an object's content type
+SNIFF_BYTES = 8 * 1024
+
+TEXT = 'text/plain'
+CSV = 'text/csv'
+TSV = 'text/tab-separated-values'
+JSON = 'application/json'
+TIFF = 'image/tiff'
+ZIP = 'application/zip'
+TAR = 'application/x-tar'
+GZIP = 'application/gzip'
+BINARY = 'application/octet-stream'
+
+# (magic bytes at offset 0, mimetype), checked in order
+SIGNATURES = (
+    (b'II*\x00', TIFF),
+    (b'MM\x00*', TIFF),
+    (b'II+\x00', TIFF),  # BigTIFF
+    (b'MM\x00+', TIFF),
+    (b'PK\x03\x04', ZIP),
+    (b'PK\x05\x06', ZIP),  # empty zip
+    (b'\x1f\x8b', GZIP),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'%PDF-', 'application/pdf'),
+    (b'BZh', 'application/x-bzip2'),
+    (b'\xfd7zXZ\x00', 'application/x-xz'),
+)
+# ustar magic in the first tar header block
+TAR_MAGIC_OFFSET = 257
+TAR_MAGIC = b'ustar'
+TAR_BLOCK = 512
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def is_tar(header: bytes) -> bool:
+    return header[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + len(TAR_MAGIC)] == TAR_MAGIC
+
+
+def gunzip_head(head: bytes, size: int = TAR_BLOCK) -> bytes:
+    """First size decompressed bytes of a gzip stream's head, b'' if it is corrupt."""
+    try:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(head, size)
+    except zlib.error:
+        return b''
+
+
+def is_text(head: bytes, complete: bool) -> bool:
+    """is_text.
+    Whether head decodes as UTF-8 text without NUL bytes.
+
+    A character cut off at the end of an incomplete head does not count
+    against it.
+    """
+    if b'\x00' in head:
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        return not complete and e.reason == 'unexpected end of data' and e.start >= len(head) - 3
+    return True
+
+
+def detect_mimetype(head: bytes, key: str = '', complete: bool = False) -> str:
+    """detect_mimetype.
+    Content type of an object from its first bytes.
+
+    Magic bytes decide binary formats, gzip streams are peeked into to
+    tell .tar.gz from a single gzipped file. The key's extension is only
+    used to tell CSV/TSV from other text and for tar archives without a
+    ustar header.
+
+    Args:
+        head (bytes): first bytes of the object, see SNIFF_BYTES
+        key (str): object key
+        complete (bool): whether head is the whole object
+
+    Returns:
+        str: mimetype, BINARY if the content is not recognized
+    """
+    for magic, mimetype in SIGNATURES:
+        if head.startswith(magic):
+            if mimetype == GZIP and is_tar(gunzip_head(head)):
+                return TAR
+            return mimetype
+    if is_tar(head):
+        return TAR
+
+    if is_text(head, complete):
+        delimiter = tabular.delimiter_for(key)
+        if delimiter is not None:
+            return TSV if delimiter == '\t' else CSV
+        body = head[len(UTF8_BOM):] if head.startswith(UTF8_BOM) else head
+        if body.lstrip()[:1] in (b'{', b'['):
+            return JSON
+        return TEXT
+
+    if archive.archive_kind(key) == archive.TAR:
+        return TAR
+    return BINARY
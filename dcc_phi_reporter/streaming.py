@@ -0,0 +1,109 @@
+import queue
+import logging
+import threading
+
+from typing import Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+# Bytes per StreamingBody read
+STREAM_READ_SIZE = 256 * 1024
+# Pieces downloaded ahead of the chunker
+STREAM_PREFETCH = 4
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable: Iterable, depth: int = STREAM_PREFETCH) -> Iterator:
+    """prefetch.
+    Pull items from iterable on a background thread, at most depth ahead.
+
+    Lets the download of the next pieces of an object overlap with
+    detection on the current one while keeping memory bounded. Errors from
+    iterable are re-raised in the consumer.
+
+    Args:
+        iterable: e.g. StreamingBody.iter_chunks()
+        depth (int): queue size
+
+    Yields:
+        items of iterable, in order
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(_Failure(e))
+            return
+        put(_DONE)
+
+    producer = threading.Thread(target=produce, name='prefetch', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def memory_bound(window_size: int, max_workers: int,
+                 read_size: int = STREAM_READ_SIZE, depth: int = STREAM_PREFETCH) -> int:
+    """memory_bound.
+    Upper bound in bytes on the text held while streaming one object.
+
+    Counts the prefetched pieces, the chunker's rolling buffer and the
+    windows queued for or held by Comprehend workers (UTF-8 and decoded
+    copies). Entities found are extra and grow with the PII found.
+    """
+    pieces = (depth + 2) * read_size
+    rolling = window_size + read_size
+    # imap_ordered keeps up to 2 * max_workers windows in flight, each held
+    # as text (up to 4 bytes per character in CPython) alongside its bytes
+    windows = (2 * max_workers + 1) * window_size * 5
+    return pieces + rolling + windows
+
+
+class PieceReader:
+    """Minimal read()-only file over an iterable of byte pieces, e.g. for tarfile's stream mode."""
+    def __init__(self, pieces: Iterable[bytes]):
+        self._pieces = iter(pieces)
+        self._buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            data = self._buffer + b''.join(self._pieces)
+            self._buffer = b''
+            return data
+        while len(self._buffer) < size:
+            piece = next(self._pieces, None)
+            if piece is None:
+                break
+            self._buffer += piece
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
@@ -0,0 +1,157 @@
+import csv
+import codecs
+import random
+import bisect
+import logging
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+DELIMITERS = {
+    '.csv': ',',
+    '.tsv': '\t',
+}
+# Distinct values kept exactly per column before switching to sampling
+DISTINCT_CAP = 2000
+# Values sampled per column once the cap is reached
+SAMPLE_SIZE = 500
+# Longest value sent, longer cells are truncated
+MAX_VALUE_CHARS = 500
+
+
+def delimiter_for(key: str):
+    """Delimiter for a tabular key, None if the key is not CSV/TSV."""
+    for extension, delimiter in DELIMITERS.items():
+        if key.lower().endswith(extension):
+            return delimiter
+    return None
+
+
+def iter_text_lines(pieces: Iterable[bytes]) -> Iterator[str]:
+    """Decode a stream of UTF-8 byte pieces into '\n'-terminated lines."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    pending = ''
+    for piece in pieces:
+        # The last line may continue in the next piece
+        *lines, pending = (pending + decoder.decode(piece)).split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+class ColumnValues:
+    """Bounded distinct-value set for one column.
+
+    Values are collected exactly until DISTINCT_CAP distinct values have
+    been seen, then a reservoir sample of the remaining values is kept.
+    """
+    __slots__ = ('name', 'distinct', 'sample', 'overflow_seen', 'cap', 'sample_size', '_rng')
+
+    def __init__(self, name: str, cap: int = DISTINCT_CAP, sample_size: int = SAMPLE_SIZE, seed: int = 0):
+        self.name = name
+        self.distinct = set()
+        self.sample = []
+        self.overflow_seen = 0
+        self.cap = cap
+        self.sample_size = sample_size
+        self._rng = random.Random(seed)
+
+    @property
+    def sampled(self) -> bool:
+        return self.overflow_seen > 0
+
+    def add(self, value: str):
+        value = value.strip()[:MAX_VALUE_CHARS]
+        if not value or value in self.distinct:
+            return
+        if len(self.distinct) < self.cap:
+            self.distinct.add(value)
+            return
+        # Reservoir sample of values past the cap
+        self.overflow_seen += 1
+        if len(self.sample) < self.sample_size:
+            self.sample.append(value)
+        else:
+            index = self._rng.randrange(self.overflow_seen)
+            if index < self.sample_size:
+                self.sample[index] = value
+
+    def values(self) -> List[str]:
+        return sorted(self.distinct.union(self.sample))
+
+
+def profile_table(lines: Iterable[str], delimiter: str) -> Tuple[List[ColumnValues], int]:
+    """profile_table.
+    Stream rows and collect bounded distinct values per column.
+
+    The first row is taken as the header; rows wider than the header get
+    positional column names.
+
+    Returns:
+        Tuple[List[ColumnValues], int]: columns and number of data rows
+    """
+    reader = csv.reader(lines, delimiter=delimiter)
+    header = next(reader, None)
+    if header is None:
+        return [], 0
+
+    columns = [ColumnValues(name.strip() or f'column_{i}', seed=i) for i, name in enumerate(header)]
+    rows = 0
+    for row in reader:
+        rows += 1
+        for i, value in enumerate(row):
+            if i >= len(columns):
+                columns.append(ColumnValues(f'column_{i}', seed=i))
+            columns[i].add(value)
+    return columns, rows
+
+
+def pack_values(columns: List[ColumnValues]) -> Tuple[str, List[int], List[str]]:
+    """pack_values.
+    Lay out the distinct values as 'column: value' lines for detection.
+
+    The column name gives Comprehend context (e.g. 'patient_dob: ...').
+
+    Returns:
+        Tuple[str, List[int], List[str]]: text, character offset where each
+            line starts and the column each line belongs to
+    """
+    parts = []
+    starts = []
+    owners = []
+    offset = 0
+    for column in columns:
+        for value in column.values():
+            line = f'{column.name}: {value}\n'
+            parts.append(line)
+            starts.append(offset)
+            owners.append(column.name)
+            offset += len(line)
+    return ''.join(parts), starts, owners
+
+
+def column_report(found: List[Dict], starts: List[int], owners: List[str]) -> Dict[str, Dict]:
+    """column_report.
+    Map entities in the packed text back to their columns.
+
+    Returns:
+        Dict[str, Dict]: {column: {entity type: {'count': n, 'score': max score}}}
+    """
+    report = {}
+    for entity in found:
+        index = bisect.bisect_right(starts, entity['BeginOffset']) - 1
+        if index < 0:
+            continue
+        # Ignore hits on the 'column: ' prefix itself
+        value_start = starts[index] + len(owners[index]) + 2
+        if entity['EndOffset'] <= value_start:
+            continue
+        types = report.setdefault(owners[index], {})
+        summary = types.setdefault(entity['Type'], {'count': 0, 'score': 0.0})
+        summary['count'] += 1
+        summary['score'] = max(summary['score'], round(entity['Score'], 4))
+    return report
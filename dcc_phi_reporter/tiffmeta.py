@@ -0,0 +1,361 @@
+import struct
+import logging
+
+from collections import deque
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel('INFO')
+
+IMAGE_DESCRIPTION = 270
+SUB_IFDS = 330
+EXIF_IFD = 34665
+EXIF_USER_COMMENT = 37510
+
+TAG_NAMES = {
+    269: 'DocumentName',
+    270: 'ImageDescription',
+    271: 'Make',
+    272: 'Model',
+    285: 'PageName',
+    305: 'Software',
+    306: 'DateTime',
+    315: 'Artist',
+    316: 'HostComputer',
+    700: 'XMP',
+    33432: 'Copyright',
+    36867: 'DateTimeOriginal',
+    37510: 'UserComment',
+    42016: 'ImageUniqueID',
+    42032: 'CameraOwnerName',
+    42033: 'BodySerialNumber',
+}
+# Tags pointing at further IFDs to walk
+IFD_POINTER_TAGS = {SUB_IFDS, EXIF_IFD}
+# Binary payloads stored as UNDEFINED/ASCII that never hold free text
+SKIPPED_TAGS = {
+    347,    # JPEGTables
+    33723,  # IPTC
+    34675,  # ICC profile
+    37724,  # ImageSourceData
+}
+ASCII = 2
+UNDEFINED = 7
+TEXT_TYPES = {ASCII, UNDEFINED}
+# Offset formats of the LONG, IFD, LONG8 and IFD8 types
+OFFSET_TYPES = {4: 'I', 13: 'I', 16: 'Q', 18: 'Q'}
+# Exif UserComment starts with an 8-byte character code
+USER_COMMENT_CODES = (b'ASCII\x00\x00\x00', b'UNICODE\x00', b'\x00' * 8)
+
+# IFDs walked per file, guards against offset loops and huge stacks
+MAX_IFDS = 10000
+# Longest tag value read, larger ones are skipped
+MAX_TAG_BYTES = 1024 * 1024
+# Values closer than this are fetched in one read
+COALESCE_GAP = 64 * 1024
+# Largest single coalesced read
+MAX_COALESCED_BYTES = 8 * 1024 * 1024
+# Share of printable characters for an UNDEFINED value to count as text
+MIN_PRINTABLE_RATIO = 0.9
+
+# TIFF field types whose values are a plain run of bytes
+BYTE_TYPES = {
+    1: 'BYTE',
+    2: 'ASCII',
+    7: 'UNDEFINED',
+}
+
+# (entry count format, entry format, entry size, inline value size)
+CLASSIC_LAYOUT = ('H', 'HHI4s', 12, 4)
+BIGTIFF_LAYOUT = ('Q', 'HHQ8s', 20, 8)
+
+
+class TiffLayoutError(ValueError):
+    """The file is not a TIFF layout the header-only reader understands."""
+
+
+def _read_exact(fh, offset, size):
+    fh.seek(offset)
+    data = fh.read(size)
+    if len(data) != size:
+        raise TiffLayoutError(f'Short read at offset {offset} ({len(data)} of {size} bytes)')
+    return data
+
+
+def read_header(fh):
+    """read_header.
+    Parse a TIFF or BigTIFF header.
+
+    Args:
+        fh: seekable binary file object (e.g. S3File)
+
+    Returns:
+        tuple: (byteorder, layout, first IFD offset)
+    """
+    header = _read_exact(fh, 0, 16)
+    if header[:2] == b'II':
+        byteorder = '<'
+    elif header[:2] == b'MM':
+        byteorder = '>'
+    else:
+        raise TiffLayoutError('Not a TIFF file')
+
+    version = struct.unpack(byteorder + 'H', header[2:4])[0]
+    if version == 42:
+        layout = CLASSIC_LAYOUT
+        ifd_offset = struct.unpack(byteorder + 'I', header[4:8])[0]
+    elif version == 43:
+        offset_size, reserved = struct.unpack(byteorder + 'HH', header[4:8])
+        if offset_size != 8 or reserved != 0:
+            raise TiffLayoutError('Unsupported BigTIFF offset size')
+        layout = BIGTIFF_LAYOUT
+        ifd_offset = struct.unpack(byteorder + 'Q', header[8:16])[0]
+    else:
+        raise TiffLayoutError(f'Unknown TIFF version {version}')
+
+    if ifd_offset == 0:
+        raise TiffLayoutError('TIFF has no IFD')
+
+    return byteorder, layout, ifd_offset
+
+
+def read_ifd_entries(fh, byteorder, layout, ifd_offset):
+    """read_ifd_entries.
+    Read the raw entries of the IFD at ifd_offset.
+
+    Returns:
+        tuple: (list of (tag, type, count, value bytes), next IFD offset)
+    """
+    count_fmt, entry_fmt, entry_size, _ = layout
+    count_size = struct.calcsize(count_fmt)
+    count = struct.unpack(byteorder + count_fmt, _read_exact(fh, ifd_offset, count_size))[0]
+    if count == 0 or count > 4096:
+        raise TiffLayoutError(f'Implausible IFD entry count {count}')
+
+    # Entries and the next IFD offset are contiguous, fetch them in one read
+    next_fmt = 'I' if layout is CLASSIC_LAYOUT else 'Q'
+    table = _read_exact(fh, ifd_offset + count_size,
+                        count * entry_size + struct.calcsize(next_fmt))
+
+    entries = []
+    for i in range(count):
+        entries.append(struct.unpack_from(byteorder + entry_fmt, table, i * entry_size))
+    next_offset = struct.unpack_from(byteorder + next_fmt, table, count * entry_size)[0]
+    return entries, next_offset
+
+
+def value_location(byteorder, layout, value_field, count):
+    """Return (offset, size) of an out-of-line byte value, or None if inline."""
+    inline_size = layout[3]
+    if count <= inline_size:
+        return None
+    offset_fmt = 'I' if layout is CLASSIC_LAYOUT else 'Q'
+    return struct.unpack(byteorder + offset_fmt, value_field)[0], count
+
+
+def decode_value(raw: bytes) -> str:
+    raw = raw.rstrip(b'\x00')
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('latin-1')
+
+
+def read_image_description(fh) -> str:
+    """read_image_description.
+    Fetch only the bytes holding the first page's ImageDescription.
+
+    Parses the header and first IFD and then reads the tag value directly,
+    so on an S3File this costs two or three small ranged GETs no matter how
+    large the image is.
+
+    Args:
+        fh: seekable binary file object (e.g. S3File)
+
+    Returns:
+        str: ImageDescription, '' if the first page has none
+
+    Raises:
+        TiffLayoutError: if the layout is not understood
+    """
+    byteorder, layout, ifd_offset = read_header(fh)
+    entries, _ = read_ifd_entries(fh, byteorder, layout, ifd_offset)
+
+    for tag, dtype, count, value_field in entries:
+        if tag != IMAGE_DESCRIPTION:
+            continue
+        if dtype not in BYTE_TYPES:
+            raise TiffLayoutError(f'ImageDescription has unexpected type {dtype}')
+        location = value_location(byteorder, layout, value_field, count)
+        if location is None:
+            return decode_value(value_field[:count])
+        return decode_value(_read_exact(fh, *location))
+
+    return ''
+
+
+class TagValue(NamedTuple):
+    """Decoded text value of one tag."""
+    ifd: int
+    tag: int
+    name: str
+    value: str
+
+
+def tag_name(tag: int) -> str:
+    return TAG_NAMES.get(tag, f'Tag{tag}')
+
+
+def ifd_offsets(fh, byteorder, layout, dtype, count, value_field) -> List[int]:
+    """Offsets stored in an IFD pointer tag (SubIFDs, ExifIFD)."""
+    fmt = OFFSET_TYPES.get(dtype)
+    if fmt is None:
+        return []
+    size = struct.calcsize(fmt) * count
+    raw = value_field[:size] if size <= layout[3] else _read_exact(
+        fh, struct.unpack(byteorder + ('I' if layout is CLASSIC_LAYOUT else 'Q'), value_field)[0], size)
+    return list(struct.unpack(f'{byteorder}{count}{fmt}', raw))
+
+
+def iter_ifds(fh, max_ifds: int = MAX_IFDS) -> Iterator[Tuple[str, Tuple, List]]:
+    """iter_ifds.
+    Walk every IFD: the page chain and the SubIFD and Exif IFDs hanging
+    off it (reduced resolutions, label and macro images, camera data).
+
+    An IFD that cannot be read past the first one ends its branch with a
+    warning instead of failing the walk.
+
+    Yields:
+        tuple: (byteorder, layout, list of (tag, type, count, value bytes))
+    """
+    byteorder, layout, first = read_header(fh)
+    pending = deque([first])
+    seen = set()
+    while pending and len(seen) < max_ifds:
+        offset = pending.popleft()
+        if offset == 0 or offset in seen:
+            continue
+        seen.add(offset)
+        try:
+            entries, next_offset = read_ifd_entries(fh, byteorder, layout, offset)
+        except TiffLayoutError as e:
+            if len(seen) == 1:
+                raise
+            logger.warning(f'Skipping IFD at offset {offset}: {e}')
+            continue
+        yield byteorder, layout, entries
+
+        pending.append(next_offset)
+        for tag, dtype, count, value_field in entries:
+            if tag in IFD_POINTER_TAGS:
+                pending.extend(ifd_offsets(fh, byteorder, layout, dtype, count, value_field))
+    if pending:
+        logger.warning(f'Stopped after {max_ifds} IFDs')
+
+
+def plan_ranges(locations, gap: int = COALESCE_GAP,
+                max_size: int = MAX_COALESCED_BYTES) -> List[Tuple[int, int]]:
+    """plan_ranges.
+    Merge (offset, size) locations into as few [start, end) reads as
+    possible, joining ranges less than gap bytes apart up to max_size.
+
+    Returns:
+        List[Tuple[int, int]]: sorted, non-overlapping [start, end) ranges
+    """
+    ranges = []
+    for offset, size in sorted(locations):
+        end = offset + size
+        if ranges and offset - ranges[-1][1] <= gap and max(end, ranges[-1][1]) - ranges[-1][0] <= max_size:
+            ranges[-1][1] = max(end, ranges[-1][1])
+        else:
+            ranges.append([offset, end])
+    return [tuple(r) for r in ranges]
+
+
+def read_ranges(fh, locations) -> Dict[Tuple[int, int], bytes]:
+    """read_ranges.
+    Read many (offset, size) locations with one read per planned range.
+
+    Uses fh.read_range when available (S3File, one GET per range that
+    bypasses its block cache), seek and read otherwise.
+
+    Returns:
+        Dict[Tuple[int, int], bytes]: bytes per location
+    """
+    locations = set(locations)
+    if not locations:
+        return {}
+    ordered = sorted(locations)
+    values = {}
+    index = 0
+    for start, end in plan_ranges(ordered):
+        if hasattr(fh, 'read_range'):
+            data = fh.read_range(start, end)
+        else:
+            data = _read_exact(fh, start, end - start)
+        while index < len(ordered) and ordered[index][0] < end:
+            offset, size = ordered[index]
+            values[ordered[index]] = data[offset - start:offset - start + size]
+            index += 1
+    return values
+
+
+def is_printable(raw: bytes) -> bool:
+    """Whether an UNDEFINED value is UTF-8 text rather than binary data."""
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+    if not text:
+        return False
+    printable = sum(1 for char in text if char.isprintable() or char in '\t\r\n')
+    return printable / len(text) >= MIN_PRINTABLE_RATIO
+
+
+def read_text_tags(fh, max_ifds: int = MAX_IFDS, max_value_bytes: int = MAX_TAG_BYTES) -> Tuple[List[TagValue], int]:
+    """read_text_tags.
+    Read every ASCII and text-like UNDEFINED tag of every IFD.
+
+    The IFD tables are walked first, then all out-of-line values are read
+    through read_ranges, so values that sit near each other, as in most
+    writers' layouts, cost one request between them.
+
+    Args:
+        fh: seekable binary file object (e.g. S3File)
+        max_ifds (int): IFDs walked at most
+        max_value_bytes (int): longer values are skipped
+
+    Returns:
+        Tuple[List[TagValue], int]: non-empty values in IFD order and the
+            number of IFDs walked
+
+    Raises:
+        TiffLayoutError: if the header or first IFD is not understood
+    """
+    found = []
+    ifds = 0
+    for byteorder, layout, entries in iter_ifds(fh, max_ifds):
+        for tag, dtype, count, value_field in entries:
+            if dtype not in TEXT_TYPES or tag in SKIPPED_TAGS:
+                continue
+            if count > max_value_bytes:
+                logger.info(f'Skipping {tag_name(tag)} of IFD {ifds}, {count} bytes')
+                continue
+            location = value_location(byteorder, layout, value_field, count)
+            found.append((ifds, tag, dtype, location or value_field[:count]))
+        ifds += 1
+
+    fetched = read_ranges(fh, [raw for _, _, _, raw in found if isinstance(raw, tuple)])
+    values = []
+    for ifd, tag, dtype, raw in found:
+        if isinstance(raw, tuple):
+            raw = fetched[raw]
+        if tag == EXIF_USER_COMMENT and raw[:8] in USER_COMMENT_CODES:
+            raw = raw[8:]
+        raw = raw.rstrip(b'\x00')
+        if dtype == UNDEFINED and not is_printable(raw):
+            continue
+        value = decode_value(raw).strip()
+        if value:
+            values.append(TagValue(ifd, tag, tag_name(tag), value))
+    return values, ifds
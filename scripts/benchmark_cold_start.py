@@ -0,0 +1,65 @@
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+from typing import Dict
+
+"""
+Cold-start benchmark for the Lambda handler module.
+
+DESCRIPTION:
+    Imports the handler in a fresh interpreter with `python -X importtime`
+    and reports the cumulative import time against a budget, along with the
+    most expensive imports. Heavy dependencies (boto3, tifffile, numpy)
+    must only be imported on first use, never at module load.
+
+    python scripts/benchmark_cold_start.py --runs 5
+"""
+
+MODULE = 'dcc_phi_reporter.app'
+# Cumulative import time allowed for MODULE, in milliseconds
+COLD_START_BUDGET_MS = 150
+LAZY_MODULES = ('boto3', 'tifffile', 'numpy', 'imagecodecs')
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def import_times(module: str = MODULE) -> Dict[str, int]:
+    """import_times.
+    Import module in a fresh interpreter.
+
+    Returns:
+        Dict[str, int]: cumulative import time in microseconds per imported module
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure handler cold-start import time')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    median_ms = statistics.median(run[MODULE] for run in runs) / 1000
+    print(f'{MODULE}: median {median_ms:.1f}ms over {args.runs} runs (budget {COLD_START_BUDGET_MS}ms)')
+
+    print('Most expensive imports:')
+    last = runs[-1]
+    for name, us in sorted(last.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f'\t{us / 1000:8.1f}ms  {name}')
+
+    eager = [name for name in LAZY_MODULES if name in last]
+    if eager:
+        sys.exit(f'Imported at module load: {", ".join(eager)}')
+    if median_ms > COLD_START_BUDGET_MS:
+        sys.exit(f'Over cold-start budget by {median_ms - COLD_START_BUDGET_MS:.1f}ms')
@@ -1,5 +1,18 @@
+import io
+import os
 import sys
+import csv
+import json
+import queue
+import sqlite3
 import argparse
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from urllib.parse import unquote_plus
+
 import boto3
 from botocore.client import Config
 
@@ -16,6 +29,22 @@ DESCRIPTION:
         prefixes
         file-extensions
 
+    Large buckets are listed in shards: prefixes are discovered with a
+    Delimiter, listed concurrently, and the CSV rows are streamed into an
+    S3 multipart upload whose ETag is printed for create_s3batch_job.
+    With --checkpoint, an interrupted listing resumes from the
+    continuation tokens saved with each uploaded part.
+
+    Objects can be filtered by extension, ignored prefix, size, storage
+    class and LastModified. With --index, only objects that are new or
+    changed (ETag, size) since the last run with the same SQLite index
+    are written, for incremental sweeps.
+
+    python scripts/generate_bucket_manifest.py my-bucket --output s3://my-bucket/manifest.csv \
+        --workers 16 --checkpoint manifest.state.json
+    python scripts/generate_bucket_manifest.py my-bucket --output s3://my-bucket/nightly.csv \
+        --extension .txt --extension .csv --max-size 1073741824 --storage-class STANDARD \
+        --index my-bucket.index.sqlite
 """
 
 # Config(s3={'addressing_style': 'path'})
@@ -25,6 +54,19 @@ s3 = boto3.resource('s3')
 s3client = boto3.client('s3')
 s3_paginator = boto3.client('s3').get_paginator('list_objects_v2')
 
+LISTING_WORKERS = 8
+# Stop discovering prefixes once there are this many shards per worker
+SHARDS_PER_WORKER = 4
+MAX_DISCOVERY_DEPTH = 3
+# Pages of a prefix level read while discovering, its shard lists the rest
+DISCOVERY_PAGES = 2
+# Multipart part size, S3 requires at least 5 MiB for all but the last part
+PART_SIZE = 8 * 1024 * 1024
+# Listed pages waiting for the writer, bounds memory with slow uploads
+MAX_QUEUED_PAGES = 2 * LISTING_WORKERS
+# Shard state once every page of it is written
+DONE = 'done'
+
 
 # Utils
 def get_available_buckets():
@@ -60,12 +102,452 @@ def list_objects_client(bucket_name):
         print(item)
 
 
+class Shard(NamedTuple):
+    """A prefix listed by one worker.
+
+    A recursive shard lists every key under prefix; otherwise only the keys
+    directly at its level, its sub-prefixes being shards of their own. Those
+    that discovery did not reach become recursive shards once it lists them.
+    """
+    prefix: str
+    recursive: bool = True
+
+
+def discover_shards(client, bucket_name, prefix='', delimiter='/', min_shards=SHARDS_PER_WORKER * LISTING_WORKERS,
+                    max_depth=MAX_DISCOVERY_DEPTH, max_pages=DISCOVERY_PAGES, executor=None) -> List[Shard]:
+    """discover_shards.
+    Split a bucket listing into shards by walking prefixes breadth first.
+
+    Each level is listed with Delimiter, which returns its sub-prefixes
+    without the keys below them, the prefixes of a level concurrently on
+    executor. Only the first max_pages pages of a prefix are read: a
+    prefix with keys or more pages becomes a non-recursive shard, which
+    lists its keys and any sub-prefixes past those pages. Prefixes are
+    split until there are min_shards of them or max_depth levels were
+    walked.
+
+    Returns:
+        List[Shard]: shards that together list every key under prefix once
+    """
+    def explore(level) -> Tuple[bool, List[str]]:
+        """Whether level needs a shard of its own, and the sub-prefixes read."""
+        kwargs = {'Bucket': bucket_name, 'Prefix': level, 'Delimiter': delimiter}
+        has_keys = False
+        prefixes = []
+        for _ in range(max_pages):
+            page = client.list_objects_v2(**kwargs)
+            has_keys = has_keys or bool(page.get('Contents'))
+            prefixes.extend(common['Prefix'] for common in page.get('CommonPrefixes', ()))
+            if not page.get('IsTruncated'):
+                return has_keys, prefixes
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+        return True, prefixes
+
+    shards = []
+    frontier = [prefix]
+    for _ in range(max_depth):
+        next_frontier = []
+        levels = executor.map(explore, frontier) if executor is not None else map(explore, frontier)
+        for level, (needs_shard, prefixes) in zip(frontier, levels):
+            if needs_shard:
+                shards.append(Shard(level, recursive=False))
+            next_frontier.extend(prefixes)
+        frontier = next_frontier
+        if not frontier or len(shards) + len(frontier) >= min_shards:
+            break
+    return shards + [Shard(level) for level in frontier]
+
+
+def _levels(prefix, delimiter='/') -> Iterator[str]:
+    """The prefix and every prefix above it ending with delimiter."""
+    end = prefix.find(delimiter)
+    while end != -1:
+        yield prefix[:end + len(delimiter)]
+        end = prefix.find(delimiter, end + len(delimiter))
+    yield prefix
+
+
+def list_shard(client, bucket_name, shard, delimiter='/',
+               token=None) -> Iterator[Tuple[List[Dict], List[str], Optional[str]]]:
+    """list_shard.
+    Page through one shard, from a continuation token if given.
+
+    Yields:
+        Tuple[List[Dict], List[str], Optional[str]]: list_objects_v2 Contents
+            of a page, keys URL-encoded, the sub-prefixes on it (non-recursive
+            shards only) and the token of the next page, None after the last one
+    """
+    kwargs = {'Bucket': bucket_name, 'Prefix': shard.prefix, 'EncodingType': 'url'}
+    if not shard.recursive:
+        kwargs['Delimiter'] = delimiter
+    while True:
+        if token:
+            kwargs['ContinuationToken'] = token
+        page = client.list_objects_v2(**kwargs)
+        token = page.get('NextContinuationToken') if page.get('IsTruncated') else None
+        prefixes = [unquote_plus(common['Prefix']) for common in page.get('CommonPrefixes', ())]
+        yield page.get('Contents', []), prefixes, token
+        if token is None:
+            return
+
+
+class ObjectFilter(NamedTuple):
+    """Which listed objects go into the manifest, every one by default.
+
+    Args:
+        extensions: keep keys ending in one of these, case-insensitive
+        ignore_prefixes: drop keys starting with one of these
+        min_size (int): drop objects smaller than this many bytes
+        max_size (int): drop objects larger than this many bytes
+        storage_classes: keep objects in one of these, e.g. STANDARD
+        modified_after (datetime): drop objects last modified before this
+        modified_before (datetime): drop objects last modified at or after this
+    """
+    extensions: Tuple[str, ...] = ()
+    ignore_prefixes: Tuple[str, ...] = ()
+    min_size: Optional[int] = None
+    max_size: Optional[int] = None
+    storage_classes: Tuple[str, ...] = ()
+    modified_after: Optional[datetime] = None
+    modified_before: Optional[datetime] = None
+
+    def __call__(self, content: Dict) -> bool:
+        key = unquote_plus(content['Key'])
+        if self.extensions and not key.lower().endswith(tuple(ext.lower() for ext in self.extensions)):
+            return False
+        if self.ignore_prefixes and key.startswith(tuple(self.ignore_prefixes)):
+            return False
+        if self.min_size is not None and content['Size'] < self.min_size:
+            return False
+        if self.max_size is not None and content['Size'] > self.max_size:
+            return False
+        if self.storage_classes and content.get('StorageClass', 'STANDARD') not in self.storage_classes:
+            return False
+        if self.modified_after is not None and content['LastModified'] < self.modified_after:
+            return False
+        if self.modified_before is not None and content['LastModified'] >= self.modified_before:
+            return False
+        return True
+
+    def describe(self) -> str:
+        """Settings as a string, a checkpoint is only resumed with the same ones."""
+        return repr(tuple(value.isoformat() if isinstance(value, datetime) else value for value in self))
+
+
+class ManifestIndex:
+    """(key, ETag, size) of the objects earlier manifests listed, in SQLite.
+
+    Rows live in a WITHOUT ROWID table clustered on (bucket, key), about
+    the size of the keys themselves. Changes are staged in one transaction
+    and only committed once the manifest listing them is complete, so a
+    failed run never hides objects from the next one.
+
+    Args:
+        path (str): database file
+        bucket_name (str): bucket the objects are in
+    """
+    def __init__(self, path, bucket_name):
+        self.path = path
+        self.bucket_name = bucket_name
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS objects (bucket TEXT NOT NULL, key TEXT NOT NULL, '
+                               'etag TEXT NOT NULL, size INTEGER NOT NULL, PRIMARY KEY (bucket, key)) '
+                               'WITHOUT ROWID')
+
+    def __repr__(self):
+        return "<%s path=%r>" % (type(self).__name__, self.path)
+
+    def changed(self, contents: Iterable[Dict]) -> List[Dict]:
+        """The objects of a page that are new or changed since the last commit, staged as seen."""
+        contents = list(contents)
+        if not contents:
+            return []
+        known = {}
+        for start in range(0, len(contents), 500):
+            batch = [content['Key'] for content in contents[start:start + 500]]
+            rows = self._conn.execute(
+                f'SELECT key, etag, size FROM objects WHERE bucket = ? AND key IN ({",".join("?" * len(batch))})',
+                [self.bucket_name] + batch)
+            known.update((key, (etag, size)) for key, etag, size in rows)
+        changed = [content for content in contents
+                   if known.get(content['Key']) != (content['ETag'].strip('"'), content['Size'])]
+        self._conn.executemany('INSERT OR REPLACE INTO objects (bucket, key, etag, size) VALUES (?, ?, ?, ?)',
+                               [(self.bucket_name, content['Key'], content['ETag'].strip('"'), content['Size'])
+                                for content in changed])
+        return changed
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class MultipartWriter:
+    """Streams bytes into an S3 multipart upload, one part per part_size bytes.
+
+    Parts are cut only on flush() or once the buffer holds part_size
+    bytes, so callers can keep them aligned with whole pages of rows.
+
+    Args:
+        client: S3 client
+        bucket_name (str): destination bucket
+        key (str): destination key
+        part_size (int): bytes buffered before a part is uploaded
+        upload_id (str): multipart upload to continue
+        parts (list): {'PartNumber', 'ETag'} of its uploaded parts
+    """
+    def __init__(self, client, bucket_name, key, part_size=PART_SIZE, upload_id=None, parts=None):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.buffer = io.BytesIO()
+        self.parts = list(parts or ())
+        self.upload_id = upload_id
+        if self.upload_id is None:
+            self.upload_id = client.create_multipart_upload(
+                Bucket=bucket_name, Key=key, ContentType='text/csv')['UploadId']
+
+    def __repr__(self):
+        return "<%s s3://%s/%s parts=%d>" % (type(self).__name__, self.bucket_name, self.key, len(self.parts))
+
+    @property
+    def full(self) -> bool:
+        return self.buffer.tell() >= self.part_size
+
+    def write(self, data: bytes):
+        self.buffer.write(data)
+
+    def flush(self):
+        """Upload the buffered bytes as the next part."""
+        number = len(self.parts) + 1
+        response = self.client.upload_part(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                                           PartNumber=number, Body=self.buffer.getvalue())
+        self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+        self.buffer = io.BytesIO()
+
+    def close(self) -> str:
+        """close.
+        Upload what is left and complete the upload.
+
+        Returns:
+            str: ETag of the manifest object
+        """
+        if self.buffer.tell() or not self.parts:
+            self.flush()
+        response = self.client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts})
+        return response['ETag']
+
+    def abort(self):
+        self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+
+
+def load_checkpoint(path) -> Optional[Dict]:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_checkpoint(path, state):
+    """Write state to path atomically, so a crash mid-write keeps the previous one."""
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(state, file)
+    os.replace(temp_path, path)
+
+
+def parse_time(value) -> datetime:
+    """ISO 8601 date or time, UTC unless it has an offset."""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def csv_rows(bucket_name, contents, sizes=False) -> bytes:
+    """S3 Batch CSV manifest rows (Bucket,Key) for Contents with URL-encoded keys.
+
+    With sizes, rows are Bucket,Key,,Size: an empty VersionId column keeps
+    the S3 Batch layout for other readers, and the planner of
+    process_s3batch_jobs reads sizes from the last one.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if sizes:
+        writer.writerows((bucket_name, content['Key'], '', content['Size']) for content in contents)
+    else:
+        writer.writerows((bucket_name, content['Key']) for content in contents)
+    return buffer.getvalue().encode('utf-8')
+
+
+def write_manifest(client, bucket_name, output_bucket, output_key, prefix='', delimiter='/',
+                   workers=LISTING_WORKERS, checkpoint=None, part_size=PART_SIZE,
+                   object_filter=None, index=None, sizes=False) -> Dict:
+    """write_manifest.
+    List a bucket in parallel shards and stream it into a CSV manifest object.
+
+    Workers list shards concurrently and hand whole pages to this thread
+    through a bounded queue; it writes them as CSV rows into a multipart
+    upload. After each part, the upload and the continuation token of every
+    shard as of the rows in it are saved to checkpoint, and a rerun with the
+    same checkpoint skips what is already uploaded. Sub-prefixes that
+    discovery did not reach are listed as shards of their own once found.
+    Rows come out grouped by shard, in no particular order across shards.
+
+    Listed objects are kept if object_filter accepts them and, with an
+    index, if they are new or changed since its last run. The index is
+    committed once the manifest is complete.
+
+    Args:
+        client: S3 client
+        bucket_name (str): bucket to list
+        output_bucket (str): bucket of the manifest
+        output_key (str): key of the manifest
+        prefix (str): only list keys under prefix
+        delimiter (str): prefix separator used to discover shards
+        workers (int): shards listed at once
+        checkpoint (str): local JSON state file, resumed from if it exists
+        part_size (int): multipart part size
+        object_filter (ObjectFilter): objects to keep, all if None
+        index (ManifestIndex): only keep new or changed objects
+        sizes (bool): add a Size column for process_s3batch_jobs --plan,
+            whose sub-manifests are the ones S3 Batch reads
+
+    Returns:
+        Dict: 'ObjectArn', 'ETag' of the manifest, as create_s3batch_job
+            expects, and the number of 'Keys' written and 'Listed'
+    """
+    object_filter = object_filter or ObjectFilter()
+    settings = {'bucket': bucket_name, 'output': f'{output_bucket}/{output_key}',
+                'filter': object_filter.describe(), 'index': index.path if index is not None else None,
+                'sizes': sizes}
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    state = load_checkpoint(checkpoint)
+    if state is None:
+        try:
+            shards = discover_shards(client, bucket_name, prefix, delimiter,
+                                     min_shards=SHARDS_PER_WORKER * workers, executor=executor)
+        except BaseException:
+            executor.shutdown()
+            raise
+        state = dict(settings, keys=0, listed=0, upload_id=None, parts=[],
+                     shards=[[shard.prefix, shard.recursive, None] for shard in shards])
+    elif any(state.get(name) != value for name, value in settings.items()):
+        raise ValueError(f'Checkpoint {checkpoint} was saved with other settings: '
+                         f'{ {name: state.get(name) for name in settings} }')
+    else:
+        print(f'Resuming from {checkpoint}: {state["keys"]} keys in {len(state["parts"])} parts', file=sys.stderr)
+
+    writer = MultipartWriter(client, output_bucket, output_key, part_size=part_size,
+                             upload_id=state['upload_id'], parts=state['parts'])
+    state['upload_id'] = writer.upload_id
+    if checkpoint:
+        save_checkpoint(checkpoint, state)
+
+    # Shard states as of the rows written so far; state['shards'] only
+    # advances with uploaded parts
+    tokens = {(prefix, recursive): token for prefix, recursive, token in state['shards']}
+    # Prefixes at or above a shard, whose keys some shard already lists
+    covered = {level for prefix, _ in tokens for level in _levels(prefix, delimiter)}
+    written = state['keys']
+    listed = state['listed']
+    pages = queue.Queue(maxsize=MAX_QUEUED_PAGES)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def list_worker(shard, token):
+        try:
+            for contents, prefixes, next_token in list_shard(client, bucket_name, shard, delimiter, token):
+                put((shard, contents, prefixes, next_token))
+                if stop.is_set():
+                    return
+        except Exception as e:
+            put((shard, e, [], None))
+
+    def commit_part():
+        writer.flush()
+        state['parts'] = writer.parts
+        state['keys'] = written
+        state['listed'] = listed
+        state['shards'] = [[prefix, recursive, token] for (prefix, recursive), token in tokens.items()]
+        if checkpoint:
+            save_checkpoint(checkpoint, state)
+
+    pending = [Shard(prefix, recursive) for (prefix, recursive), token in tokens.items() if token != DONE]
+    try:
+        with executor:
+            for shard in pending:
+                executor.submit(list_worker, shard, tokens[shard])
+            remaining = len(pending)
+            try:
+                while remaining:
+                    shard, contents, prefixes, next_token = pages.get()
+                    if isinstance(contents, Exception):
+                        raise contents
+                    # Sub-prefixes past the pages discovery read
+                    for sub_prefix in prefixes:
+                        if sub_prefix not in covered:
+                            covered.update(_levels(sub_prefix, delimiter))
+                            tokens[Shard(sub_prefix)] = None
+                            executor.submit(list_worker, Shard(sub_prefix), None)
+                            remaining += 1
+                    listed += len(contents)
+                    contents = [content for content in contents if object_filter(content)]
+                    if index is not None:
+                        contents = index.changed(contents)
+                    writer.write(csv_rows(bucket_name, contents, sizes))
+                    written += len(contents)
+                    tokens[shard] = DONE if next_token is None else next_token
+                    if next_token is None:
+                        remaining -= 1
+                    if writer.full:
+                        commit_part()
+            finally:
+                stop.set()
+    except BaseException:
+        if not checkpoint:
+            writer.abort()
+        raise
+
+    if writer.buffer.tell():
+        commit_part()
+    etag = writer.close()
+    if index is not None:
+        index.commit()
+    if checkpoint:
+        os.remove(checkpoint)
+    return {'ObjectArn': f'arn:aws:s3:::{output_bucket}/{output_key}', 'ETag': etag.strip('"'),
+            'Keys': written, 'Listed': listed}
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Generate a s3batch bucket manifest file')
     parser.add_argument('bucket_name', nargs=1, help='Bucket name')
     # parser.add_argument('-p', '--profile', default='default')
     parser.add_argument('-pr', '--prefix', default='/')
-    # parser.add_argument('-i', '--ignore', default='/')
+    parser.add_argument('-o', '--output', help='s3://bucket/key to upload the manifest to, printed if unset')
+    parser.add_argument('-w', '--workers', type=int, default=LISTING_WORKERS, help='Shards listed at once')
+    parser.add_argument('--checkpoint', help='Local state file to resume an interrupted --output listing from')
+    parser.add_argument('-e', '--extension', action='append', default=[], help='Only keys with this extension')
+    parser.add_argument('-i', '--ignore', action='append', default=[], help='Skip keys with this prefix')
+    parser.add_argument('--min-size', type=int, help='Skip objects smaller than this many bytes')
+    parser.add_argument('--max-size', type=int, help='Skip objects larger than this many bytes')
+    parser.add_argument('--storage-class', action='append', default=[], help='Only objects in this storage class')
+    parser.add_argument('--modified-after', type=parse_time, help='Only objects modified since (ISO 8601)')
+    parser.add_argument('--modified-before', type=parse_time, help='Only objects modified before (ISO 8601)')
+    parser.add_argument('--index', help='SQLite index of earlier runs, only new or changed objects are written')
+    parser.add_argument('--sizes', action='store_true',
+                        help='Add object sizes to the --output rows, for process_s3batch_jobs.py --plan')
     # parser.add_argument('-r', '--region')  # Required for s3 style
 
     args = parser.parse_args()
@@ -85,6 +567,25 @@ if __name__ == '__main__':
     # for obj in bucket.objects.all():
     #     print(f'{bucket.name},{obj.key}')
 
+    object_filter = ObjectFilter(tuple(args.extension), tuple(args.ignore), args.min_size, args.max_size,
+                                 tuple(args.storage_class), args.modified_after, args.modified_before)
+    if not args.output and (object_filter != ObjectFilter() or args.index):
+        sys.exit('Filters and --index need --output')
+
+    if args.output:
+        if not args.output.startswith('s3://'):
+            sys.exit(f'Output must be s3://bucket/key, got {args.output}')
+        output_bucket, _, output_key = args.output[len('s3://'):].partition('/')
+        index = ManifestIndex(args.index, bucket_name) if args.index else None
+        location = write_manifest(s3client, bucket_name, output_bucket, output_key,
+                                  prefix=prefix[1:] if prefix.startswith('/') else prefix,
+                                  workers=args.workers, checkpoint=args.checkpoint,
+                                  object_filter=object_filter, index=index, sizes=args.sizes)
+        print(f"Wrote {location['Keys']} of {location['Listed']} keys to {args.output}", file=sys.stderr)
+        # Manifest Location for create_s3batch_job
+        print(json.dumps({'ObjectArn': location['ObjectArn'], 'ETag': location['ETag']}))
+        sys.exit()
+
     # Via boto3.client abstraction
     for key in keys(bucket_name, prefix=prefix):
         print(f'{bucket_name},{key}')
@@ -1,26 +1,61 @@
 
+import io
 import sys
+import csv
+import codecs
 import uuid
+import heapq
 import argparse
 import json
+import math
 
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+from urllib.parse import unquote_plus
 from pydantic import BaseModel
 
 # import pydantic
 import boto3
 from botocore.exceptions import ClientError
 
-s3 = boto3.resource('s3')
-s3client = boto3.client('s3')
-lambdaclient = boto3.client('lambda')
-s3control = boto3.client('s3control')
-sts = boto3.client("sts")
+# boto3 clients, created on first use so the planner imports without a region
+_clients = {}
+
+
+def get_client(service_name):
+    if service_name not in _clients:
+        _clients[service_name] = boto3.client(service_name)
+    return _clients[service_name]
+
+
+# Objects at least this large get jobs of their own, away from small ones
+HUGE_OBJECT_BYTES = 1024 * 1024 * 1024
+# Objects below this are many-per-second work, kept apart from the rest
+SMALL_OBJECT_BYTES = 1024 * 1024
+SIZE_CLASSES = ('small', 'large', 'huge')
+# Added to the template's priority, so the longest jobs start first and
+# the quick ones fill the remaining Lambda concurrency
+CLASS_PRIORITY = {'small': 0, 'large': 1, 'huge': 2}
+# Work per job; an object costs its share of whichever limit it fills more
+JOB_BYTES = 100 * 1024 * 1024 * 1024
+JOB_CHARS = 2 * 1024 * 1024 * 1024
+HEAD_WORKERS = 16
+
+# Estimated share of an object's bytes sent to Comprehend, by extension;
+# see dcc_phi_reporter.app.EXTRACTORS for how each type is scanned
+TEXT_EXTENSIONS = ('.txt', '.xml', '.md', '.log', '.csv', '.tsv', '.json', '.jsonl')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.gz')
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+# Archives are scanned up to dcc_phi_reporter.archive.ARCHIVE_BYTE_BUDGET
+ARCHIVE_CHARS = 1024 * 1024 * 1024
+# TIFFs only have their text tags scanned
+TIFF_CHARS = 64 * 1024
 
 
 def create_s3batch_job_from_json(config):
-    response = s3control.create_job(**config)
+    response = get_client('s3control').create_job(**config)
     print(f'jobID: {response}')
+    return response
 
 
 class Tag(BaseModel):
@@ -69,16 +104,219 @@ class S3BatchJob(BaseModel):
     Tags: List[Tag] = []
 
 
+class ManifestObject(NamedTuple):
+    bucket: str
+    key: str  # URL-encoded, as in the manifest
+    size: int
+
+    @property
+    def chars(self) -> int:
+        return estimate_chars(unquote_plus(self.key), self.size)
+
+    @property
+    def size_class(self) -> str:
+        if self.size >= HUGE_OBJECT_BYTES:
+            return 'huge'
+        if self.size < SMALL_OBJECT_BYTES:
+            return 'small'
+        return 'large'
+
+
+class Partition(NamedTuple):
+    """One sub-manifest and the job that will scan it."""
+    size_class: str
+    objects: List[ManifestObject]
+
+    @property
+    def bytes(self) -> int:
+        return sum(obj.size for obj in self.objects)
+
+    @property
+    def chars(self) -> int:
+        return sum(obj.chars for obj in self.objects)
+
+
+def estimate_chars(key, size) -> int:
+    """Characters an object is expected to send to Comprehend."""
+    key = key.lower()
+    if key.endswith(TEXT_EXTENSIONS):
+        return size
+    if key.endswith(ARCHIVE_EXTENSIONS):
+        return min(size, ARCHIVE_CHARS)
+    if key.endswith(TIFF_EXTENSIONS):
+        return min(size, TIFF_CHARS)
+    return 0
+
+
+def read_manifest(client, location) -> Iterator[Tuple[str, str, Optional[int]]]:
+    """read_manifest.
+    Stream the (bucket, URL-encoded key, size) rows of a CSV manifest, a
+    local path or s3://bucket/key. Sizes come from the fourth column that
+    generate_bucket_manifest --sizes writes, None without it.
+    """
+    if location.startswith('s3://'):
+        bucket, _, key = location[len('s3://'):].partition('/')
+        body = client.get_object(Bucket=bucket, Key=key)['Body']
+        # The pinned botocore's StreamingBody is not an io object TextIOWrapper takes
+        file = codecs.getreader('utf-8')(body)
+    else:
+        file = open(location, newline='')
+    with file:
+        for row in csv.reader(file):
+            if row:
+                yield row[0], row[1], int(row[3]) if len(row) > 3 and row[3] else None
+
+
+def object_sizes(client, rows, workers=HEAD_WORKERS) -> List[ManifestObject]:
+    """Manifest objects with their sizes, a concurrent HEAD request for each row without one."""
+    def head(row):
+        bucket, key = row
+        return client.head_object(Bucket=bucket, Key=unquote_plus(key))['ContentLength']
+
+    objects = []
+    missing = []
+    for bucket, key, size in rows:
+        if size is None:
+            missing.append(len(objects))
+        objects.append(ManifestObject(bucket, key, size))
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            sizes = executor.map(head, ((objects[index].bucket, objects[index].key) for index in missing))
+            for index, size in zip(missing, sizes):
+                objects[index] = objects[index]._replace(size=size)
+    return objects
+
+
+def plan_partitions(objects: Iterable[ManifestObject], job_bytes=JOB_BYTES, job_chars=JOB_CHARS) -> List[Partition]:
+    """plan_partitions.
+    Split manifest objects into balanced sub-manifests, one job each.
+
+    Objects are first grouped by size class so huge objects never share a
+    job with swarms of small ones. Each class gets enough partitions that
+    none needs more than job_bytes or job_chars on average, and objects
+    are dealt largest first to the least loaded partition (LPT scheduling).
+    An object costs the larger of its shares of job_bytes and job_chars,
+    so a job fills up on whichever of the two its objects are heavy in.
+
+    Args:
+        objects: manifest objects with sizes
+        job_bytes (int): bytes per job
+        job_chars (int): estimated Comprehend characters per job
+
+    Returns:
+        List[Partition]: non-empty partitions, huge ones first
+    """
+    by_class = {size_class: [] for size_class in SIZE_CLASSES}
+    for obj in objects:
+        by_class[obj.size_class].append(obj)
+
+    partitions = []
+    for size_class in reversed(SIZE_CLASSES):
+        members = by_class[size_class]
+        if not members:
+            continue
+        costs = [(max(obj.size / job_bytes, obj.chars / job_chars), obj) for obj in members]
+        count = min(max(1, math.ceil(sum(cost for cost, _ in costs))), len(members))
+        bins = [Partition(size_class, []) for _ in range(count)]
+        loads = [(0.0, index) for index in range(count)]
+        for cost, obj in sorted(costs, key=lambda item: (-item[0], item[1].key)):
+            load, index = heapq.heappop(loads)
+            bins[index].objects.append(obj)
+            heapq.heappush(loads, (load + cost, index))
+        partitions.extend(bins)
+    return partitions
+
+
+def write_partition(client, partition, bucket, key) -> Dict[str, str]:
+    """Upload a partition's CSV manifest, returning its Manifest Location."""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows((obj.bucket, obj.key) for obj in partition.objects)
+    response = client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue().encode('utf-8'),
+                                 ContentType='text/csv')
+    return {'ObjectArn': f'arn:aws:s3:::{bucket}/{key}', 'ETag': response['ETag'].strip('"')}
+
+
+def build_jobs(template: S3BatchJob, partitions: List[Partition], locations: List[Dict[str, str]]) -> List[S3BatchJob]:
+    """build_jobs.
+    One job per partition, copied from template with its manifest location,
+    a priority raised by size class (CLASS_PRIORITY) and a request token
+    derived from the sub-manifest ETag and partition number, so a rerun of
+    the same plan is not submitted twice.
+    """
+    jobs = []
+    for number, (partition, location) in enumerate(zip(partitions, locations), start=1):
+        config = template.dict(exclude_unset=True)
+        config.update(
+            Description=f'{template.Description} ({number}/{len(partitions)}, {partition.size_class}: '
+                        f'{len(partition.objects)} objects, {partition.bytes} bytes)',
+            Priority=(template.Priority or 0) + CLASS_PRIORITY[partition.size_class],
+            ClientRequestToken=str(uuid.uuid5(uuid.NAMESPACE_URL, f'{location["ETag"]}#{number}')),
+            Tags=config.get('Tags', []) + [{'Key': 'size-class', 'Value': partition.size_class}],
+        )
+        config['Manifest']['Location'] = {'ObjectArn': location['ObjectArn'], 'ETag': location['ETag']}
+        jobs.append(S3BatchJob(**config))
+    return jobs
+
+
+def plan_jobs(client, template, manifest, output_prefix, job_bytes=JOB_BYTES, job_chars=JOB_CHARS,
+              workers=HEAD_WORKERS) -> List[S3BatchJob]:
+    """plan_jobs.
+    Partition a manifest by size and build a job per sub-manifest.
+
+    Args:
+        client: S3 client
+        template (S3BatchJob): settings shared by the jobs
+        manifest (str): CSV manifest, local path or s3://bucket/key
+        output_prefix (str): s3://bucket/prefix for the sub-manifests
+        job_bytes (int): bytes per job
+        job_chars (int): estimated Comprehend characters per job
+        workers (int): concurrent HEAD requests for rows without a size
+
+    Returns:
+        List[S3BatchJob]: jobs ready to submit
+    """
+    if not output_prefix.startswith('s3://'):
+        raise ValueError(f'Output prefix must be s3://bucket/prefix, got {output_prefix!r}')
+    bucket, _, prefix = output_prefix[len('s3://'):].partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+
+    objects = object_sizes(client, read_manifest(client, manifest), workers=workers)
+    partitions = plan_partitions(objects, job_bytes=job_bytes, job_chars=job_chars)
+    locations = []
+    for number, partition in enumerate(partitions, start=1):
+        key = f'{prefix}manifest-{number:04d}-{partition.size_class}.csv'
+        locations.append(write_partition(client, partition, bucket, key))
+        print(f'{key}: {len(partition.objects)} objects, {partition.bytes} bytes, ~{partition.chars} chars',
+              file=sys.stderr)
+    return build_jobs(template, partitions, locations)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Utility: process s3batch job file")
     parser.add_argument('jobs', nargs=1, help='S3Batch Jobs JSON')
+    parser.add_argument('--plan', metavar='MANIFEST',
+                        help='Split this manifest (path or s3://) into size-balanced jobs, '
+                             'using the first job of the JSON as template')
+    parser.add_argument('--output-prefix', help='s3://bucket/prefix for the sub-manifests of --plan')
+    parser.add_argument('--job-bytes', type=int, default=JOB_BYTES, help='Object bytes per planned job')
+    parser.add_argument('--job-chars', type=int, default=JOB_CHARS, help='Estimated Comprehend characters per planned job')
+    parser.add_argument('--dry-run', action='store_true', help='Print the jobs without submitting them')
     args = parser.parse_args()
     jobs_file = args.jobs[0]
 
     with open(jobs_file) as file:
         data = json.load(file)
         jobs: List[S3BatchJob] = [S3BatchJob(**item) for item in data]
-        # print(jobs[0])
-        for job in jobs:
-            print(job.dict(exclude_unset=True))
+
+    if args.plan:
+        if not args.output_prefix:
+            sys.exit('--plan needs --output-prefix')
+        jobs = plan_jobs(get_client('s3'), jobs[0], args.plan, args.output_prefix,
+                         job_bytes=args.job_bytes, job_chars=args.job_chars)
+
+    # print(jobs[0])
+    for job in jobs:
+        print(job.dict(exclude_unset=True))
+        if not args.dry_run:
             create_s3batch_job_from_json(job.dict(exclude_unset=True))
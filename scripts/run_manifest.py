@@ -0,0 +1,233 @@
+import io
+import os
+import csv
+import sys
+import time
+import uuid
+import logging
+import argparse
+import functools
+import multiprocessing
+
+from typing import Dict, Iterator, List, Set, Tuple
+from urllib.parse import unquote_plus
+
+"""
+Local runner for the PHI detection handler over a manifest.
+
+DESCRIPTION:
+    Reads an S3 Batch CSV manifest (Bucket,Key[,VersionId], keys
+    URL-encoded), groups its rows into S3 Batch invocation events like
+    events/s3batchevent_text.json and runs lambda_handler on them across a
+    process pool. Each worker process imports the handler once and keeps
+    its boto3 clients warm across invocations, like a warm Lambda
+    container. TemporaryFailure tasks are retried as S3 Batch would.
+
+    Results are appended to a completion report in the Report_CSV_20180820
+    layout (Bucket,Key,VersionId,TaskStatus,ErrorCode,HTTPStatusCode,
+    ResultMessage) as invocations finish. Rerunning with the same report
+    skips the rows already in it, so an interrupted run resumes.
+
+    The handler's settings come from the environment as in Lambda, e.g.
+    SCAN_MODE, RESULT_CACHE or CHECKPOINT_PREFIX.
+
+    python scripts/run_manifest.py manifest.csv --report report.csv --processes 8
+"""
+
+logger = logging.getLogger(__name__)
+
+TASKS_PER_INVOCATION = 8
+# Lambda's longest timeout
+INVOCATION_TIMEOUT = 900  # seconds
+# Times a TemporaryFailure task is retried before it is reported failed
+TASK_RETRIES = 2
+
+Row = Tuple[str, str, str]
+
+
+class LocalContext:
+    """Lambda context whose remaining time counts down from timeout seconds."""
+    def __init__(self, timeout: float = INVOCATION_TIMEOUT):
+        self.end = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self.end - time.monotonic()) * 1000))
+
+
+def read_manifest(path) -> List[Row]:
+    """(bucket, URL-encoded key, version ID or '') rows of a local CSV manifest."""
+    with open(path, newline='') as file:
+        return [(row[0], row[1], row[2] if len(row) > 2 else '') for row in csv.reader(file) if row]
+
+
+def task_id(row: Row) -> str:
+    """Stable task ID of a manifest row, so retries and reruns find its checkpoints."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, 's3://{}/{}?versionId={}'.format(*row)))
+
+
+def make_event(job_id: str, rows: List[Row]) -> Dict:
+    """S3 Batch invocation event (schema 1.0) for manifest rows."""
+    return {
+        'invocationSchemaVersion': '1.0',
+        'invocationId': str(uuid.uuid4()),
+        'job': {'id': job_id},
+        'tasks': [{
+            'taskId': task_id(row),
+            # The handler reads s3Key as the object's key
+            's3Key': unquote_plus(row[1]),
+            's3VersionId': row[2] or None,
+            's3BucketArn': f'arn:aws:s3:::{row[0]}',
+        } for row in rows],
+    }
+
+
+def report_row(row: Row, result: Dict) -> List[str]:
+    """Report_CSV_20180820 row for a task result."""
+    bucket, key, version = row
+    code = result['resultCode']
+    if code == 'Succeeded':
+        return [bucket, key, version, 'succeeded', '200', '', result['resultString']]
+    status = '500' if code == 'TemporaryFailure' else '400'
+    return [bucket, key, version, 'failed', status, code, result['resultString']]
+
+
+def completed_rows(report) -> Set[Row]:
+    """Rows already in a report, after cutting off a line left half-written."""
+    if not os.path.exists(report):
+        return set()
+    with open(report, 'rb+') as file:
+        data = file.read()
+        if data and not data.endswith(b'\n'):
+            data = data[:data.rfind(b'\n') + 1]
+            file.truncate(len(data))
+    return {tuple(fields[:3]) for fields in csv.reader(io.StringIO(data.decode('utf-8'))) if len(fields) >= 3}
+
+
+def init_worker(log_level=None, endpoint_url=None):
+    """Import the handler and create its clients once per worker process.
+
+    With endpoint_url, the clients send their requests there instead of
+    AWS, e.g. to a moto server.
+    """
+    from dcc_phi_reporter import app
+
+    if log_level is not None:
+        # Handler modules set their own levels
+        for name in list(logging.root.manager.loggerDict):
+            if name.startswith('dcc_phi_reporter'):
+                logging.getLogger(name).setLevel(log_level)
+    for service_name in ('s3', 'comprehend'):
+        if endpoint_url is not None:
+            import boto3
+
+            app._clients[('client', service_name)] = boto3.client(service_name, endpoint_url=endpoint_url,
+                                                                  config=app.client_config())
+        app.get_client(service_name)
+
+
+def invoke(rows: List[Row], job_id: str, timeout: float = INVOCATION_TIMEOUT,
+           retries: int = TASK_RETRIES) -> List[Tuple[Row, Dict]]:
+    """invoke.
+    Run lambda_handler on one invocation's rows, retrying TemporaryFailure tasks.
+
+    Returns:
+        List[Tuple[Row, Dict]]: each row with its final task result
+    """
+    from dcc_phi_reporter import app
+
+    by_id = {task_id(row): row for row in rows}
+    final = {}
+    pending = rows
+    for attempt in range(retries + 1):
+        try:
+            response = app.lambda_handler(make_event(job_id, pending), LocalContext(timeout))
+            results = response['results']
+        except Exception as e:
+            # A crashed invocation fails all of its tasks, like an unhandled Lambda error
+            logger.exception('Invocation failed')
+            results = [{'taskId': task_id(row), 'resultCode': 'PermanentFailure',
+                        'resultString': f'{type(e).__name__}: {e}'} for row in pending]
+        for result in results:
+            final[result['taskId']] = result
+        pending = [by_id[result['taskId']] for result in results if result['resultCode'] == 'TemporaryFailure']
+        if not pending:
+            break
+    return [(row, final[task_id(row)]) for row in rows]
+
+
+def batches(rows: List[Row], size: int) -> Iterator[List[Row]]:
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def run_manifest(manifest, report, job_id=None, processes=None, tasks_per_invocation=TASKS_PER_INVOCATION,
+                 timeout=INVOCATION_TIMEOUT, retries=TASK_RETRIES, log_level=None,
+                 endpoint_url=None) -> Dict[str, int]:
+    """run_manifest.
+    Run the handler over every row of a manifest not yet in the report.
+
+    Args:
+        manifest (str): local CSV manifest
+        report (str): completion report, appended to
+        job_id (str): S3 Batch job ID of the events, derived from manifest if None
+        processes (int): worker processes, all CPUs if None, 0 to run in this process
+        tasks_per_invocation (int): tasks per event
+        timeout (float): seconds each invocation may run
+        retries (int): retries of TemporaryFailure tasks
+        log_level: level of the handler's loggers in the workers, unchanged if None
+        endpoint_url (str): endpoint of the workers' S3 and Comprehend clients, AWS if None
+
+    Returns:
+        Dict[str, int]: counts of 'skipped' rows and 'succeeded'/'failed' tasks
+    """
+    job_id = job_id or str(uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(manifest)))
+    done = completed_rows(report)
+    rows = [row for row in read_manifest(manifest) if row not in done]
+    counts = {'skipped': len(done), 'succeeded': 0, 'failed': 0}
+    run = functools.partial(invoke, job_id=job_id, timeout=timeout, retries=retries)
+
+    with open(report, 'a', newline='') as file:
+        writer = csv.writer(file, lineterminator='\n')
+
+        def record(results):
+            for row, result in results:
+                fields = report_row(row, result)
+                writer.writerow(fields)
+                counts[fields[3]] += 1
+            file.flush()
+
+        if processes == 0:
+            init_worker(log_level, endpoint_url)
+            for results in map(run, batches(rows, tasks_per_invocation)):
+                record(results)
+        else:
+            with multiprocessing.Pool(processes, initializer=init_worker, initargs=(log_level, endpoint_url)) as pool:
+                for results in pool.imap_unordered(run, batches(rows, tasks_per_invocation)):
+                    record(results)
+    return counts
+
+
+if __name__ == '__main__':
+    # Run as a script, the repository root is not on sys.path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    parser = argparse.ArgumentParser(description='Run the PHI detection handler over a manifest locally')
+    parser.add_argument('manifest', help='S3 Batch CSV manifest')
+    parser.add_argument('--report', default='report.csv', help='Completion report, resumed if it exists')
+    parser.add_argument('--job-id', help='Job ID of the synthesized events')
+    parser.add_argument('-p', '--processes', type=int, help='Worker processes, 0 to run in this one')
+    parser.add_argument('--tasks-per-invocation', type=int, default=TASKS_PER_INVOCATION)
+    parser.add_argument('--timeout', type=float, default=INVOCATION_TIMEOUT, help='Seconds per invocation')
+    parser.add_argument('--retries', type=int, default=TASK_RETRIES, help='Retries of TemporaryFailure tasks')
+    parser.add_argument('--endpoint-url', help='Send S3 and Comprehend requests here, e.g. a local moto server')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    start = time.monotonic()
+    counts = run_manifest(args.manifest, args.report, job_id=args.job_id, processes=args.processes,
+                          tasks_per_invocation=args.tasks_per_invocation, timeout=args.timeout,
+                          retries=args.retries, log_level=logging.WARNING, endpoint_url=args.endpoint_url)
+    elapsed = time.monotonic() - start
+    tasks = counts['succeeded'] + counts['failed']
+    print(f"{tasks} tasks in {elapsed:.1f}s ({tasks / max(elapsed, 1e-9):.1f}/s): {counts['succeeded']} succeeded, "
+          f"{counts['failed']} failed, {counts['skipped']} already reported", file=sys.stderr)
@@ -1,8 +1,14 @@
 import os
+import re
 
 import pytest
 import boto3
-from moto import mock_s3
+
+# moto refuses multipart parts under 5 MiB like S3 does; its documented
+# setting lowers that and is read when moto is imported
+os.environ.setdefault('S3_UPLOAD_PART_MIN_SIZE', '1')
+
+from moto import mock_s3  # noqa: E402
 
 
 @pytest.fixture
@@ -19,3 +25,37 @@ def s3_client(aws_credentials):
     with mock_s3():
         conn = boto3.client("s3", region_name="us-east-1")
         yield conn
+
+
+class StubComprehend:
+    """Finds a few fixed PII patterns the way detect_pii_entities reports them."""
+    patterns = {
+        'NAME': re.compile(r'John Smith'),
+        'SSN': re.compile(r'\d{3}-\d{2}-\d{4}'),
+    }
+
+    def __init__(self):
+        self.calls = []
+
+    def detect_pii_entities(self, Text, LanguageCode):
+        self.calls.append(Text)
+        found = []
+        for entity_type, pattern in self.patterns.items():
+            for match in pattern.finditer(Text):
+                found.append({
+                    'Score': 0.99,
+                    'Type': entity_type,
+                    'BeginOffset': match.start(),
+                    'EndOffset': match.end(),
+                })
+        return {'Entities': found}
+
+
+@pytest.fixture
+def comprehend_stub(mocker):
+    from dcc_phi_reporter import app
+
+    stub = StubComprehend()
+    mocker.patch.dict(app._clients, {('client', 'comprehend'): stub})
+    mocker.patch.object(app, 'chunk_cache', app.chunkcache.ChunkCache())
+    return stub
@@ -0,0 +1,98 @@
+import io
+import gzip
+import tarfile
+import zipfile
+
+import pytest
+
+from dcc_phi_reporter import archive
+
+
+def scan_member(name, fileobj, seekable):
+    return {'member': name, 'status': 'scanned', 'text': fileobj.read().decode('utf-8'), 'seekable': seekable}
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+
+def make_tar(members, mode='w:gz'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as tf:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def test_archive_kind():
+    assert archive.archive_kind('a/b.ZIP') == archive.ZIP
+    assert archive.archive_kind('a/b.tar.gz') == archive.TAR
+    assert archive.archive_kind('a/b.tgz') == archive.TAR
+    assert archive.archive_kind('a/b.txt.gz') == archive.GZIP
+    assert archive.archive_kind('a/b.txt') is None
+
+
+def test_byte_budget():
+    budget = archive.ByteBudget(10)
+    assert budget.take(6)
+    assert not budget.take(6)
+    assert budget.take(4)
+    assert budget.used == 10
+    assert budget.exhausted
+
+
+def test_scan_zip_in_order():
+    data = make_zip({'a.txt': b'first', 'dir/b.txt': b'second', 'c.txt': b'third'})
+    results = archive.scan_zip(lambda: io.BytesIO(data), scan_member, archive.ByteBudget(), workers=2)
+    assert [r['member'] for r in results] == ['a.txt', 'dir/b.txt', 'c.txt']
+    assert [r['text'] for r in results] == ['first', 'second', 'third']
+    assert all(r['seekable'] for r in results)
+
+
+def test_scan_zip_budget():
+    data = make_zip({'a.txt': b'x' * 60, 'b.txt': b'y' * 60, 'c.txt': b'z' * 30})
+    budget = archive.ByteBudget(100)
+    results = archive.scan_zip(lambda: io.BytesIO(data), scan_member, budget, workers=1)
+    assert [r['status'] for r in results] == ['scanned', 'skipped', 'scanned']
+    assert budget.exhausted
+    assert budget.used == 90
+
+
+def test_scan_zip_bad_archive():
+    with pytest.raises(archive.ArchiveError):
+        archive.scan_zip(lambda: io.BytesIO(b'not a zip'), scan_member, archive.ByteBudget())
+
+
+def test_scan_tar_stream():
+    data = make_tar({'a.txt': b'first', 'b.csv': b'h\nv\n'})
+
+    class Stream:
+        """Non-seekable reader like a StreamingBody."""
+        def __init__(self, data):
+            self.buffer = io.BytesIO(data)
+
+        def read(self, size=-1):
+            return self.buffer.read(size)
+
+    results = archive.scan_tar(Stream(data), scan_member, archive.ByteBudget())
+    assert [(r['member'], r['text']) for r in results] == [('a.txt', 'first'), ('b.csv', 'h\nv\n')]
+    assert not any(r['seekable'] for r in results)
+
+
+def test_scan_tar_bad_archive():
+    with pytest.raises(archive.ArchiveError):
+        archive.scan_tar(io.BytesIO(b'\x1f\x8b' + b'garbage' * 100), scan_member, archive.ByteBudget())
+
+
+def test_scan_gzip_truncates_at_budget():
+    data = gzip.compress(b'a' * 1000)
+    results = archive.scan_gzip(io.BytesIO(data), 'logs/app.log.gz', scan_member, archive.ByteBudget(100))
+    assert results[0]['member'] == 'logs/app.log'
+    assert results[0]['text'] == 'a' * 100
+    assert results[0]['truncated']
@@ -0,0 +1,60 @@
+import pytest
+
+from dcc_phi_reporter import app, dispatch
+from dcc_phi_reporter.checkpoint import Checkpoint, TaskCheckpoint, checkpoint_location
+from dcc_phi_reporter.entities import EntityList
+
+SENTENCE = 'Visit {} notes for patient John Smith, SSN 123-45-6789, were reviewed. '
+
+
+def test_encode_round_trip():
+    found = EntityList([{'Type': 'NAME', 'BeginOffset': 3, 'EndOffset': 13, 'Score': 0.5}])
+    saved = Checkpoint.decode(Checkpoint(120, 118, 2, found, namespace='v1').encode())
+    assert (saved.byte_offset, saved.char_offset, saved.chunks, saved.namespace) == (120, 118, 2, 'v1')
+    assert list(saved.entities) == list(found)
+
+
+def test_checkpoint_location():
+    assert checkpoint_location('s3://state/ckpt', 'job', 'task', '"abc"') == (
+        'state', 'ckpt/job/task/abc.checkpoint.json.gz')
+
+
+def test_task_checkpoint_store(s3_client):
+    s3_client.create_bucket(Bucket='state')
+    store = TaskCheckpoint(s3_client, 's3://state', 'job', 'task', '"abc"', namespace='v1')
+    assert store.load() is None
+
+    store.save(Checkpoint(10, 10, 1))
+    assert store.load().byte_offset == 10
+    # Other detector settings chunk differently
+    assert TaskCheckpoint(s3_client, 's3://state', 'job', 'task', '"abc"', namespace='v2').load() is None
+
+    store.discard()
+    assert store.load() is None
+
+
+def test_detect_pii_resumes_from_checkpoint(comprehend_stub, mocker):
+    mocker.patch.object(app.checkpoint, 'SAVE_EVERY_CHUNKS', 3)
+    data = ''.join(SENTENCE.format(i) for i in range(60))
+    full = app.detect_pii(data, window_size=400, overlap=50)
+    chunks = len(comprehend_stub.calls)
+
+    comprehend_stub.calls.clear()
+    mocker.patch.object(app, 'chunk_cache', app.chunkcache.ChunkCache())
+    # Snapshots, the checkpoint's entities keep growing after save
+    saves = []
+    # Time runs out after five Comprehend calls
+    deadline = dispatch.Deadline(lambda: 60000 if len(comprehend_stub.calls) < 5 else 0, margin_ms=1000)
+    with pytest.raises(dispatch.DeadlineExceeded):
+        app.detect_pii(data, window_size=400, overlap=50, max_workers=1, deadline=deadline,
+                       save=lambda progress: saves.append(Checkpoint.decode(progress.encode())))
+    assert [saved.chunks for saved in saves] == [3, 5]
+
+    comprehend_stub.calls.clear()
+    resume = saves[-1]
+    rest = data.encode('utf-8')[resume.byte_offset:].decode('utf-8')
+    stats = {}
+    resumed = app.detect_pii(rest, window_size=400, overlap=50, resume=resume, stats=stats)
+    assert list(resumed) == list(full)
+    assert len(comprehend_stub.calls) == chunks - 5
+    assert stats['resumed_bytes'] == resume.byte_offset
@@ -0,0 +1,59 @@
+from dcc_phi_reporter import app
+from dcc_phi_reporter.chunkcache import ChunkCache
+from dcc_phi_reporter.resultcache import SQLiteResultCache
+
+FOUND = [{'Score': 0.9, 'Type': 'NAME', 'BeginOffset': 0, 'EndOffset': 4}]
+
+
+def test_lru_bound_and_counters():
+    cache = ChunkCache(max_entries=2)
+    cache.put('a', FOUND)
+    cache.put('b', [])
+    cache.put('c', [])
+    assert cache.get('a') is None
+    assert cache.get('c') == []
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_persistent_tier():
+    persistent = SQLiteResultCache(':memory:')
+    ChunkCache(persistent=persistent).put('John was here', FOUND)
+    warm = ChunkCache(persistent=persistent)
+    assert warm.get('John was here') == FOUND
+    assert warm.hits == 1
+
+
+def test_repeated_boilerplate_is_detected_once(comprehend_stub):
+    header = 'Form 12: patient John Smith, please sign below and return. '
+    data = (header * 40 + '\n') * 5
+    stats = {}
+    found = app.detect_pii(data, window_size=len(header) * 40 + 1, overlap=0, stats=stats)
+
+    assert len(comprehend_stub.calls) == 1
+    assert stats['chunk_cache_hits'] == 4
+    assert stats['chunk_cache_misses'] == 1
+    assert len(found) == 200
+    assert all(data[e['BeginOffset']:e['EndOffset']] == 'John Smith' for e in found)
+
+
+def test_get_or_compute_coalesces_concurrent_misses():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = ChunkCache()
+    calls = []
+    release = threading.Event()
+
+    def compute(text):
+        calls.append(text)
+        release.wait(1)
+        return FOUND
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(cache.get_or_compute, 'same text', compute) for _ in range(4)]
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert calls == ['same text']
+    assert sorted(hit for _, hit in results) == [False, True, True, True]
+    assert all(found == FOUND for found, _ in results)
@@ -0,0 +1,66 @@
+import pytest
+
+from dcc_phi_reporter.chunking import iter_chunks
+
+TEXT = 'Patient John Smith was seen on 2020-01-01. Follow up in two weeks! ' * 20
+
+
+@pytest.mark.parametrize('max_bytes', [16, 50, 100, 5000])
+def test_chunks_respect_byte_limit_and_rejoin(max_bytes):
+    chunks = list(iter_chunks(TEXT, max_bytes=max_bytes))
+    assert ''.join(c.text for c in chunks) == TEXT
+    assert all(c.byte_size <= max_bytes for c in chunks)
+
+
+def test_offsets_multibyte():
+    text = 'héllo wörld ünïcode ' * 10
+    for chunk in iter_chunks(text, max_bytes=25):
+        assert text[chunk.char_offset:chunk.char_offset + len(chunk.text)] == chunk.text
+        encoded = text.encode('utf-8')
+        assert encoded[chunk.byte_offset:chunk.byte_offset + chunk.byte_size] == chunk.text.encode('utf-8')
+
+
+def test_breaks_at_boundaries():
+    chunks = list(iter_chunks(TEXT, max_bytes=100))
+    for chunk in chunks[:-1]:
+        assert chunk.text[-1].isspace()
+    # Sentence boundaries are preferred over arbitrary whitespace
+    assert chunks[0].text.endswith('. ') or chunks[0].text.endswith('! ')
+
+
+def test_no_whitespace_cuts_on_char_boundary():
+    text = '€' * 10
+    chunks = list(iter_chunks(text, max_bytes=7))
+    assert [c.text for c in chunks] == ['€€', '€€', '€€', '€€', '€€']
+
+
+def test_empty():
+    assert list(iter_chunks('', max_bytes=100)) == []
+
+
+@pytest.mark.parametrize('overlap', [8, 20, 25])
+def test_overlapping_chunks(overlap):
+    chunks = list(iter_chunks(TEXT, max_bytes=100, overlap=overlap))
+    for prev, chunk in zip(chunks, chunks[1:]):
+        assert TEXT[chunk.char_offset:chunk.char_offset + len(chunk.text)] == chunk.text
+        prev_end = prev.byte_offset + prev.byte_size
+        if prev.byte_size > 2 * overlap:
+            assert prev.byte_offset < chunk.byte_offset <= prev_end - overlap
+        else:
+            assert chunk.byte_offset == prev_end
+    assert chunks[-1].char_offset + len(chunks[-1].text) == len(TEXT)
+
+
+@pytest.mark.parametrize('text,max_bytes', [('😀 日😀\n', 12), ('😀 ' + 'x' * 6000, 5000), ('日本語 ' * 50, 16)])
+@pytest.mark.parametrize('overlap', [1, 2, 3])
+def test_small_overlap_multibyte_advances(text, max_bytes, overlap):
+    chunks = list(iter_chunks(text, max_bytes=max_bytes, overlap=overlap))
+    for prev, chunk in zip(chunks, chunks[1:]):
+        assert chunk.byte_offset > prev.byte_offset
+        assert text[chunk.char_offset:chunk.char_offset + len(chunk.text)] == chunk.text
+    assert chunks[-1].char_offset + len(chunks[-1].text) == len(text)
+
+
+def test_overlap_must_leave_progress():
+    with pytest.raises(ValueError):
+        list(iter_chunks(TEXT, max_bytes=100, overlap=30))
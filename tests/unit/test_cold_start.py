@@ -0,0 +1,7 @@
+from scripts.benchmark_cold_start import LAZY_MODULES, MODULE, import_times
+
+
+def test_heavy_modules_are_imported_lazily():
+    times = import_times()
+    assert MODULE in times
+    assert [name for name in LAZY_MODULES if name in times] == []
@@ -0,0 +1,83 @@
+import time
+import random
+
+import pytest
+from botocore.exceptions import ClientError
+
+from dcc_phi_reporter import dispatch
+
+
+def throttle_error():
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                       'DetectPiiEntities')
+
+
+def test_imap_ordered_keeps_order():
+    def slow_square(x):
+        time.sleep(random.uniform(0, 0.01))
+        return x * x
+
+    assert list(dispatch.imap_ordered(slow_square, range(50), max_workers=8)) == \
+        [x * x for x in range(50)]
+
+
+def test_throttling_backs_off_and_retries(monkeypatch):
+    monkeypatch.setattr(dispatch, 'BACKOFF_BASE', 0.001)
+    failures = {'left': 5}
+
+    def flaky(x):
+        if failures['left'] > 0:
+            failures['left'] -= 1
+            raise throttle_error()
+        return x
+
+    limiter = dispatch.AdaptiveLimiter(8)
+    assert list(dispatch.imap_ordered(flaky, range(20), max_workers=8, limiter=limiter)) == \
+        list(range(20))
+    assert limiter.limit < 8
+    assert limiter.in_flight == 0
+
+
+def test_other_errors_are_raised():
+    def broken(x):
+        raise ClientError({'Error': {'Code': 'TextSizeLimitExceededException'}}, 'DetectPiiEntities')
+
+    with pytest.raises(ClientError):
+        list(dispatch.imap_ordered(broken, range(3), max_workers=2))
+
+
+def test_aimd_limits():
+    limiter = dispatch.AdaptiveLimiter(4)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(throttled=True)
+    assert limiter.limit == 1
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 4
+
+
+def test_deadline_stops_early():
+    remaining = iter([10000, 10000, 100] + [100] * 100)
+    deadline = dispatch.Deadline(lambda: next(remaining), margin_ms=1000)
+    with pytest.raises(dispatch.DeadlineExceeded):
+        list(dispatch.imap_ordered(lambda x: x, range(10), max_workers=1, deadline=deadline))
+
+
+def test_deadline_bounds_wait_for_call_in_flight():
+    end = time.monotonic() + 1.2
+    deadline = dispatch.Deadline(lambda: int((end - time.monotonic()) * 1000), margin_ms=1000)
+    started = time.monotonic()
+    with pytest.raises(dispatch.DeadlineExceeded):
+        list(dispatch.imap_ordered(lambda x: time.sleep(2), range(1), max_workers=1, deadline=deadline))
+    assert time.monotonic() - started < 1
+
+
+def test_deadline_from_context():
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 500
+
+    assert dispatch.Deadline.from_context('') is None
+    assert dispatch.Deadline.from_context(Context()).expired()
@@ -0,0 +1,63 @@
+from dcc_phi_reporter import app
+from dcc_phi_reporter.entities import merge_entities, rebase_entities
+
+
+def entity(entity_type, begin, end, score=0.9):
+    return {'Score': score, 'Type': entity_type, 'BeginOffset': begin, 'EndOffset': end}
+
+
+def test_rebase_entities():
+    rebased = rebase_entities([entity('NAME', 1, 5)], 100)
+    assert (rebased[0]['BeginOffset'], rebased[0]['EndOffset']) == (101, 105)
+
+
+def test_merge_entities():
+    merged = merge_entities([
+        entity('NAME', 10, 20, 0.8),
+        entity('SSN', 30, 41),
+        entity('NAME', 10, 20, 0.95),
+        entity('NAME', 15, 25),
+        entity('DATE_TIME', 12, 18),
+        entity('NAME', 25, 30),
+    ])
+    assert list(merged) == [
+        entity('NAME', 10, 25, 0.95),
+        entity('DATE_TIME', 12, 18),
+        entity('NAME', 25, 30),
+        entity('SSN', 30, 41),
+    ]
+
+
+def test_detect_pii_global_offsets(comprehend_stub):
+    data = ('Nothing to see here. ' * 7 + 'Patient John Smith has SSN 123-45-6789. ') * 6
+    found = app.detect_pii(data, window_size=160, overlap=40)
+
+    assert len(comprehend_stub.calls) > 1
+    assert len([e for e in found if e['Type'] == 'NAME']) == 6
+    assert len([e for e in found if e['Type'] == 'SSN']) == 6
+    for e in found:
+        text = data[e['BeginOffset']:e['EndOffset']]
+        assert text == 'John Smith' or text == '123-45-6789'
+
+
+def test_entity_list_round_trip_and_summary():
+    from dcc_phi_reporter.entities import EntityList
+
+    found = EntityList([entity('NAME', 10, 20, 0.5), entity('SSN', 30, 41, 0.99), entity('NAME', 50, 60, 0.9)])
+    found.extend([entity('NAME', 1, 5)], 100)
+    assert len(found) == 4
+    assert found[3] == entity('NAME', 101, 105)
+    assert found.summary(top_k=2) == {
+        'count': 4,
+        'types': {'NAME': {'count': 3, 'score': 0.9}, 'SSN': {'count': 1, 'score': 0.99}},
+        'top': [['SSN', 30, 41, 0.99], ['NAME', 50, 60, 0.9]],
+    }
+
+
+def test_entity_list_window_offsets():
+    from dcc_phi_reporter.entities import EntityList
+
+    found = EntityList([entity('NAME', 1, 2)])
+    found.extend([entity('SSN', 3, 4)], origin=4096)
+    assert [e.get('WindowByteOffset') for e in found] == [0, 4096]
+    assert found.summary()['top'][1] == ['SSN', 3, 4, 0.9, 4096]
@@ -0,0 +1,147 @@
+import csv
+import io
+
+from urllib.parse import unquote_plus
+
+import boto3
+import pytest
+
+from botocore.config import Config
+
+from scripts import generate_bucket_manifest as manifest
+
+KEYS = ['top.txt', 'a/1.txt', 'a/2.txt', 'b/c/3.txt', 'b/c/4.txt', 'b/5.txt', 'd e/6,7.txt']
+
+
+def client_config():
+    # botocore 1.36+ sends aws-chunked bodies with checksums by default, and
+    # moto stores multipart parts with their checksum trailer; older
+    # botocore only sends checksums when required and has no such setting
+    try:
+        return Config(request_checksum_calculation='when_required')
+    except TypeError:
+        return Config()
+
+
+@pytest.fixture
+def bucket(s3_client):
+    s3_client = boto3.client('s3', region_name='us-east-1', config=client_config())
+    s3_client.create_bucket(Bucket='data')
+    for key in KEYS:
+        s3_client.put_object(Bucket='data', Key=key, Body=b'x')
+    return s3_client
+
+
+class FailingClient:
+    """S3 client whose shard listings fail after a number of pages."""
+    def __init__(self, client, pages):
+        self.client = client
+        self.pages = pages
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def list_objects_v2(self, **kwargs):
+        if 'EncodingType' in kwargs:
+            if not self.pages:
+                raise RuntimeError('Connection reset')
+            self.pages -= 1
+        return self.client.list_objects_v2(**kwargs, MaxKeys=1)
+
+
+class PagingClient:
+    """S3 client listing one key or prefix per page, counting delimited listings."""
+    def __init__(self, client):
+        self.client = client
+        self.levels = []
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def list_objects_v2(self, **kwargs):
+        if 'Delimiter' in kwargs and 'EncodingType' not in kwargs:
+            self.levels.append(kwargs['Prefix'])
+        return self.client.list_objects_v2(**kwargs, MaxKeys=1)
+
+
+def manifest_keys(client):
+    body = client.get_object(Bucket='data', Key='manifest.csv')['Body'].read().decode('utf-8')
+    return sorted(unquote_plus(key) for _, key in csv.reader(io.StringIO(body)))
+
+
+def test_discover_shards_cover_every_key_once(bucket):
+    shards = manifest.discover_shards(bucket, 'data', min_shards=3)
+    assert sorted(shards) == [('', False), ('a/', True), ('b/', True), ('d e/', True)]
+    listed = [content['Key'] for shard in shards
+              for contents, _, _ in manifest.list_shard(bucket, 'data', shard) for content in contents]
+    assert sorted(unquote_plus(key) for key in listed) == sorted(KEYS)
+
+
+def test_discover_shards_reads_first_pages(bucket):
+    client = PagingClient(bucket)
+    shards = manifest.discover_shards(client, 'data', min_shards=10)
+    assert all(client.levels.count(level) <= manifest.DISCOVERY_PAGES for level in client.levels)
+    assert ('', False) in shards
+
+    location = manifest.write_manifest(client, 'data', 'data', 'manifest.csv', workers=2)
+    assert location['Keys'] == len(KEYS)
+    assert manifest_keys(bucket) == sorted(KEYS)
+
+
+def test_write_manifest(bucket):
+    location = manifest.write_manifest(bucket, 'data', 'data', 'manifest.csv', workers=4)
+    assert location['Keys'] == len(KEYS)
+    assert location['ETag'] == bucket.head_object(Bucket='data', Key='manifest.csv')['ETag'].strip('"')
+    assert len(manifest_keys(bucket)) == len(KEYS)
+
+
+def test_write_manifest_sizes(bucket):
+    bucket.put_object(Bucket='data', Key='big.txt', Body=b'x' * 10)
+    manifest.write_manifest(bucket, 'data', 'data', 'manifest.csv', sizes=True)
+    body = bucket.get_object(Bucket='data', Key='manifest.csv')['Body'].read().decode('utf-8')
+    rows = {unquote_plus(key): (version, size) for _, key, version, size in csv.reader(io.StringIO(body))}
+    assert rows['big.txt'] == ('', '10')
+    assert rows['d e/6,7.txt'] == ('', '1')
+
+
+def test_write_manifest_resumes_from_checkpoint(bucket, tmp_path):
+    checkpoint = str(tmp_path / 'state.json')
+    with pytest.raises(RuntimeError):
+        manifest.write_manifest(FailingClient(bucket, pages=8), 'data', 'data', 'manifest.csv',
+                                workers=1, checkpoint=checkpoint, part_size=1)
+    state = manifest.load_checkpoint(checkpoint)
+    assert len(state['parts']) >= 3
+
+    location = manifest.write_manifest(bucket, 'data', 'data', 'manifest.csv',
+                                       workers=1, checkpoint=checkpoint, part_size=1)
+    assert location['Keys'] == len(KEYS)
+    assert len(manifest_keys(bucket)) == len(KEYS)
+    assert len(set(manifest_keys(bucket))) == len(KEYS)
+    assert not (tmp_path / 'state.json').exists()
+
+
+def test_object_filter():
+    modified = manifest.parse_time('2024-05-01T12:00:00')
+    content = {'Key': 'a/Notes%2C+2024.TXT', 'Size': 100, 'StorageClass': 'STANDARD', 'LastModified': modified}
+    assert manifest.ObjectFilter()(content)
+    assert manifest.ObjectFilter(extensions=('.txt',), min_size=100, max_size=100)(content)
+    assert not manifest.ObjectFilter(extensions=('.csv',))(content)
+    assert not manifest.ObjectFilter(ignore_prefixes=('a/',))(content)
+    assert not manifest.ObjectFilter(min_size=101)(content)
+    assert not manifest.ObjectFilter(storage_classes=('GLACIER',))(content)
+    assert manifest.ObjectFilter(modified_after=manifest.parse_time('2024-05-01'))(content)
+    assert not manifest.ObjectFilter(modified_before=manifest.parse_time('2024-05-01'))(content)
+
+
+def test_write_manifest_delta(bucket, tmp_path):
+    index = manifest.ManifestIndex(str(tmp_path / 'index.sqlite'), 'data')
+    first = manifest.write_manifest(bucket, 'data', 'data', 'manifest.csv', index=index,
+                                    object_filter=manifest.ObjectFilter(ignore_prefixes=('manifest',)))
+    assert first['Keys'] == len(KEYS)
+
+    bucket.put_object(Bucket='data', Key='a/1.txt', Body=b'changed')
+    bucket.put_object(Bucket='data', Key='a/new.txt', Body=b'x')
+    second = manifest.write_manifest(bucket, 'data', 'data', 'manifest.csv', index=index,
+                                     object_filter=manifest.ObjectFilter(ignore_prefixes=('manifest',)))
+    assert second['Keys'] == 2
+    assert manifest_keys(bucket) == ['a/1.txt', 'a/new.txt']
@@ -1,9 +1,15 @@
+import io
+import gzip
 import json
+import math
+import tarfile
+import zipfile
 
 import pytest
 from moto import mock_s3
+from botocore.exceptions import EndpointConnectionError
 
-from dcc_phi_reporter import app
+from dcc_phi_reporter import app, sampling
 
 MY_BUCKET = "my_bucket"
 MY_PREFIX = "mock_folder"
@@ -106,3 +112,340 @@ def test_lambda_handler(s3Batch_event, mocker):
     # print(ret)
     # assert ret["invocationId"] == s3Batch_event["invocationId"]
     # assert ret["invocationSchemaVersion"] == s3Batch_event["invocationSchemaVersion"]
+
+
+@pytest.fixture()
+def text_object(s3_client, mocker):
+    s3_client.create_bucket(Bucket="s3batch-dev-unmanaged")
+    s3_client.put_object(Bucket="s3batch-dev-unmanaged", Key="example_texts_1/text1.txt",
+                         Body=b"Patient John Smith, SSN 123-45-6789.")
+    mocker.patch.dict(app._clients, {('client', 's3'): s3_client})
+    return s3_client
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def test_lambda_handler_detects_pii(s3Batch_event, text_object, comprehend_stub):
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    assert ret["invocationId"] == s3Batch_event["invocationId"]
+    assert ret["results"][0]["resultCode"] == "Succeeded"
+    assert "John Smith" not in ret["results"][0]["resultString"]
+    assert '"NAME"' in ret["results"][0]["resultString"]
+
+
+def test_lambda_handler_deadline(s3Batch_event, text_object, comprehend_stub):
+    ret = app.lambda_handler(s3Batch_event, Context(100))
+    assert ret["results"][0]["resultCode"] == "TemporaryFailure"
+    assert comprehend_stub.calls == []
+
+
+def test_lambda_handler_all_tasks(s3Batch_event, text_object, comprehend_stub):
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="example_texts_1/clean.txt",
+                           Body=b"Nothing to report here.")
+    template = s3Batch_event["tasks"][0]
+    s3Batch_event["tasks"] = [
+        dict(template, taskId="t1"),
+        dict(template, taskId="t2", s3Key="example_texts_1/missing.txt"),
+        dict(template, taskId="t3", s3Key="example_texts_1/clean.txt"),
+    ]
+
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    results = {r["taskId"]: r for r in ret["results"]}
+    assert [r["taskId"] for r in ret["results"]] == ["t1", "t2", "t3"]
+    assert results["t1"]["resultCode"] == "Succeeded"
+    assert '"NAME"' in results["t1"]["resultString"]
+    assert json.loads(results["t1"]["resultString"])["stats"]["chunks_sent"] == 1
+    assert results["t2"]["resultCode"] == "PermanentFailure"
+    assert results["t3"]["resultCode"] == "Succeeded"
+    assert json.loads(results["t3"]["resultString"])["entities"] == {'count': 0, 'types': {}, 'top': []}
+
+
+def test_lambda_handler_replays_cached_results(s3Batch_event, text_object, comprehend_stub, mocker):
+    mocker.patch.object(app, 'result_cache', app.resultcache.SQLiteResultCache(':memory:'))
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="example_texts_1/copy.txt",
+                           Body=b"Patient John Smith, SSN 123-45-6789.")
+    head_object = mocker.spy(text_object, 'head_object')
+
+    first = app.lambda_handler(s3Batch_event, Context(60000))
+    calls = len(comprehend_stub.calls)
+    s3Batch_event["tasks"][0]["s3Key"] = "example_texts_1/copy.txt"
+    second = app.lambda_handler(s3Batch_event, Context(60000))
+
+    assert len(comprehend_stub.calls) == calls
+    assert second["results"][0]["resultCode"] == "Succeeded"
+    assert second["results"][0]["resultString"] == first["results"][0]["resultString"]
+    # Only parameters the pinned botocore knows about
+    assert [set(kwargs) for _, kwargs in head_object.call_args_list] == [{'Bucket', 'Key'}] * 2
+
+
+def test_lambda_handler_streams_large_text(s3Batch_event, text_object, comprehend_stub, mocker):
+    mocker.patch.object(app, 'STREAM_MIN_SIZE', 10)
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    assert ret["results"][0]["resultCode"] == "Succeeded"
+    assert '"NAME"' in ret["results"][0]["resultString"]
+
+
+def test_lambda_handler_sample_mode(s3Batch_event, text_object, comprehend_stub, mocker):
+    mocker.patch.object(app, 'SCAN_MODE', 'sample')
+    mocker.patch.object(sampling, 'SIZE_TIERS', ((1000, 0), (math.inf, 4)))
+    body = ('Routine log line without anything in it. ' * 5000).encode('utf-8')
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="example_texts_1/text1.txt", Body=body)
+
+    ret = app.lambda_handler(s3Batch_event, "")
+    result = ret["results"][0]
+    assert result["resultCode"] == "Succeeded"
+    sample = json.loads(result["resultString"])["sample"]
+    assert sample["windows"] == 4
+    assert sample["escalate"] is False
+    assert sum(len(call.encode('utf-8')) for call in comprehend_stub.calls) < len(body) / 2
+
+
+def test_lambda_handler_scans_zip_members(s3Batch_event, text_object, comprehend_stub, mocker):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr('notes/visit.txt', b'Patient John Smith, SSN 123-45-6789.')
+        zf.writestr('notes/clean.txt', b'Nothing to report here.')
+        zf.writestr('nested.zip', b'')
+        zf.writestr('scan.png', b'')
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="uploads/batch.zip", Body=buffer.getvalue())
+    s3Batch_event["tasks"][0]["s3Key"] = "uploads/batch.zip"
+
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    result = ret["results"][0]
+    assert result["resultCode"] == "Succeeded"
+    members = json.loads(result["resultString"])["members"]
+    assert [m["member"] for m in members] == ['notes/visit.txt', 'notes/clean.txt', 'nested.zip', 'scan.png']
+    assert members[0]["entities"]["types"] == {'NAME': {'count': 1, 'score': 0.99}, 'SSN': {'count': 1, 'score': 0.99}}
+    assert members[1]["entities"]["count"] == 0
+    assert members[2] == {'member': 'nested.zip', 'status': 'skipped', 'reason': 'nested archive'}
+    assert members[3]["reason"] == 'unsupported type'
+
+
+def test_lambda_handler_scans_tar_gz(s3Batch_event, text_object, comprehend_stub):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tf:
+        data = b'name,notes\nJohn Smith,ok\n'
+        info = tarfile.TarInfo('table.csv')
+        info.size = len(data)
+        tf.addfile(info, io.BytesIO(data))
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="uploads/batch.tar.gz", Body=buffer.getvalue())
+    s3Batch_event["tasks"][0]["s3Key"] = "uploads/batch.tar.gz"
+
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    report = json.loads(ret["results"][0]["resultString"])
+    assert report["members"][0]["columns"] == {'name': {'NAME': {'count': 1, 'score': 0.99}}}
+    assert report["bytes_scanned"] == len(data)
+
+
+def test_lambda_handler_bad_archive(s3Batch_event, text_object, comprehend_stub):
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="uploads/broken.zip",
+                           Body=b'PK\x03\x04' + b'not a zip' * 10)
+    s3Batch_event["tasks"][0]["s3Key"] = "uploads/broken.zip"
+
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    assert ret["results"][0]["resultCode"] == "PermanentFailure"
+
+
+def test_lambda_handler_sniffs_content(s3Batch_event, text_object, comprehend_stub):
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="uploads/notes.dat",
+                           Body=b"Patient John Smith, SSN 123-45-6789.")
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="uploads/photo.txt",
+                           Body=b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 100)
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="uploads/empty.txt", Body=b'')
+    template = s3Batch_event["tasks"][0]
+    s3Batch_event["tasks"] = [
+        dict(template, taskId="t1", s3Key="uploads/notes.dat"),
+        dict(template, taskId="t2", s3Key="uploads/photo.txt"),
+        dict(template, taskId="t3", s3Key="uploads/empty.txt"),
+    ]
+
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    results = {r["taskId"]: r for r in ret["results"]}
+    assert '"NAME"' in results["t1"]["resultString"]
+    assert results["t2"]["resultCode"] == "Succeeded"
+    assert json.loads(results["t2"]["resultString"]) == {'skipped': 'image/png'}
+    assert json.loads(results["t3"]["resultString"])["entities"] == {'count': 0, 'types': {}, 'top': []}
+
+
+def test_fetch_head_reused_for_whole_object(text_object, mocker):
+    head = app.fetch_head("s3batch-dev-unmanaged", "example_texts_1/text1.txt", size=16)
+    assert head.data == b"Patient John Smi"
+    assert head.size == 36
+    assert head.mimetype == app.sniff.TEXT
+    assert b''.join(app.iter_object("s3batch-dev-unmanaged", "example_texts_1/text1.txt", head)) == \
+        b"Patient John Smith, SSN 123-45-6789."
+
+    whole = app.fetch_head("s3batch-dev-unmanaged", "example_texts_1/text1.txt")
+    assert whole.complete
+    get_object = mocker.spy(text_object, 'get_object')
+    assert list(app.iter_object("s3batch-dev-unmanaged", "example_texts_1/text1.txt", whole)) == [whole.data]
+    assert get_object.call_count == 0
+
+
+def test_lambda_handler_scans_json_paths(s3Batch_event, text_object, comprehend_stub):
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="stories/a.story.json",
+                           Body=json.dumps({"pages": [{"caption": "John Smith", "size": [1, 2]}]}).encode('utf-8'))
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="stories/log.json",
+                           Body=b"[INFO] John Smith logged in")
+    template = s3Batch_event["tasks"][0]
+    s3Batch_event["tasks"] = [
+        dict(template, taskId="t1", s3Key="stories/a.story.json"),
+        dict(template, taskId="t2", s3Key="stories/log.json"),
+    ]
+
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    report = json.loads(ret["results"][0]["resultString"])
+    assert report["paths"] == {'$.pages[*].caption': {'NAME': {'count': 1, 'score': 0.99}}}
+    # Not actually JSON, scanned as plain text instead
+    assert '"NAME"' in ret["results"][1]["resultString"]
+    assert "paths" not in ret["results"][1]["resultString"]
+
+
+def test_lambda_handler_scans_large_json_as_text(s3Batch_event, text_object, comprehend_stub, mocker):
+    mocker.patch.object(app, 'JSON_PATH_MAX_SIZE', 10)
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="logs/a.jsonl",
+                           Body=b'{"msg": "John Smith logged in"}\n' * 3)
+    s3Batch_event["tasks"][0]["s3Key"] = "logs/a.jsonl"
+
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    report = json.loads(ret["results"][0]["resultString"])
+    assert "paths" not in report
+    assert report["entities"]["count"] == 3
+
+
+def test_lambda_handler_retries_json_as_text(s3Batch_event, text_object, comprehend_stub, mocker):
+    mocker.patch.object(app, 'CHECKPOINT_PREFIX', 's3://s3batch-dev-unmanaged/checkpoints')
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="stories/a.story.json",
+                           Body=json.dumps({"caption": "John Smith"}).encode('utf-8'))
+    s3Batch_event["tasks"][0]["s3Key"] = "stories/a.story.json"
+    mocker.patch.object(app, 'scan_json', side_effect=app.dispatch.DeadlineExceeded('0ms left'))
+
+    first = app.lambda_handler(s3Batch_event, Context(60000))
+    assert first["results"][0]["resultCode"] == "TemporaryFailure"
+    # A scan by path cannot resume, the retry scans the object as text
+    second = app.lambda_handler(s3Batch_event, Context(60000))
+    assert app.scan_json.call_count == 1
+    assert second["results"][0]["resultCode"] == "Succeeded"
+    assert json.loads(second["results"][0]["resultString"])["entities"]["count"] == 1
+    assert "Contents" not in text_object.list_objects_v2(Bucket="s3batch-dev-unmanaged", Prefix="checkpoints/")
+
+
+def test_lambda_handler_scans_ome_fields(s3Batch_event, text_object, comprehend_stub):
+    import numpy
+    import tifffile
+
+    description = ('<OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06">'
+                   '<Image Name="John Smith"><Pixels>' + '<Plane TheZ="0"/>' * 500 +
+                   '</Pixels></Image></OME>')
+    buffer = io.BytesIO()
+    tifffile.imwrite(buffer, numpy.zeros((16, 16), dtype='uint8'), description=description, metadata=None)
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="slides/a.ome.tif", Body=buffer.getvalue())
+    s3Batch_event["tasks"][0]["s3Key"] = "slides/a.ome.tif"
+
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    report = json.loads(ret["results"][0]["resultString"])
+    assert report["xpaths"] == {'/OME/Image/@Name': {'NAME': {'count': 1, 'score': 0.99}}}
+    assert comprehend_stub.calls == ['/OME/Image/@Name: John Smith\n']
+
+
+@pytest.mark.parametrize('fallback', [False, True])
+def test_lambda_handler_scans_every_tiff_tag(s3Batch_event, text_object, comprehend_stub, mocker, fallback):
+    import numpy
+    import tifffile
+
+    mocker.patch.object(app, 'TIFF_SCAN', 'all')
+    if fallback:
+        # A layout only tifffile reads
+        mocker.patch.object(app.tiffmeta, 'iter_ifds', side_effect=app.tiffmeta.TiffLayoutError('odd layout'))
+    buffer = io.BytesIO()
+    with tifffile.TiffWriter(buffer) as tif:
+        tif.write(numpy.zeros((64, 64), 'uint8'), description='<OME><Image Name="slide 7"/></OME>',
+                  software='scanner', metadata=None)
+        tif.write(numpy.zeros((16, 16), 'uint8'), description='label', software='scanner', metadata=None,
+                  extratags=[(315, 's', 0, 'John Smith', True)])
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="slides/b.svs.tif", Body=buffer.getvalue())
+    s3Batch_event["tasks"][0]["s3Key"] = "slides/b.svs.tif"
+
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    report = json.loads(ret["results"][0]["resultString"])
+    assert report["ifds"] == 2
+    assert report["values_sent"] == 4
+    assert report["xpaths"] == {'/TIFF/Artist': {'NAME': {'count': 1, 'score': 0.99}}}
+
+
+def test_lambda_handler_writes_sidecar(s3Batch_event, text_object, comprehend_stub, mocker):
+    mocker.patch.object(app, 'RESULTS_PREFIX', 's3://s3batch-dev-unmanaged/phi-results')
+    mocker.patch.object(app.report, 'RESULT_STRING_LIMIT', 240)
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+
+    result = json.loads(ret["results"][0]["resultString"])
+    assert result["sidecar"] == ('s3://s3batch-dev-unmanaged/phi-results/s3batch-dev-unmanaged/'
+                                 'example_texts_1/text1.txt.entities.jsonl.gz')
+    # Offsets did not fit, they are in the sidecar
+    assert result["entities"]["count"] == 2
+    assert result["entities"]["top"] == []
+    body = text_object.get_object(Bucket="s3batch-dev-unmanaged",
+                                  Key=result["sidecar"].split('/', 3)[3])['Body'].read()
+    assert len(gzip.decompress(body).splitlines()) == 3
+
+
+def test_lambda_handler_resumes_from_checkpoint(s3Batch_event, text_object, comprehend_stub, mocker):
+    mocker.patch.object(app, 'CHECKPOINT_PREFIX', 's3://s3batch-dev-unmanaged/checkpoints')
+    mocker.patch.object(app.checkpoint, 'SAVE_EVERY_CHUNKS', 2)
+    save = mocker.spy(app.checkpoint.TaskCheckpoint, 'save')
+    body = ''.join(f'Visit {i}: patient John Smith, SSN 123-45-6789. ' for i in range(5000))
+    text_object.put_object(Bucket="s3batch-dev-unmanaged", Key="example_texts_1/text1.txt", Body=body.encode())
+    chunks = len(list(app.chunking.iter_chunks(body, app.BYTE_MAX, app.WINDOW_OVERLAP)))
+
+    # Time runs out once the first checkpoint is saved
+    context = Context(60000)
+    context.get_remaining_time_in_millis = lambda: 100 if save.call_count else 60000
+    first = app.lambda_handler(s3Batch_event, context)
+    assert first["results"][0]["resultCode"] == "TemporaryFailure"
+    listed = text_object.list_objects_v2(Bucket="s3batch-dev-unmanaged", Prefix="checkpoints/")
+    assert len(listed["Contents"]) == 1
+
+    # The retry lands on a fresh container
+    mocker.patch.object(app, 'chunk_cache', app.chunkcache.ChunkCache())
+    sent = len(comprehend_stub.calls)
+    second = app.lambda_handler(s3Batch_event, Context(60000))
+    assert second["results"][0]["resultCode"] == "Succeeded"
+    assert len(comprehend_stub.calls) - sent < chunks
+    assert json.loads(second["results"][0]["resultString"])["entities"]["count"] == 10000
+    assert "Contents" not in text_object.list_objects_v2(Bucket="s3batch-dev-unmanaged", Prefix="checkpoints/")
+
+
+def test_lambda_handler_packs_small_objects(s3Batch_event, text_object, comprehend_stub, mocker):
+    template = s3Batch_event["tasks"][0]
+    s3Batch_event["tasks"] = []
+    for i in range(20):
+        key = f"example_texts_1/note{i}.txt"
+        text_object.put_object(Bucket="s3batch-dev-unmanaged", Key=key,
+                               Body=f"Note {i}: John Smith, SSN 123-45-6789.".encode())
+        s3Batch_event["tasks"].append(dict(template, taskId=f"t{i}", s3Key=key))
+    unpacked = app.lambda_handler(s3Batch_event, Context(60000))
+    calls = len(comprehend_stub.calls)
+
+    comprehend_stub.calls.clear()
+    mocker.patch.object(app, 'chunk_cache', app.chunkcache.ChunkCache())
+    mocker.patch.object(app, 'PACK_OBJECT_BYTES', 1024)
+    packed = app.lambda_handler(s3Batch_event, Context(60000))
+
+    assert calls == 20
+    assert len(comprehend_stub.calls) == 1
+    entities = [[json.loads(r["resultString"])["entities"] for r in ret["results"]] for ret in (packed, unpacked)]
+    assert entities[0] == entities[1]
+
+
+def test_lambda_handler_scans_unpacked_when_packing_fails(s3Batch_event, text_object, comprehend_stub, mocker):
+    mocker.patch.object(app, 'PACK_OBJECT_BYTES', 1024)
+    mocker.patch.object(app, 'pack_pii', side_effect=EndpointConnectionError(endpoint_url='https://comprehend'))
+    ret = app.lambda_handler(s3Batch_event, Context(60000))
+    assert app.pack_pii.called
+    assert [r["resultCode"] for r in ret["results"]] == ["Succeeded"]
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from dcc_phi_reporter import app, jsonleaves
+
+STORY = {
+    'title': 'Visit notes',
+    'scenes': [
+        {'text': 'John Smith came in', 'frames': list(range(50)), 'speaker': 'nurse'},
+        {'text': 'John Smith came in', 'frames': [], 'speaker': 'nurse'},
+    ],
+    'thumbnail': 'iVBORw0KGgo' * 40,
+    'odd key': 'tab\there é "quoted"',
+    'done': True,
+    'score': -1.5e3,
+}
+
+
+def pieces_of(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 7, 4096])
+def test_iter_string_leaves_across_pieces(size):
+    data = json.dumps(STORY).encode('utf-8')
+    assert list(jsonleaves.iter_string_leaves(pieces_of(data, size))) == [
+        ('$.title', 'Visit notes'),
+        ('$.scenes[*].text', 'John Smith came in'),
+        ('$.scenes[*].speaker', 'nurse'),
+        ('$.scenes[*].text', 'John Smith came in'),
+        ('$.scenes[*].speaker', 'nurse'),
+        ('$.thumbnail', 'iVBORw0KGgo' * 40),
+        ("$['odd key']", 'tab\there é "quoted"'),
+    ]
+
+
+def test_iter_string_leaves_json_lines():
+    data = b'{"a": "x"}\n{"a": ["y", 1]}\n"z"\n'
+    assert list(jsonleaves.iter_string_leaves([data])) == [('$.a', 'x'), ('$.a[*]', 'y'), ('$', 'z')]
+
+
+@pytest.mark.parametrize('data', [b'[1,', b'{"a" 1}', b'[1,]', b'"abc', b'[INFO] started', b'{1: 2}'])
+def test_iter_string_leaves_rejects_non_json(data):
+    with pytest.raises(jsonleaves.JSONLeafError):
+        list(jsonleaves.iter_string_leaves([data]))
+
+
+def test_collect_leaves_drops_blobs_and_repeats():
+    leaves = jsonleaves.iter_string_leaves([json.dumps(STORY).encode('utf-8')])
+    paths, counts = jsonleaves.collect_leaves(leaves)
+    assert [(p.name, p.values()) for p in paths] == [
+        ('$.title', ['Visit notes']),
+        ('$.scenes[*].text', ['John Smith came in']),
+        ('$.scenes[*].speaker', ['nurse']),
+        ("$['odd key']", ['tab\there é "quoted"']),
+    ]
+    assert counts == {'leaves': 7, 'blobs': 1, 'distinct': 4}
+
+
+def test_path_values_are_capped():
+    values = jsonleaves.PathValues('$.events[*].id', cap=3, sample_size=2)
+    for i in range(100):
+        values.add(f'id {i % 50}')
+    assert values.sampled
+    assert values.seen == 100
+    assert values.values()[:3] == ['id 0', 'id 1', 'id 2']
+    assert len(values.values()) == 5
+
+
+def test_scan_json_reports_paths(comprehend_stub):
+    story = dict(STORY, scenes=STORY['scenes'] * 500)
+    data = json.dumps(story).encode('utf-8')
+    report = app.scan_json(pieces_of(data, 1000))
+
+    assert report['values_sent'] == 4
+    assert report['blobs_skipped'] == 1
+    assert report['paths'] == {'$.scenes[*].text': {'NAME': {'count': 1, 'score': 0.99}}}
+    assert sum(len(call) for call in comprehend_stub.calls) < len(data) / 100
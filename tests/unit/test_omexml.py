@@ -0,0 +1,60 @@
+import pytest
+
+from dcc_phi_reporter import app, omexml
+
+PLANES = ''.join(f'<Plane TheC="0" TheT="0" TheZ="{z}" PositionX="1.5"/>' for z in range(2000))
+OME = f'''<?xml version="1.0" encoding="UTF-8"?>
+<OME xmlns="http://www.openmicroscopy.org/Schemas/OME/2016-06">
+  <Experimenter ID="Experimenter:0" FirstName="John" LastName="Smith" Email="js@example.org"/>
+  <Image ID="Image:0" Name="John Smith biopsy">
+    <Description>Scanned for John Smith, SSN 123-45-6789</Description>
+    <Pixels ID="Pixels:0" DimensionOrder="XYZCT" Type="uint8" SizeX="512" SizeY="512" SizeZ="2000" SizeC="1" SizeT="1">
+      <Channel ID="Channel:0:0" Name="DAPI" SamplesPerPixel="1"/>
+      <TiffData IFD="0" PlaneCount="2000"><UUID FileName="slide.ome.tif">urn:uuid:1</UUID></TiffData>
+      {PLANES}
+    </Pixels>
+  </Image>
+  <StructuredAnnotations>
+    <XMLAnnotation ID="Annotation:0">
+      <Value>
+        <OriginalMetadata><Key>Patient</Key><Value>John Smith</Value></OriginalMetadata>
+        <OriginalMetadata><Key>Objective</Key><Value>20x</Value></OriginalMetadata>
+      </Value>
+    </XMLAnnotation>
+    <CommentAnnotation ID="Annotation:1"><Value>reviewed</Value></CommentAnnotation>
+  </StructuredAnnotations>
+</OME>'''
+
+
+def test_iter_text_fields_keeps_free_text_only():
+    assert list(omexml.iter_text_fields(OME)) == [
+        ('/OME/Experimenter/@FirstName', 'John'),
+        ('/OME/Experimenter/@LastName', 'Smith'),
+        ('/OME/Experimenter/@Email', 'js@example.org'),
+        ('/OME/Image/@Name', 'John Smith biopsy'),
+        ('/OME/Image/Description', 'Scanned for John Smith, SSN 123-45-6789'),
+        ('/OME/Image/Pixels/Channel/@Name', 'DAPI'),
+        ("/OME/StructuredAnnotations/XMLAnnotation/Value/OriginalMetadata[Key='Patient']/Value", 'John Smith'),
+        ("/OME/StructuredAnnotations/XMLAnnotation/Value/OriginalMetadata[Key='Objective']/Value", '20x'),
+        ('/OME/StructuredAnnotations/CommentAnnotation/Value', 'reviewed'),
+    ]
+
+
+@pytest.mark.parametrize('description', ['ImageJ=1.53\nimages=3', '<Root><Image Name="x"/></Root>', '<OME><Image'])
+def test_iter_text_fields_rejects_non_ome(description):
+    with pytest.raises(omexml.OMEXMLError):
+        list(omexml.iter_text_fields(description))
+
+
+def test_scan_ome_sends_one_request(comprehend_stub):
+    report = app.scan_ome(OME)
+
+    assert len(comprehend_stub.calls) == 1
+    assert len(comprehend_stub.calls[0]) < len(OME) / 50
+    assert report['values_sent'] == 9
+    assert report['xpaths'] == {
+        '/OME/Image/@Name': {'NAME': {'count': 1, 'score': 0.99}},
+        '/OME/Image/Description': {'NAME': {'count': 1, 'score': 0.99}, 'SSN': {'count': 1, 'score': 0.99}},
+        "/OME/StructuredAnnotations/XMLAnnotation/Value/OriginalMetadata[Key='Patient']/Value":
+            {'NAME': {'count': 1, 'score': 0.99}},
+    }
@@ -0,0 +1,40 @@
+import pytest
+
+from dcc_phi_reporter import app, packing
+
+
+def test_pack_documents_respects_limit():
+    documents = ['a' * 4, 'é' * 3, 'b' * 5, 'c']
+    packs = list(packing.pack_documents(documents, max_bytes=12))
+    assert [pack.text for pack in packs] == ['aaaa\n\nééé', 'bbbbb\n\nc']
+    assert packs[0].spans == [(0, 0, 4), (1, 6, 9)]
+    assert packs[1].spans == [(2, 0, 5), (3, 7, 8)]
+    with pytest.raises(ValueError):
+        list(packing.pack_documents(['x' * 13], max_bytes=12))
+
+
+def test_split_entities():
+    pack = packing.Pack('John\n\nSmith Jr', [(0, 0, 4), (1, 6, 14)])
+    found = [
+        {'Type': 'NAME', 'BeginOffset': 0, 'EndOffset': 4, 'Score': 0.9},
+        # Runs across the separator, cut at the end of the first document
+        {'Type': 'NAME', 'BeginOffset': 2, 'EndOffset': 11, 'Score': 0.5},
+        # Starts in the separator
+        {'Type': 'NAME', 'BeginOffset': 5, 'EndOffset': 11, 'Score': 0.5},
+        {'Type': 'NAME', 'BeginOffset': 6, 'EndOffset': 11, 'Score': 0.8},
+    ]
+    split = packing.split_entities(pack, found)
+    assert [(e['BeginOffset'], e['EndOffset']) for e in split[0]] == [(0, 4), (2, 4)]
+    assert [(e['BeginOffset'], e['EndOffset']) for e in split[1]] == [(0, 5)]
+
+
+def test_pack_pii_matches_unpacked(comprehend_stub, mocker):
+    documents = [f'Note {i}: John Smith, SSN 123-45-6789.' for i in range(30)] + ['Nothing here.']
+    unpacked = [list(app.detect_pii(text)) for text in documents]
+    calls = len(comprehend_stub.calls)
+
+    comprehend_stub.calls.clear()
+    mocker.patch.object(app, 'chunk_cache', app.chunkcache.ChunkCache())
+    requests = app.pack_pii(documents, window_size=400)
+    assert [list(app.detect_pii(text)) for text in documents] == unpacked
+    assert len(comprehend_stub.calls) == requests < calls
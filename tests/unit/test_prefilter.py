@@ -0,0 +1,66 @@
+import pytest
+
+from dcc_phi_reporter import app, prefilter
+
+DOC = ('Seen 01/02/2020, call (555) 123-4567 or mail jo@example.org. '
+       'SSN 123-45-6789, MRN: 0012345, Boston MA 02115.')
+
+
+def hit_types(text):
+    return sorted(e['Type'] for e in prefilter.get_prefilter().scan(text))
+
+
+def test_scan_patterns():
+    assert hit_types(DOC) == ['ADDRESS', 'DATE_TIME', 'EMAIL', 'MRN', 'PHONE', 'SSN']
+
+
+def test_name_dictionary_whole_words():
+    matcher = prefilter.AhoCorasick(['ann', 'anna', 'smith'])
+    text = 'Anna Smith met Ann at Smithfield'
+    assert [text[b:e] for b, e in matcher.finditer(text)] == ['Anna', 'Smith', 'Ann']
+
+
+def test_classify():
+    screen = prefilter.get_prefilter()
+    assert screen.classify('1,2,3\n4,5,6\n', []) == prefilter.CLEAN
+    assert screen.classify('the patient was seen', []) == prefilter.AMBIGUOUS
+    assert screen.classify('x', [prefilter.entity('SSN', 0, 1)]) == prefilter.HIT
+
+
+NUMERIC = '1.5,2.25,3.125,4.0\n' * 400
+PROSE = 'The patient John Smith was seen today. '
+
+
+def test_skip_clean_skips_numeric_chunks(comprehend_stub):
+    stats = {}
+    found = app.detect_pii(NUMERIC + PROSE, overlap=0, policy=prefilter.SKIP_CLEAN, stats=stats)
+    assert len(comprehend_stub.calls) == 1
+    assert stats['chars_skipped'] > stats['chars_sent'] > 0
+    assert [e['Type'] for e in found] == ['NAME']
+
+
+def test_confirm_hits_sends_whole_document_or_nothing(comprehend_stub):
+    stats = {}
+    app.detect_pii('nothing here at all', policy=prefilter.CONFIRM_HITS, stats=stats)
+    assert comprehend_stub.calls == []
+    assert stats['chars_skipped'] == len('nothing here at all')
+
+    app.detect_pii(DOC, policy=prefilter.CONFIRM_HITS, stats=stats)
+    assert comprehend_stub.calls == [DOC]
+
+
+def test_confirm_hits_takes_encoded_document(comprehend_stub):
+    found = app.detect_pii(DOC.encode('utf-8'), policy=prefilter.CONFIRM_HITS)
+    assert comprehend_stub.calls == [DOC]
+    assert list(found) == list(app.detect_pii(DOC, policy=prefilter.CONFIRM_HITS))
+
+
+def test_local_only_never_calls_comprehend(comprehend_stub):
+    found = app.detect_pii(DOC, policy=prefilter.LOCAL_ONLY)
+    assert comprehend_stub.calls == []
+    assert sorted(e['Type'] for e in found) == hit_types(DOC)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        app.detect_pii(DOC, policy='sometimes')
@@ -0,0 +1,84 @@
+import json
+import os
+
+from scripts import process_s3batch_jobs as jobs
+
+GIB = 1024 ** 3
+JOBS_FILE = os.path.join(os.path.dirname(jobs.__file__), 'batch_jobs.json')
+
+
+def objects(sizes, extension='.txt'):
+    return [jobs.ManifestObject('data', f'obj{i}{extension}', size) for i, size in enumerate(sizes)]
+
+
+def test_plan_partitions_isolates_huge_objects():
+    planned = jobs.plan_partitions(objects([5 * GIB, 3 * GIB] + [100] * 1000 + [10 * 1024 * 1024] * 50),
+                                   job_bytes=4 * GIB)
+    assert [(p.size_class, len(p.objects)) for p in planned] == [('huge', 1), ('huge', 1), ('large', 50), ('small', 1000)]
+
+
+def test_plan_partitions_balances_bytes():
+    # No text, so only bytes count
+    sizes = [(i % 7 + 1) * 100 * 1024 * 1024 for i in range(70)]
+    planned = jobs.plan_partitions(objects(sizes, '.png'), job_bytes=GIB)
+    loads = [p.bytes for p in planned]
+    assert len(planned) == -(-sum(sizes) // GIB)
+    assert sum(len(p.objects) for p in planned) == 70
+    assert max(loads) - min(loads) <= 700 * 1024 * 1024
+
+
+def test_plan_partitions_fills_on_larger_share():
+    # Text is as many characters as bytes, counted once against both limits
+    planned = jobs.plan_partitions(objects([GIB // 2] * 2), job_bytes=GIB, job_chars=GIB)
+    assert [len(p.objects) for p in planned] == [2]
+
+
+def test_estimate_chars():
+    assert jobs.estimate_chars('a/notes.TXT', 1000) == 1000
+    assert jobs.estimate_chars('a/slide.ome.tiff', GIB) == jobs.TIFF_CHARS
+    assert jobs.estimate_chars('a/image.png', GIB) == 0
+
+
+def test_read_manifest_streams_rows(s3_client):
+    s3_client.create_bucket(Bucket='data')
+    s3_client.put_object(Bucket='data', Key='manifest.csv', Body='data,a+b.txt,,10\n\ndata,c%C3%A9.txt\n'.encode())
+    rows = jobs.read_manifest(s3_client, 's3://data/manifest.csv')
+    assert not isinstance(rows, list)
+    assert list(rows) == [('data', 'a+b.txt', 10), ('data', 'c%C3%A9.txt', None)]
+
+
+def test_plan_jobs(s3_client, tmp_path):
+    s3_client.create_bucket(Bucket='data')
+    rows = []
+    for i, size in enumerate([10, 20, 2 * 1024 * 1024]):
+        s3_client.put_object(Bucket='data', Key=f'dir/file {i}.txt', Body=b'x' * size)
+        rows.append(f'data,dir/file+{i}.txt\n')
+    (tmp_path / 'manifest.csv').write_text(''.join(rows))
+    with open(JOBS_FILE) as file:
+        template = jobs.S3BatchJob(**json.load(file)[0])
+
+    planned = jobs.plan_jobs(s3_client, template, str(tmp_path / 'manifest.csv'), 's3://data/plans')
+    assert [job.Priority for job in planned] == [template.Priority + 1, template.Priority]
+    assert len({job.ClientRequestToken for job in planned}) == 2
+    replanned = jobs.plan_jobs(s3_client, template, str(tmp_path / 'manifest.csv'), 's3://data/plans')
+    assert [job.ClientRequestToken for job in replanned] == [job.ClientRequestToken for job in planned]
+    location = planned[1].Manifest.Location
+    assert location.ObjectArn == 'arn:aws:s3:::data/plans/manifest-0002-small.csv'
+    body = s3_client.get_object(Bucket='data', Key='plans/manifest-0002-small.csv')
+    assert body['ETag'].strip('"') == location.ETag
+    assert sorted(body['Body'].read().splitlines()) == [b'data,dir/file+0.txt', b'data,dir/file+1.txt']
+    assert 'ObjectVersionId' not in planned[1].dict(exclude_unset=True)['Manifest']['Location']
+
+
+def test_plan_jobs_reads_manifest_sizes(s3_client, tmp_path, mocker):
+    s3_client.create_bucket(Bucket='data')
+    (tmp_path / 'manifest.csv').write_text('data,a.txt,,10\ndata,b.txt,,20\n')
+    with open(JOBS_FILE) as file:
+        template = jobs.S3BatchJob(**json.load(file)[0])
+    head_object = mocker.spy(s3_client, 'head_object')
+
+    planned = jobs.plan_jobs(s3_client, template, str(tmp_path / 'manifest.csv'), 's3://data/plans')
+    assert len(planned) == 1
+    assert not head_object.called
+    body = s3_client.get_object(Bucket='data', Key='plans/manifest-0001-small.csv')['Body'].read()
+    assert sorted(body.splitlines()) == [b'data,a.txt', b'data,b.txt']
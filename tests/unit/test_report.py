@@ -0,0 +1,61 @@
+import gzip
+import json
+
+from dcc_phi_reporter import report
+from dcc_phi_reporter.entities import EntityList
+
+
+def many_entities(n):
+    return EntityList({'Score': 0.9, 'Type': 'NAME' if i % 2 else 'SSN', 'BeginOffset': i * 10,
+                       'EndOffset': i * 10 + 5} for i in range(n))
+
+
+def test_encode_is_canonical_json():
+    encoded = report.encode({'b': 1, 'a': [1, 2], 'entities': many_entities(2)}, top_k=1)
+    assert encoded == ('{"a":[1,2],"b":1,"entities":{"count":2,'
+                       '"top":[["SSN",0,5,0.9]],"types":{"NAME":{"count":1,"score":0.9},'
+                       '"SSN":{"count":1,"score":0.9}}}}')
+
+
+def test_bounded_drops_detail_to_fit():
+    result = {'entities': many_entities(100000)}
+    full = report.bounded(result, limit=10000)
+    assert len(json.loads(full)['entities']['top']) == report.TOP_K
+
+    no_top = json.loads(report.bounded(result, limit=150))
+    assert no_top['entities'] == {'count': 100000, 'top': [], 'types': {
+        'NAME': {'count': 50000, 'score': 0.9}, 'SSN': {'count': 50000, 'score': 0.9}}}
+
+    members = {'members': [{'member': f'file{i}.txt', 'status': 'scanned', 'entities': many_entities(3)}
+                           for i in range(100)],
+               'bytes_scanned': 1234, 'budget_exhausted': False}
+    compact = report.bounded(members, limit=200)
+    assert len(compact) <= 200
+    assert json.loads(compact) == {'budget_exhausted': False, 'bytes_scanned': 1234, 'truncated': True,
+                                   'types': {'SSN': {'count': 200, 'score': 0.9},
+                                             'NAME': {'count': 100, 'score': 0.9}}}
+
+
+def test_bounded_drops_stats_before_entities():
+    stats = {f'counter_{i}': i for i in range(20)}
+    result = json.loads(report.bounded({'entities': many_entities(4), 'stats': stats}, limit=150))
+    assert 'stats' not in result
+    assert result['entities']['count'] == 4
+
+
+def test_type_totals_include_named_reports():
+    result = {'columns': {'name': {'NAME': {'count': 2, 'score': 0.8}}},
+              'members': [{'member': 'a.json', 'paths': {'$.n': {'NAME': {'count': 1, 'score': 0.95}}}}]}
+    assert report.type_totals(result) == {'NAME': {'count': 3, 'score': 0.95}}
+
+
+def test_write_sidecar(s3_client):
+    s3_client.create_bucket(Bucket='results')
+    result = {'members': [{'member': 'a.txt', 'status': 'scanned', 'entities': many_entities(3)}]}
+    url = report.write_sidecar(s3_client, 's3://results/phi', 'data', 'x/y.zip', result)
+
+    assert url == 's3://results/phi/data/x/y.zip.entities.jsonl.gz'
+    body = s3_client.get_object(Bucket='results', Key='phi/data/x/y.zip.entities.jsonl.gz')['Body'].read()
+    lines = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+    assert lines[0]['members'][0]['entities']['count'] == 3
+    assert lines[1:] == [dict(entity, Member='a.txt') for entity in many_entities(3)]
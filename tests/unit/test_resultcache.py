@@ -0,0 +1,31 @@
+import boto3
+from moto import mock_dynamodb
+
+from dcc_phi_reporter import resultcache
+
+
+def test_cache_key():
+    assert resultcache.cache_key('"abc"', 10, namespace='v1') == 'v1|etag:abc|10'
+    assert resultcache.cache_key('"abc-2"', 10) == '|etag:abc-2|10'
+
+
+def test_sqlite_cache(tmp_path):
+    path = str(tmp_path / 'results.db')
+    cache = resultcache.from_url(f'sqlite://{path}')
+    assert cache.get('k') is None
+    cache.put('k', '[]')
+    cache.put('k', '[1]')
+    assert resultcache.SQLiteResultCache(path).get('k') == '[1]'
+
+
+def test_dynamodb_cache(aws_credentials):
+    with mock_dynamodb():
+        client = boto3.client('dynamodb', region_name='us-east-1')
+        client.create_table(TableName='phi-results',
+                            KeySchema=[{'AttributeName': 'cache_key', 'KeyType': 'HASH'}],
+                            AttributeDefinitions=[{'AttributeName': 'cache_key', 'AttributeType': 'S'}],
+                            BillingMode='PAY_PER_REQUEST')
+        cache = resultcache.DynamoDBResultCache('phi-results', client=client)
+        assert cache.get('k') is None
+        cache.put('k', '[]')
+        assert cache.get('k') == '[]'
@@ -0,0 +1,74 @@
+import csv
+
+import pytest
+
+from dcc_phi_reporter import app
+from scripts import run_manifest as runner
+
+KEYS = ['notes/a.txt', 'notes/b c.txt', 'notes/clean.txt', 'notes/missing.txt']
+
+
+@pytest.fixture
+def manifest(s3_client, comprehend_stub, mocker, tmp_path):
+    s3_client.create_bucket(Bucket='data')
+    for key in KEYS[:2]:
+        s3_client.put_object(Bucket='data', Key=key, Body=b'Patient John Smith, SSN 123-45-6789.')
+    s3_client.put_object(Bucket='data', Key=KEYS[2], Body=b'Nothing to see.')
+    mocker.patch.dict(app._clients, {('client', 's3'): s3_client})
+    path = tmp_path / 'manifest.csv'
+    path.write_text('data,notes/a.txt\ndata,notes/b+c.txt\ndata,notes/clean.txt\ndata,notes/missing.txt\n')
+    return str(path)
+
+
+def read_report(path):
+    with open(path, newline='') as file:
+        return {row[1]: row for row in csv.reader(file)}
+
+
+def test_run_manifest_writes_report(manifest, comprehend_stub, tmp_path):
+    report = str(tmp_path / 'report.csv')
+    counts = runner.run_manifest(manifest, report, processes=0, tasks_per_invocation=3)
+    assert counts == {'skipped': 0, 'succeeded': 3, 'failed': 1}
+
+    rows = read_report(report)
+    assert rows['notes/b+c.txt'][:6] == ['data', 'notes/b+c.txt', '', 'succeeded', '200', '']
+    assert '"NAME"' in rows['notes/b+c.txt'][6]
+    assert rows['notes/missing.txt'][3:6] == ['failed', '400', 'PermanentFailure']
+
+
+def test_run_manifest_resumes(manifest, comprehend_stub, tmp_path):
+    report = tmp_path / 'report.csv'
+    runner.run_manifest(manifest, str(report), processes=0)
+    lines = report.read_text().splitlines(keepends=True)
+    # Interrupted while writing the last row
+    report.write_text(''.join(lines[:2]) + lines[2][:10])
+
+    comprehend_stub.calls.clear()
+    counts = runner.run_manifest(manifest, str(report), processes=0)
+    assert counts == {'skipped': 2, 'succeeded': 1, 'failed': 1}
+    assert len(read_report(report)) == 4
+
+
+def test_invoke_retries_temporary_failures(mocker):
+    rows = [('data', 'a.txt', ''), ('data', 'b.txt', '')]
+    events = []
+
+    def handler(event, context):
+        events.append(event)
+        # a.txt fails temporarily on the first attempt only
+        return {'results': [{'taskId': task['taskId'], 'resultString': '{}',
+                             'resultCode': 'TemporaryFailure' if task['s3Key'] == 'a.txt' and len(events) == 1
+                             else 'Succeeded'} for task in event['tasks']]}
+    mocker.patch.object(app, 'lambda_handler', side_effect=handler)
+
+    results = runner.invoke(rows, 'job', retries=2)
+    assert [result['resultCode'] for _, result in results] == ['Succeeded', 'Succeeded']
+    assert [[task['s3Key'] for task in event['tasks']] for event in events] == [['a.txt', 'b.txt'], ['a.txt']]
+
+
+def test_init_worker_endpoint_url(mocker, monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    mocker.patch.dict(app._clients, clear=True)
+    runner.init_worker(endpoint_url='http://localhost:5000')
+    assert app.get_client('s3').meta.endpoint_url == 'http://localhost:5000'
+    assert app.get_client('comprehend').meta.endpoint_url == 'http://localhost:5000'
@@ -0,0 +1,73 @@
+import io
+
+import pytest
+
+from dcc_phi_reporter.app import S3File
+
+MY_BUCKET = "my_bucket"
+MY_KEY = "mock_folder/blob.bin"
+DATA = bytes(range(256)) * 64  # 16 KiB
+
+
+@pytest.fixture
+def s3_object(s3_client):
+    s3_client.create_bucket(Bucket=MY_BUCKET)
+    s3_client.put_object(Bucket=MY_BUCKET, Key=MY_KEY, Body=DATA)
+    return s3_client, MY_BUCKET, MY_KEY
+
+
+def test_small_reads_share_one_request(s3_object):
+    f = S3File(*s3_object, block_size=1024, read_ahead=2, max_blocks=8)
+    assert f.read(8) == DATA[:8]
+    assert f.read(16) == DATA[8:24]
+    f.seek(2048)
+    assert f.read(4) == DATA[2048:2052]
+    assert f.requests == 1
+
+
+def test_read_spanning_blocks_and_eof(s3_object):
+    f = S3File(*s3_object, block_size=1000, read_ahead=0, max_blocks=4)
+    f.seek(990)
+    assert f.read(20) == DATA[990:1010]
+    f.seek(-10, io.SEEK_END)
+    assert f.read(100) == DATA[-10:]
+    assert f.read(1) == b''
+
+
+def test_lru_eviction_is_bounded(s3_object):
+    f = S3File(*s3_object, block_size=1024, read_ahead=0, max_blocks=2)
+    for offset in (0, 4096, 8192):
+        f.seek(offset)
+        assert f.read(10) == DATA[offset:offset + 10]
+    assert len(f._blocks) == 2
+    f.seek(0)
+    f.read(10)
+    assert f.requests == 4
+
+
+def test_read_larger_than_cache(s3_object):
+    f = S3File(*s3_object, block_size=1024, read_ahead=0, max_blocks=2)
+    assert f.read() == DATA
+    assert len(f._blocks) == 0
+
+
+def test_head_serves_reads_without_requests(s3_object):
+    f = S3File(*s3_object, block_size=1024, read_ahead=0, max_blocks=4, head=DATA[:100], size=len(DATA))
+    assert f.read(8) == DATA[:8]
+    f.seek(90)
+    assert f.read(10) == DATA[90:100]
+    assert f.requests == 0
+    assert f.read(10) == DATA[100:110]
+    assert f.requests == 1
+
+
+def test_size_from_head_request(s3_object):
+    f = S3File(*s3_object)
+    assert f.size == len(DATA)
+
+
+def test_etag_must_match(s3_object):
+    s3_client = s3_object[0]
+    f = S3File(*s3_object, etag='"stale"')
+    with pytest.raises(s3_client.exceptions.ClientError):
+        f.read(8)
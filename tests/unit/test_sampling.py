@@ -0,0 +1,41 @@
+import math
+
+from dcc_phi_reporter import sampling
+
+MiB = 1024 * 1024
+
+
+def test_windows_for_size():
+    assert sampling.windows_for_size(10) == 0
+    assert sampling.windows_for_size(50 * MiB) == 8
+    assert sampling.windows_for_size(5 * 1024 * MiB) == 16
+    assert sampling.windows_for_size(5 * 1024 * 1024 * MiB) == 32
+
+
+def test_plan_windows_stratified_and_deterministic():
+    size = 100 * MiB
+    seed = sampling.seed_for('a/b.txt', '"etag"')
+    windows = sampling.plan_windows(size, 8, seed)
+    assert windows == sampling.plan_windows(size, 8, seed)
+    assert windows != sampling.plan_windows(size, 8, seed + 1)
+    for i, (start, end) in enumerate(windows):
+        assert end - start == sampling.SAMPLE_WINDOW
+        assert i * size / 8 <= start and end <= (i + 1) * size / 8
+
+
+def test_plan_windows_small_object():
+    assert sampling.plan_windows(1000, 8, 0) == [(0, 1000)]
+
+
+def test_coverage_report():
+    report = sampling.coverage_report(1000, [(0, 100), (500, 600)], 0)
+    assert report['coverage'] == 0.2
+    assert math.isclose(report['phi_fraction_upper'], 1 - 0.05 ** 0.5, abs_tol=1e-4)
+    assert not report['escalate']
+    assert sampling.coverage_report(1000, [(0, 100)], 1)['escalate']
+
+
+def test_decode_window_drops_partial_characters():
+    raw = 'ééé'.encode('utf-8')[1:-1]
+    assert sampling.decode_window(raw) == 'é'
+
@@ -0,0 +1,43 @@
+import gzip
+import io
+import tarfile
+
+from dcc_phi_reporter import sniff
+
+
+def test_detect_binary_signatures():
+    assert sniff.detect_mimetype(b'II*\x00\x08\x00\x00\x00') == sniff.TIFF
+    assert sniff.detect_mimetype(b'MM\x00+\x00\x08') == sniff.TIFF
+    assert sniff.detect_mimetype(b'PK\x03\x04rest') == sniff.ZIP
+    assert sniff.detect_mimetype(b'\x89PNG\r\n\x1a\n....') == 'image/png'
+    assert sniff.detect_mimetype(b'%PDF-1.7\n') == 'application/pdf'
+    assert sniff.detect_mimetype(b'\x00\x01\x02\x03') == sniff.BINARY
+
+
+def test_detect_gzip_and_tar():
+    assert sniff.detect_mimetype(gzip.compress(b'plain text')) == sniff.GZIP
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tf:
+        info = tarfile.TarInfo('a.txt')
+        info.size = 3
+        tf.addfile(info, io.BytesIO(b'abc'))
+    data = buffer.getvalue()
+    assert sniff.detect_mimetype(data[:sniff.SNIFF_BYTES]) == sniff.TAR
+    assert sniff.detect_mimetype(gzip.decompress(data)) == sniff.TAR
+
+
+def test_detect_text_kinds():
+    assert sniff.detect_mimetype(b'Patient notes', 'a.dat', complete=True) == sniff.TEXT
+    assert sniff.detect_mimetype(b'  {"a": 1}', 'a.txt') == sniff.JSON
+    assert sniff.detect_mimetype(b'\xef\xbb\xbf[1, 2]', 'a') == sniff.JSON
+    assert sniff.detect_mimetype(b'a,b\n1,2\n', 'a.CSV') == sniff.CSV
+    assert sniff.detect_mimetype(b'a\tb\n', 'a.tsv') == sniff.TSV
+    assert sniff.detect_mimetype(b'', 'empty.txt', complete=True) == sniff.TEXT
+
+
+def test_is_text_allows_cut_character():
+    head = 'café'.encode('utf-8')[:-1]
+    assert sniff.is_text(head, complete=False)
+    assert not sniff.is_text(head, complete=True)
+    assert not sniff.is_text(b'\xff\xfe' + 'text'.encode('utf-16-le'), complete=False)
@@ -0,0 +1,56 @@
+import tracemalloc
+
+import pytest
+
+from dcc_phi_reporter import app, streaming
+from dcc_phi_reporter.chunking import iter_chunks, iter_stream_chunks
+
+LINE = 'Visit note: John Smith reports mild pain. Plan: rest, fluids, follow up. '
+
+
+def test_stream_chunks_match_whole_document():
+    text = 'Grüße aus Köln, ' * 500 + LINE * 100
+    encoded = text.encode('utf-8')
+    pieces = (encoded[i:i + 333] for i in range(0, len(encoded), 333))
+    assert list(iter_stream_chunks(pieces, max_bytes=1000, overlap=100)) == \
+        list(iter_chunks(text, max_bytes=1000, overlap=100))
+
+
+def test_prefetch_preserves_order_and_errors():
+    assert list(streaming.prefetch(iter(range(100)), depth=3)) == list(range(100))
+
+    def broken():
+        yield b'ok'
+        raise IOError('connection reset')
+
+    with pytest.raises(IOError):
+        list(streaming.prefetch(broken()))
+
+
+class CountingComprehend:
+    """Comprehend stub that keeps nothing from the text it is sent."""
+    def __init__(self):
+        self.calls = 0
+
+    def detect_pii_entities(self, Text, LanguageCode):
+        self.calls += 1
+        return {'Entities': []}
+
+
+def test_streamed_detection_memory_is_bounded(mocker):
+    mocker.patch.dict(app._clients, {('client', 'comprehend'): CountingComprehend()})
+    mocker.patch.object(app, 'chunk_cache', app.chunkcache.ChunkCache(max_entries=0))
+    piece = ('Nothing to report in this line of the log file. ' * 1000).encode('utf-8')
+    total = 64 * 1024 * 1024
+    pieces = (piece for _ in range(total // len(piece)))
+
+    tracemalloc.start()
+    try:
+        app.detect_pii(streaming.prefetch(pieces), window_size=app.BYTE_MAX)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    bound = streaming.memory_bound(app.BYTE_MAX, app.COMPREHEND_WORKERS, read_size=len(piece))
+    assert peak < bound
+    assert peak < total // 20
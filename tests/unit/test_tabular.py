@@ -0,0 +1,44 @@
+from dcc_phi_reporter import app, tabular
+
+
+def test_iter_text_lines_across_pieces():
+    data = 'a,b\r\n"multi\nline",é\n3,4'.encode('utf-8')
+    pieces = [data[i:i + 3] for i in range(0, len(data), 3)]
+    assert ''.join(tabular.iter_text_lines(pieces)) == data.decode('utf-8')
+    assert list(tabular.iter_text_lines([b'x\ny\n'])) == ['x\n', 'y\n']
+
+
+def test_column_values_cap_then_sample():
+    column = tabular.ColumnValues('id', cap=10, sample_size=5)
+    for i in range(1000):
+        column.add(str(i % 100))
+    assert column.sampled
+    assert len(column.distinct) == 10
+    assert len(column.values()) <= 15
+
+
+def test_profile_table_dedupes_repeated_values():
+    lines = ['name\tdob\tcount\n'] + ['John Smith\t01/02/1980\t7\n', 'Jane Doe\t\t8\n'] * 1000
+    columns, rows = tabular.profile_table(lines, '\t')
+    assert rows == 2000
+    assert [c.values() for c in columns] == [['Jane Doe', 'John Smith'], ['01/02/1980'], ['7', '8']]
+
+
+def test_scan_table_reports_columns(comprehend_stub):
+    body = 'patient_name,ssn,visit\n' + 'John Smith,123-45-6789,1\n' * 5000
+    pieces = [body.encode('utf-8')]
+    report = app.scan_table(pieces, ',')
+
+    assert report['rows'] == 5000
+    assert report['values_sent'] == 3
+    assert len(comprehend_stub.calls) == 1
+    assert report['columns'] == {
+        'patient_name': {'NAME': {'count': 1, 'score': 0.99}},
+        'ssn': {'SSN': {'count': 1, 'score': 0.99}},
+    }
+
+
+def test_delimiter_for():
+    assert tabular.delimiter_for('a/b.CSV') == ','
+    assert tabular.delimiter_for('a/b.tsv') == '\t'
+    assert tabular.delimiter_for('a/b.txt') is None
@@ -0,0 +1,98 @@
+import io
+
+import numpy
+import pytest
+import tifffile
+
+from dcc_phi_reporter import tiffmeta
+from dcc_phi_reporter.app import S3File, extract_image_description
+
+MY_BUCKET = "my_bucket"
+DESCRIPTION = '<?xml version="1.0"?><OME><Image Name="patient scan"/></OME>'
+
+
+def make_tiff(description=None, bigtiff=False, shape=(64, 64), byteorder='<'):
+    buffer = io.BytesIO()
+    tifffile.imwrite(buffer, numpy.zeros(shape, dtype='uint8'), bigtiff=bigtiff,
+                     byteorder=byteorder, description=description, metadata=None)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize('bigtiff', [False, True])
+@pytest.mark.parametrize('byteorder', ['<', '>'])
+def test_read_image_description(bigtiff, byteorder):
+    fh = make_tiff(DESCRIPTION, bigtiff=bigtiff, byteorder=byteorder)
+    assert tiffmeta.read_image_description(fh) == DESCRIPTION
+
+
+def test_read_inline_and_missing_description():
+    assert tiffmeta.read_image_description(make_tiff('ab')) == 'ab'
+    assert tiffmeta.read_image_description(make_tiff()) == ''
+
+
+def test_not_a_tiff():
+    with pytest.raises(tiffmeta.TiffLayoutError):
+        tiffmeta.read_image_description(io.BytesIO(b'GIF89a' + b'\x00' * 32))
+
+
+def test_extract_from_s3_uses_few_requests(s3_client):
+    s3_client.create_bucket(Bucket=MY_BUCKET)
+    body = make_tiff(DESCRIPTION, shape=(2048, 2048)).getvalue()
+    s3_client.put_object(Bucket=MY_BUCKET, Key='image.ome.tiff', Body=body)
+    fh = S3File(s3_client, MY_BUCKET, 'image.ome.tiff')
+    assert extract_image_description(fh) == DESCRIPTION
+    assert fh.requests <= 3
+
+
+
+def make_slide():
+    """Pyramid with a SubIFD plus a label page, like a whole-slide scan."""
+    buffer = io.BytesIO()
+    with tifffile.TiffWriter(buffer) as tif:
+        tif.write(numpy.zeros((256, 256), 'uint8'), description=DESCRIPTION, subifds=1, metadata=None,
+                  software='scanner 1.0', tile=(64, 64))
+        tif.write(numpy.zeros((128, 128), 'uint8'), subfiletype=1, tile=(64, 64), metadata=None,
+                  software='scanner 1.0', extratags=[(285, 's', 0, 'reduced John Smith', True)])
+        tif.write(numpy.zeros((32, 32), 'uint8'), description='label John Smith 123-45-6789',
+                  software='scanner 1.0', metadata=None, extratags=[(315, 's', 0, 'Dr. Jones', True)])
+    buffer.seek(0)
+    return buffer
+
+
+def test_read_text_tags_walks_every_ifd():
+    tags, ifds = tiffmeta.read_text_tags(make_slide())
+    assert ifds == 3
+    assert [(t.ifd, t.name, t.value) for t in tags if t.name != 'Software'] == [
+        (0, 'ImageDescription', DESCRIPTION),
+        (1, 'ImageDescription', 'label John Smith 123-45-6789'),
+        (1, 'Artist', 'Dr. Jones'),
+        (2, 'PageName', 'reduced John Smith'),
+    ]
+
+
+def test_read_text_tags_undefined_values():
+    buffer = io.BytesIO()
+    tifffile.imwrite(buffer, numpy.zeros((8, 8), 'uint8'), metadata=None, software=False,
+                     extratags=[(65001, 7, 6, b'note\x00\x00', True), (65002, 7, 4, b'\xff\xd8\xff\x00', True)])
+    buffer.seek(0)
+    tags, _ = tiffmeta.read_text_tags(buffer)
+    assert [(t.name, t.value) for t in tags] == [('Tag65001', 'note')]
+
+
+def test_plan_ranges_coalesces_nearby_values():
+    locations = [(100, 10), (0, 50), (60, 10), (10000, 5), (10003, 10)]
+    assert tiffmeta.plan_ranges(locations, gap=20) == [(0, 70), (100, 110), (10000, 10013)]
+    assert tiffmeta.plan_ranges(locations, gap=30) == [(0, 110), (10000, 10013)]
+    assert tiffmeta.plan_ranges(locations, gap=30, max_size=80) == [(0, 70), (100, 110), (10000, 10013)]
+
+
+def test_read_ranges_one_request_per_planned_range(s3_client):
+    s3_client.create_bucket(Bucket=MY_BUCKET)
+    data = bytes(range(256)) * 1024
+    s3_client.put_object(Bucket=MY_BUCKET, Key='blob', Body=data)
+    fh = S3File(s3_client, MY_BUCKET, 'blob')
+    locations = [(10, 5), (300, 20), (1000, 8), (200000, 4)]
+    values = tiffmeta.read_ranges(fh, locations)
+    assert values == {(offset, size): data[offset:offset + size] for offset, size in locations}
+    assert fh.requests == 2